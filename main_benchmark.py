@@ -0,0 +1,140 @@
+import argparse
+import logging
+import logging.config
+import os
+import sys
+
+from benchmark.synthetic_vault_generator import SyntheticVaultGenerator
+from benchmark.vault_benchmark import VaultBenchmark
+
+
+logger = logging.getLogger(__name__)
+
+CACHES_DIRECTORY = "caches"
+
+
+def run(args: argparse.Namespace) -> int:
+    generator = SyntheticVaultGenerator(
+        n_accounts=args.accounts,
+        n_replicas=args.replicas,
+        min_n_fields=args.min_fields,
+        max_n_fields=args.max_fields,
+        seed=args.seed,
+    )
+    vault_directory = args.vault_directory
+    if vault_directory is None:
+        vault_directory = os.path.join(
+            os.path.dirname(__file__),
+            CACHES_DIRECTORY,
+            "benchmark_vault_{}_{}".format(args.accounts, args.replicas),
+        )
+    benchmark = VaultBenchmark(
+        generator=generator,
+        vault_directory=vault_directory,
+        n_samples=args.samples,
+        n_unlock_samples=args.unlock_samples,
+        seed=args.seed,
+    )
+    results = benchmark.run(operations=tuple(args.operations))
+    print(VaultBenchmark.report(results=results))
+    if args.output is not None:
+        VaultBenchmark.save(results=results, file_path=args.output)
+    if args.baseline is not None:
+        return compare_results(
+            baseline=VaultBenchmark.load(file_path=args.baseline),
+            current=results,
+            threshold=args.threshold,
+        )
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    return compare_results(
+        baseline=VaultBenchmark.load(file_path=args.baseline),
+        current=VaultBenchmark.load(file_path=args.current),
+        threshold=args.threshold,
+    )
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> int:
+    table, regressions = VaultBenchmark.compare(
+        baseline=baseline, current=current, threshold=threshold
+    )
+    print(table)
+    if len(regressions) > 0:
+        logger.warning("Slower: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the password vault on synthetic vaults."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Time the operations, generating the vault if needed."
+    )
+    run_parser.add_argument("-n", "--accounts", type=int, default=1000)
+    run_parser.add_argument("-r", "--replicas", type=int, default=1)
+    run_parser.add_argument("--min-fields", type=int, default=2)
+    run_parser.add_argument("--max-fields", type=int, default=10)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--samples",
+        type=int,
+        default=VaultBenchmark.N_SAMPLES,
+        help="Number of timed calls of the per-account operations.",
+    )
+    run_parser.add_argument(
+        "--unlock-samples",
+        type=int,
+        default=VaultBenchmark.N_UNLOCK_SAMPLES,
+    )
+    run_parser.add_argument(
+        "--operations",
+        nargs="+",
+        choices=VaultBenchmark.OPERATIONS,
+        default=list(VaultBenchmark.OPERATIONS),
+    )
+    run_parser.add_argument(
+        "--vault-directory",
+        help=(
+            f"Directory of the synthetic vault. Defaults to one in "
+            f"{CACHES_DIRECTORY}/ per number of accounts and replicas."
+        ),
+    )
+    run_parser.add_argument(
+        "-o", "--output", help="Save the results to a JSON file."
+    )
+    run_parser.add_argument(
+        "--baseline", help="Compare the results with a saved JSON file."
+    )
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+    run_parser.set_defaults(command_function=run)
+
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="Compare two saved results. Exit with 1 if any is slower.",
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change of the median to report, e.g. 0.1 for 10%%.",
+    )
+    compare_parser.set_defaults(command_function=compare)
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+        level=logging.DEBUG if os.environ.get("DEBUG") else logging.INFO,
+    )
+    args = build_parser().parse_args()
+    sys.exit(args.command_function(args))
@@ -0,0 +1,25 @@
+import time
+
+## Taken before any other import, to measure the startup time
+START_TIME = time.perf_counter()
+
+import logging
+import logging.config
+import os
+import sys
+
+from password_vault.password_vault_cli import PasswordVaultCli
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+        level=logging.DEBUG if os.environ.get("DEBUG") else logging.INFO,
+    )
+
+    password_vault_cli = PasswordVaultCli(
+        password_vault_directory=os.path.dirname(__file__),
+        start_time=START_TIME,
+    )
+    sys.exit(password_vault_cli.run(argv=sys.argv[1:]))
@@ -1,18 +1,92 @@
+import time
+
+## Taken before any other import, to measure the startup time
+START_TIME = time.perf_counter()
+
+import argparse
 import logging
 import logging.config
 import os
 
-from password_vault.password_vault_gui import PasswordVaultGui
+from util.startup_profiler import StartupProfiler
+
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PROFILE_FILE_NAME = "startup_profile.jsonl"
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Password vault GUI.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help=(
+            "Log the import times and the time to the first window, and "
+            f"append them to caches/{STARTUP_PROFILE_FILE_NAME}."
+        ),
+    )
+    parser.add_argument(
+        "--profile-fsm",
+        action="store_true",
+        help=(
+            "Log the time spent in each GUI state on exit, and append it to "
+            "caches/fsm_profile.jsonl."
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help=(
+            "Save the time spent in the handler stack as a trace, viewable "
+            "in ui.perfetto.dev or chrome://tracing."
+        ),
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(
         format="%(asctime)s %(levelname)s: %(message)s",
         datefmt="%Y-%m-%dT%H:%M:%S",
         level=logging.DEBUG if os.environ.get("DEBUG") else logging.INFO,
     )
 
+    password_vault_directory = os.path.dirname(__file__)
+    startup_profiler = None
+    on_window_shown = None
+    if args.profile_startup:
+        startup_profiler = StartupProfiler(start_time=START_TIME)
+        startup_profiler.install()
+
+        def on_window_shown():
+            startup_profiler.mark(event="First window")
+            startup_profiler.uninstall()
+            logger.info("Startup profile:\n" + startup_profiler.report())
+            startup_profiler.save(
+                file_path=os.path.join(
+                    password_vault_directory,
+                    PasswordVaultGui.CACHES_DIRECTORY,
+                    STARTUP_PROFILE_FILE_NAME,
+                )
+            )
+
+    ## Imported after the profiler is installed, so that it is profiled
+    from password_vault.password_vault_gui import PasswordVaultGui
+
     password_vault = PasswordVaultGui(
-        password_vault_directory=os.path.dirname(__file__)
+        password_vault_directory=password_vault_directory,
+        on_window_shown=on_window_shown,
+        is_fsm_profiled=args.profile_fsm,
     )
-    password_vault.loop()
+    tracer = None
+    if args.trace is not None:
+        from util.span_tracer import SpanTracer
+
+        tracer = SpanTracer()
+        tracer.start()
+    try:
+        password_vault.loop()
+    finally:
+        if tracer is not None:
+            tracer.stop()
+            tracer.save(file_path=args.trace)
+            logger.info(f"Saved the trace to \"{args.trace}\"")
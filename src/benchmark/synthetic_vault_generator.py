@@ -0,0 +1,217 @@
+from __future__ import annotations
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+
+from password_vault.password_vault import PasswordVault
+
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticVaultGenerator:
+    """
+    Generate vaults of random accounts for benchmarking, reproducibly from a
+    seed. A generated vault is reused when asked for again with the same
+    parameters, as large vaults take long to generate.
+    """
+
+    PARAMETERS_FILE_NAME = "synthetic_vault.json"
+    REPLICA_DIRECTORY_PREFIX = "replica_"
+    WRITE_BATCH_SIZE = 1024
+    NAME_WORDS = (
+        "mail",
+        "bank",
+        "cloud",
+        "shop",
+        "news",
+        "forum",
+        "games",
+        "travel",
+        "music",
+        "photo",
+        "code",
+        "chat",
+    )
+    DOMAINS = ("com", "org", "net", "io", "dev", "co.uk")
+    FIELD_NAMES = (
+        "username",
+        "email",
+        "password",
+        "url",
+        "notes",
+        "totp",
+        "security_question",
+        "security_answer",
+        "pin",
+        "recovery_code",
+    )
+
+    def __init__(
+        self,
+        n_accounts: int,
+        n_replicas: int = 1,
+        min_n_fields: int = 2,
+        max_n_fields: int = 10,
+        seed: int = 0,
+    ):
+        """
+        Parameters
+        ----
+        n_accounts : int
+        n_replicas : int
+        min_n_fields : int
+            Minimum number of fields in an account, besides the fields
+            `PasswordVault` adds to every account.
+        max_n_fields : int
+        seed : int
+        """
+        assert n_accounts > 0 and n_replicas > 0
+        assert 0 <= min_n_fields <= max_n_fields
+        self._parameters = {
+            "n_accounts": n_accounts,
+            "n_replicas": n_replicas,
+            "min_n_fields": min_n_fields,
+            "max_n_fields": max_n_fields,
+            "seed": seed,
+        }
+
+    @property
+    def parameters(self) -> dict:
+        return dict(self._parameters)
+
+    def get_replica_directories(self, directory: str) -> list:
+        return [
+            os.path.join(directory, f"{self.REPLICA_DIRECTORY_PREFIX}{i}")
+            for i in range(self._parameters["n_replicas"])
+        ]
+
+    def generate(self, directory: str, main_password: str) -> list:
+        """
+        Parameters
+        ----
+        directory : str
+            Directory of the vault. A vault of other parameters in it is
+            replaced.
+        main_password : str
+
+        Return
+        ----
+        list: Replica directories of the vault.
+        """
+        replica_directories = self.get_replica_directories(directory=directory)
+        parameters_file_path = os.path.join(
+            directory, self.PARAMETERS_FILE_NAME
+        )
+        if self._read_parameters(file_path=parameters_file_path) == (
+            self._parameters
+        ):
+            logger.info(f"Reuse the synthetic vault in \"{directory}\"")
+            return replica_directories
+        if os.path.isdir(directory) and len(os.listdir(directory)) > 0:
+            self._delete_vault(directory=directory)
+        for replica_directory in replica_directories:
+            os.makedirs(replica_directory, exist_ok=True)
+
+        logger.info(
+            "Generate a synthetic vault of {n_accounts} accounts and "
+            "{n_replicas} replicas".format(**self._parameters)
+        )
+        password_vault = PasswordVault(
+            directories=replica_directories, main_password=main_password
+        )
+        details_batch = []
+        for details in self.iter_accounts():
+            details_batch.append(details)
+            if len(details_batch) >= self.WRITE_BATCH_SIZE:
+                password_vault.update_accounts(details_list=details_batch)
+                details_batch = []
+        if len(details_batch) > 0:
+            password_vault.update_accounts(details_list=details_batch)
+        ## Written last, so that an interrupted generation is not reused
+        self._write_parameters(file_path=parameters_file_path)
+        return replica_directories
+
+    @contextlib.contextmanager
+    def modifying(self, directory: str):
+        """
+        Mark the vault as not reusable while it is modified, in case the
+        modification is interrupted before the vault is restored.
+        """
+        parameters_file_path = os.path.join(
+            directory, self.PARAMETERS_FILE_NAME
+        )
+        os.remove(parameters_file_path)
+        yield
+        self._write_parameters(file_path=parameters_file_path)
+
+    def iter_accounts(self):
+        rng = random.Random(self._parameters["seed"])
+        for i in range(self._parameters["n_accounts"]):
+            yield self._generate_account(rng=rng, index=i)
+
+    def get_account_names(self) -> list:
+        """Names of the generated accounts, in the order of generation."""
+        return [
+            details[PasswordVault.ACCOUNT_NAME_TAG]
+            for details in self.iter_accounts()
+        ]
+
+    def _generate_account(self, rng: random.Random, index: int) -> dict:
+        ## The index keeps the names unique
+        account_name = "{}{}-{}.{}".format(
+            rng.choice(self.NAME_WORDS),
+            rng.choice(self.NAME_WORDS),
+            index,
+            rng.choice(self.DOMAINS),
+        )
+        details = {PasswordVault.ACCOUNT_NAME_TAG: account_name}
+        n_fields = rng.randint(
+            self._parameters["min_n_fields"], self._parameters["max_n_fields"]
+        )
+        for j in range(n_fields):
+            field_name = self.FIELD_NAMES[j % len(self.FIELD_NAMES)]
+            if j >= len(self.FIELD_NAMES):
+                field_name += f"_{j // len(self.FIELD_NAMES)}"
+            details[field_name] = "".join(
+                rng.choices(
+                    "abcdefghijklmnopqrstuvwxyz0123456789",
+                    k=rng.randint(8, 64),
+                )
+            )
+        return details
+
+    def _write_parameters(self, file_path: str):
+        with open(file_path, "w") as f:
+            json.dump(self._parameters, f, indent=4)
+
+    @classmethod
+    def _read_parameters(cls, file_path: str) -> dict | None:
+        try:
+            with open(file_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @classmethod
+    def _delete_vault(cls, directory: str):
+        """
+        Delete a synthetic vault, refusing to touch a directory which does
+        not look like one.
+        """
+        for entry in os.listdir(directory):
+            if entry != cls.PARAMETERS_FILE_NAME and not entry.startswith(
+                cls.REPLICA_DIRECTORY_PREFIX
+            ):
+                raise ValueError(
+                    f"\"{directory}\" is not a synthetic vault directory"
+                )
+        for entry in os.listdir(directory):
+            entry_path = os.path.join(directory, entry)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path)
+            else:
+                os.remove(entry_path)
@@ -0,0 +1,322 @@
+from __future__ import annotations
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+from benchmark.synthetic_vault_generator import SyntheticVaultGenerator
+from password_vault.password_vault import PasswordVault
+
+
+logger = logging.getLogger(__name__)
+
+
+class VaultBenchmark:
+    """
+    Time the operations of `PasswordVault` on a synthetic vault.
+
+    Every operation leaves the vault as it was: deleted accounts are added
+    back, and the password is changed back, outside of the timing.
+    """
+
+    RESULTS_VERSION = 1
+    MAIN_PASSWORD = "benchmark main password"
+    NEW_MAIN_PASSWORD = "benchmark new main password"
+    OPERATIONS = (
+        "unlock",
+        "search_per_keystroke",
+        "get_account",
+        "update_account",
+        "delete_account",
+        "change_password",
+        "create_archive",
+    )
+    N_SAMPLES = 100
+    N_UNLOCK_SAMPLES = 3
+    N_SEARCH_QUERIES = 10
+    SEARCH_N_CANDIDATES = 64
+
+    def __init__(
+        self,
+        generator: SyntheticVaultGenerator,
+        vault_directory: str,
+        n_samples: int = N_SAMPLES,
+        n_unlock_samples: int = N_UNLOCK_SAMPLES,
+        seed: int = 0,
+    ):
+        """
+        Parameters
+        ----
+        generator : SyntheticVaultGenerator
+        vault_directory : str
+            Directory of the synthetic vault, reused across runs of the same
+            generator parameters.
+        n_samples : int
+            Number of timed calls of the per-account operations.
+        n_unlock_samples : int
+            Number of timed unlocks. The password change and the archiving
+            are timed once, as they process the whole vault.
+        seed : int
+            Seed of the choice of the accounts to operate on.
+        """
+        self._generator = generator
+        self._vault_directory = vault_directory
+        self._n_samples = n_samples
+        self._n_unlock_samples = n_unlock_samples
+        self._rng = random.Random(seed)
+        self._directories = []
+        self._account_names = []
+        self._password_vault = None
+
+    def run(self, operations: tuple = OPERATIONS) -> dict:
+        """
+        Return
+        ----
+        dict: Machine-readable results, which can be saved as JSON and
+            compared by `compare`.
+        """
+        unknown_operations = set(operations) - set(self.OPERATIONS)
+        if len(unknown_operations) > 0:
+            raise ValueError(f"Unknown operations: {unknown_operations}")
+        start_time = time.perf_counter()
+        self._directories = self._generator.generate(
+            directory=self._vault_directory, main_password=self.MAIN_PASSWORD
+        )
+        generation_time = time.perf_counter() - start_time
+        self._account_names = self._generator.get_account_names()
+        self._password_vault = PasswordVault(
+            directories=self._directories, main_password=self.MAIN_PASSWORD
+        )
+        results = {}
+        with self._generator.modifying(directory=self._vault_directory):
+            for operation in operations:
+                logger.info(f"Benchmark \"{operation}\"")
+                latencies = getattr(self, f"_benchmark_{operation}")()
+                results[operation] = self._get_statistics(latencies=latencies)
+        return {
+            "version": self.RESULTS_VERSION,
+            "created": datetime.datetime.now(
+                tz=datetime.timezone.utc
+            ).isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "n_cpus": os.cpu_count(),
+            },
+            "parameters": self._generator.parameters
+            | {
+                "n_samples": self._n_samples,
+                "n_unlock_samples": self._n_unlock_samples,
+            },
+            "generation_s": round(generation_time, 3),
+            "results": results,
+        }
+
+    @classmethod
+    def save(cls, results: dict, file_path: str):
+        with open(file_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+    @classmethod
+    def load(cls, file_path: str) -> dict:
+        with open(file_path, "r") as f:
+            results = json.load(f)
+        if results.get("version") != cls.RESULTS_VERSION:
+            raise ValueError(
+                f"Cannot read benchmark results v{results.get('version')}"
+            )
+        return results
+
+    @classmethod
+    def compare(
+        cls, baseline: dict, current: dict, threshold: float = 0.1
+    ) -> tuple[str, list]:
+        """
+        Compare the median latencies of two results.
+
+        Parameters
+        ----
+        baseline : dict
+        current : dict
+        threshold : float
+            Relative change of the median below which an operation is
+            reported as unchanged.
+
+        Return
+        ----
+        str: Table of the comparison.
+        list: Operations which are slower by more than the threshold.
+        """
+        if baseline["parameters"] != current["parameters"]:
+            logger.warning(
+                "Results are of different parameters: {} and {}".format(
+                    baseline["parameters"], current["parameters"]
+                )
+            )
+        lines = [
+            f"{'baseline [ms]':>14} | {'current [ms]':>13} | {'change':>8} | "
+            "operation"
+        ]
+        regressions = []
+        for operation, current_stats in current["results"].items():
+            baseline_stats = baseline["results"].get(operation, None)
+            if baseline_stats is None:
+                continue
+            baseline_median = baseline_stats["median_ms"]
+            current_median = current_stats["median_ms"]
+            change = (
+                0.0
+                if baseline_median == 0
+                else current_median / baseline_median - 1
+            )
+            verdict = ""
+            if change > threshold:
+                verdict = " (slower)"
+                regressions.append(operation)
+            elif change < -threshold:
+                verdict = " (faster)"
+            lines.append(
+                f"{baseline_median:>14.3f} | {current_median:>13.3f} | "
+                f"{change * 100:>+7.1f}% | {operation}{verdict}"
+            )
+        return "\n".join(lines), regressions
+
+    @classmethod
+    def report(cls, results: dict) -> str:
+        lines = [
+            f"{'median [ms]':>12} | {'p95 [ms]':>10} | {'max [ms]':>10} | "
+            f"{'n':>5} | operation"
+        ]
+        for operation, stats in results["results"].items():
+            lines.append(
+                f"{stats['median_ms']:>12.3f} | {stats['p95_ms']:>10.3f} | "
+                f"{stats['max_ms']:>10.3f} | {stats['n_samples']:>5} | "
+                f"{operation}"
+            )
+        return "\n".join(lines)
+
+    def _benchmark_unlock(self) -> list:
+        return [
+            self._time(
+                lambda: PasswordVault(
+                    directories=self._directories,
+                    main_password=self.MAIN_PASSWORD,
+                )
+            )
+            for _ in range(self._n_unlock_samples)
+        ]
+
+    def _benchmark_search_per_keystroke(self) -> list:
+        """Search every prefix of account names, as if they were typed."""
+        latencies = []
+        for account_name in self._sample_account_names(
+            n=self.N_SEARCH_QUERIES
+        ):
+            for i in range(1, len(account_name) + 1):
+                latencies.append(
+                    self._time(
+                        lambda: self._password_vault.search_account_name(
+                            account_name=account_name[:i],
+                            n_candidates=self.SEARCH_N_CANDIDATES,
+                        )
+                    )
+                )
+        return latencies
+
+    def _benchmark_get_account(self) -> list:
+        return [
+            self._time(
+                lambda: self._password_vault.get_account(
+                    account_name=account_name
+                )
+            )
+            for account_name in self._sample_account_names(n=self._n_samples)
+        ]
+
+    def _benchmark_update_account(self) -> list:
+        latencies = []
+        for account_name in self._sample_account_names(n=self._n_samples):
+            details = self._password_vault.get_account(
+                account_name=account_name
+            )
+            latencies.append(
+                self._time(
+                    lambda: self._password_vault.update_account(
+                        details=details
+                    )
+                )
+            )
+        return latencies
+
+    def _benchmark_delete_account(self) -> list:
+        latencies = []
+        for account_name in self._sample_account_names(n=self._n_samples):
+            details = self._password_vault.get_account(
+                account_name=account_name
+            )
+            latencies.append(
+                self._time(
+                    lambda: self._password_vault.delete_account(
+                        account_name=account_name
+                    )
+                )
+            )
+            self._password_vault.update_account(details=details)
+        return latencies
+
+    def _benchmark_change_password(self) -> list:
+        latency = self._time(
+            lambda: self._password_vault.change_password(
+                new_main_password=self.NEW_MAIN_PASSWORD
+            )
+        )
+        self._password_vault.change_password(
+            new_main_password=self.MAIN_PASSWORD
+        )
+        return [latency]
+
+    def _benchmark_create_archive(self) -> list:
+        with tempfile.TemporaryDirectory() as archive_directory:
+            return [
+                self._time(
+                    lambda: self._password_vault.create_archive(
+                        archive_file_path=os.path.join(
+                            archive_directory, "benchmark.zip"
+                        )
+                    )
+                )
+            ]
+
+    def _sample_account_names(self, n: int) -> list:
+        return self._rng.sample(
+            self._account_names, k=min(n, len(self._account_names))
+        )
+
+    @classmethod
+    def _time(cls, function: Callable) -> float:
+        start_time = time.perf_counter()
+        function()
+        return time.perf_counter() - start_time
+
+    @classmethod
+    def _get_statistics(cls, latencies: list) -> dict:
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        p95_index = min(
+            len(latencies_ms) - 1, int(round(0.95 * (len(latencies_ms) - 1)))
+        )
+        return {
+            "n_samples": len(latencies_ms),
+            "mean_ms": round(statistics.fmean(latencies_ms), 3),
+            "median_ms": round(statistics.median(latencies_ms), 3),
+            "p95_ms": round(latencies_ms[p95_index], 3),
+            "min_ms": round(latencies_ms[0], 3),
+            "max_ms": round(latencies_ms[-1], 3),
+            "total_ms": round(sum(latencies_ms), 3),
+        }
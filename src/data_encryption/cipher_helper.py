@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from Crypto.Cipher import ChaCha20
 
+from util.span_tracer import traced
+
 
 class CipherHelper:
     KEY_NUM_BYTES = 32
@@ -29,6 +31,7 @@ class CipherHelper:
         return plaintext
 
     @classmethod
+    @traced
     def encrypt_and_pack(
         cls, data: bytes, key: bytes, nonce: bytes | int
     ) -> bytes:
@@ -42,6 +45,7 @@ class CipherHelper:
         )
 
     @classmethod
+    @traced
     def unpack_and_decrypt(cls, packed_data: bytes, key: bytes):
         nonce, ciphertext = cls._unpack_data(packed_data)
         decrypted_data = cls.decrypt(
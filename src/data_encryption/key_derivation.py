@@ -0,0 +1,178 @@
+from __future__ import annotations
+import dataclasses
+import hashlib
+import hmac
+import json
+import math
+import secrets
+import time
+
+from data_encryption.cipher_helper import CipherHelper
+
+
+@dataclasses.dataclass(frozen=True)
+class KdfParameters:
+    ALGORITHM = "scrypt"
+    salt: bytes
+    ## CPU and memory cost, a power of 2
+    n: int
+    ## Block size
+    r: int
+    ## Parallelization
+    p: int
+
+    @property
+    def memory_size(self) -> int:
+        """Bytes of memory used by a derivation."""
+        return 128 * self.r * self.n
+
+    def with_new_salt(self) -> KdfParameters:
+        return dataclasses.replace(self, salt=KeyDerivation.generate_salt())
+
+
+class KeyDerivation:
+    """
+    Derive keys from the main password with scrypt, whose cost is
+    calibrated to a target time on the current machine.
+
+    The derived key does not encrypt the data. It wraps the key of the
+    vault, which is random, in a record stored with the parameters. The
+    cost can then be changed by wrapping the same key again, without
+    re-encrypting the data.
+    """
+
+    VERSION = 1
+    SALT_NUM_BYTES = 16
+    KEY_CHECK_PREFIX = b"key_check"
+    KEY_CHECK_NUM_BYTES = 16
+    DEFAULT_TARGET_TIME = 0.3
+    R = 8
+    P = 1
+    MIN_LOG2_N = 14
+    ## 1 GiB of memory with r = 8
+    MAX_LOG2_N = 20
+
+    @classmethod
+    def generate_salt(cls) -> bytes:
+        return secrets.token_bytes(cls.SALT_NUM_BYTES)
+
+    @classmethod
+    def generate_key(cls) -> bytes:
+        return secrets.token_bytes(CipherHelper.KEY_NUM_BYTES)
+
+    @classmethod
+    def derive_key(cls, password: str, parameters: KdfParameters) -> bytes:
+        return hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=parameters.salt,
+            n=parameters.n,
+            r=parameters.r,
+            p=parameters.p,
+            maxmem=2 * parameters.memory_size,
+            dklen=CipherHelper.KEY_NUM_BYTES,
+        )
+
+    @classmethod
+    def calibrate(
+        cls, target_time: float = DEFAULT_TARGET_TIME
+    ) -> KdfParameters:
+        """
+        Return the parameters of the highest cost whose derivation takes at
+        most `target_time` seconds on this machine, or the minimum cost.
+        """
+        parameters = KdfParameters(
+            salt=cls.generate_salt(), n=2**cls.MIN_LOG2_N, r=cls.R, p=cls.P
+        )
+        elapsed_time = cls._time_derivation(parameters=parameters)
+        ## The time is about proportional to n
+        log2_n = cls.MIN_LOG2_N + math.floor(
+            math.log2(max(target_time / elapsed_time, 1.0))
+        )
+        log2_n = min(log2_n, cls.MAX_LOG2_N)
+        while log2_n > cls.MIN_LOG2_N:
+            parameters = dataclasses.replace(parameters, n=2**log2_n)
+            if cls._time_derivation(parameters=parameters) <= target_time:
+                break
+            log2_n -= 1
+        return dataclasses.replace(parameters, n=2**log2_n)
+
+    @classmethod
+    def wrap_key(
+        cls, key: bytes, password: str, parameters: KdfParameters
+    ) -> bytes:
+        """
+        Return
+        ----
+        bytes: Record of the parameters and the key encrypted by the key
+            derived from the password.
+        """
+        password_key = cls.derive_key(password=password, parameters=parameters)
+        wrapped_key = CipherHelper.encrypt_and_pack(
+            data=key,
+            key=password_key,
+            nonce=secrets.token_bytes(CipherHelper.NONCE_NUM_BYTES),
+        )
+        return json.dumps(
+            {
+                "version": cls.VERSION,
+                "algorithm": KdfParameters.ALGORITHM,
+                "salt": parameters.salt.hex(),
+                "n": parameters.n,
+                "r": parameters.r,
+                "p": parameters.p,
+                "key_check": cls._get_key_check(password_key).hex(),
+                "wrapped_key": wrapped_key.hex(),
+            }
+        ).encode("utf-8")
+
+    @classmethod
+    def unwrap_key(
+        cls, record: bytes, password: str
+    ) -> tuple[bytes, KdfParameters]:
+        """
+        Return
+        ----
+        bytes: the key wrapped in the record
+        KdfParameters: parameters of the record
+
+        Raise
+        ----
+        ValueError: if the password is incorrect, or the record is invalid
+        """
+        record_dict = json.loads(record.decode("utf-8"))
+        if record_dict.get("version") != cls.VERSION:
+            raise ValueError(
+                f"Cannot read key derivation v{record_dict.get('version')}."
+            )
+        if record_dict.get("algorithm") != KdfParameters.ALGORITHM:
+            raise ValueError(
+                f"Unknown key derivation \"{record_dict.get('algorithm')}\"."
+            )
+        parameters = KdfParameters(
+            salt=bytes.fromhex(record_dict["salt"]),
+            n=record_dict["n"],
+            r=record_dict["r"],
+            p=record_dict["p"],
+        )
+        password_key = cls.derive_key(password=password, parameters=parameters)
+        if not hmac.compare_digest(
+            cls._get_key_check(password_key),
+            bytes.fromhex(record_dict["key_check"]),
+        ):
+            raise ValueError("Main password is incorrect.")
+        key = CipherHelper.unpack_and_decrypt(
+            packed_data=bytes.fromhex(record_dict["wrapped_key"]),
+            key=password_key,
+        )
+        return key, parameters
+
+    @classmethod
+    def _get_key_check(cls, password_key: bytes) -> bytes:
+        check = hmac.digest(password_key, cls.KEY_CHECK_PREFIX, hashlib.sha256)
+        return check[: cls.KEY_CHECK_NUM_BYTES]
+
+    @classmethod
+    def _time_derivation(cls, parameters: KdfParameters) -> float:
+        start_time = time.perf_counter()
+        cls.derive_key(password="calibration", parameters=parameters)
+        return time.perf_counter() - start_time
@@ -0,0 +1,431 @@
+from __future__ import annotations
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import queue
+import threading
+from typing import Iterator, Optional, TYPE_CHECKING
+import zipfile
+
+from data_encryption.cipher_helper import CipherHelper
+from file_manipulation.directory_handler_with_encryption import (
+    DirectoryHandlerWithEncryption,
+    DirectoryInfo,
+)
+
+
+if TYPE_CHECKING:
+    from util.operation_progress import OperationProgress
+
+
+class DirectoryArchiver:
+    """
+    Create zip archives of an encrypted directory.
+
+    Records are already encrypted, so they are stored without compression and
+    streamed from disk into the archive. Only the small metadata members
+    (hashes, directory info and the manifest) are deflated.
+
+    Every archive carries a manifest listing the hash of every record in the
+    directory at the time of archiving. An incremental archive only contains
+    the records whose hash differs from the manifest of its base archive.
+    Records are archived under their file names, whatever the layout of the
+    directory, so an extracted archive is a directory of the flat layout.
+    The metadata of the sharded layout is therefore not archived.
+    """
+
+    MANIFEST_FILE_NAME = "archive_manifest.json"
+    MANIFEST_VERSION = 1
+    PARTIAL_FILE_SUFFIX = ".partial"
+    READ_AHEAD_QUEUE_SIZE = 32
+    STRING_ENCODING = "utf-8"
+
+    @classmethod
+    def create_archive(
+        cls,
+        directory_handler: DirectoryHandlerWithEncryption,
+        archive_file_path: str,
+        base_archive_file_path: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ):
+        """
+        Parameters
+        ----
+        directory_handler : DirectoryHandlerWithEncryption
+            Handler of the directory to be archived.
+        archive_file_path : str
+            Path of the zip file to be created.
+        base_archive_file_path : str | None
+            Path of a previous archive of the same directory. If given, and
+            the archive was encrypted with the same key, only records changed
+            since that archive are stored. It must be in the directory of the
+            archive, where it is looked up on verification and restore.
+        progress : OperationProgress | None
+            Reports the records archived, and cancels archiving. A cancelled
+            archive is not created.
+
+        Raise
+        ----
+        ValueError: if the base archive is not in the directory of the archive
+        """
+        assert archive_file_path.endswith(".zip")
+        if base_archive_file_path is not None and os.path.dirname(
+            os.path.abspath(base_archive_file_path)
+        ) != os.path.dirname(os.path.abspath(archive_file_path)):
+            raise ValueError(
+                f"Base archive \"{base_archive_file_path}\" is not in the "
+                "directory of the archive"
+            )
+        ## Held for the whole pass, so that the archive has the records and
+        ## hashes of one state of the directory, while writers wait
+        with directory_handler.shared_lock():
+            records_hash = {
+                file_name: directory_handler.get_file_hash(
+                    file_name=file_name
+                ).hex()
+                for file_name in directory_handler.get_all_files_name()
+            }
+            base_manifest = None
+            if base_archive_file_path is not None:
+                base_manifest = cls.read_manifest(
+                    archive_file_path=base_archive_file_path
+                )
+                if base_manifest["key_id"] != directory_handler.key_id.hex():
+                    ## Case: key changed since the base archive. Records in
+                    ## the base archive cannot be decrypted with the current
+                    ## key.
+                    base_manifest = None
+            if base_manifest is None:
+                included_files_name = sorted(records_hash)
+            else:
+                base_records_hash = base_manifest["records"]
+                included_files_name = sorted(
+                    file_name
+                    for file_name, file_hash in records_hash.items()
+                    if base_records_hash.get(file_name) != file_hash
+                )
+            manifest = {
+                "version": cls.MANIFEST_VERSION,
+                "created": datetime.datetime.now(
+                    tz=datetime.timezone.utc
+                ).isoformat(),
+                "key_id": directory_handler.key_id.hex(),
+                "base_archive": (
+                    None
+                    if base_manifest is None
+                    else os.path.basename(base_archive_file_path)
+                ),
+                "records": records_hash,
+                "included": included_files_name,
+            }
+
+            partial_file_path = archive_file_path + cls.PARTIAL_FILE_SUFFIX
+            if progress is not None:
+                progress.start_stage(
+                    stage="Archiving", n_items_total=len(included_files_name)
+                )
+            try:
+                cls._write_archive(
+                    directory_handler=directory_handler,
+                    partial_file_path=partial_file_path,
+                    included_files_name=included_files_name,
+                    manifest=manifest,
+                    progress=progress,
+                )
+            except BaseException:
+                ## Case: cancelled, or failed, such as on a full disk
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(partial_file_path)
+                raise
+            os.replace(partial_file_path, archive_file_path)
+
+    @classmethod
+    def _write_archive(
+        cls,
+        directory_handler: DirectoryHandlerWithEncryption,
+        partial_file_path: str,
+        included_files_name: list,
+        manifest: dict,
+        progress: Optional[OperationProgress],
+    ):
+        directory = directory_handler.directory
+        with zipfile.ZipFile(partial_file_path, "w") as archive:
+            metadata_directory = os.path.join(
+                directory, directory_handler.METADATA_SUBDIRECTORY
+            )
+            excluded_files_name = cls._get_excluded_metadata(
+                directory_handler=directory_handler
+            )
+            for file_name in sorted(os.listdir(metadata_directory)):
+                file_path = os.path.join(metadata_directory, file_name)
+                if (
+                    not os.path.isfile(file_path)
+                    or file_name in excluded_files_name
+                ):
+                    ## Case: outbound queues, the lock of the processes
+                    ## using the directory, or the sharded layout
+                    continue
+                archive.write(
+                    filename=file_path,
+                    arcname=cls._get_metadata_arcname(
+                        directory_handler=directory_handler,
+                        file_name=file_name,
+                    ),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+            for file_name in included_files_name:
+                if progress is not None:
+                    progress.check_cancelled()
+                archive.write(
+                    filename=directory_handler.get_hash_file_path(
+                        file_name=file_name
+                    ),
+                    arcname=cls._get_hash_arcname(
+                        directory_handler=directory_handler,
+                        file_name=file_name,
+                    ),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+                file_path = directory_handler.get_file_path(
+                    file_name=file_name
+                )
+                archive.write(
+                    filename=file_path,
+                    arcname=file_name,
+                    compress_type=zipfile.ZIP_STORED,
+                )
+                if progress is not None:
+                    progress.advance(n_bytes=os.path.getsize(file_path))
+            archive.writestr(
+                cls.MANIFEST_FILE_NAME,
+                json.dumps(manifest, indent=1).encode(cls.STRING_ENCODING),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+
+    @classmethod
+    def read_manifest(cls, archive_file_path: str) -> dict:
+        with zipfile.ZipFile(archive_file_path, "r") as archive:
+            try:
+                manifest_bytes = archive.read(cls.MANIFEST_FILE_NAME)
+            except KeyError:
+                raise ValueError(
+                    f"Archive \"{archive_file_path}\" has no manifest"
+                )
+        manifest = json.loads(manifest_bytes.decode(cls.STRING_ENCODING))
+        if manifest.get("version") != cls.MANIFEST_VERSION:
+            raise NotImplementedError(
+                f"Cannot read archive manifest v{manifest.get('version')}."
+            )
+        return manifest
+
+    @classmethod
+    def read_metadata(cls, archive_file_path: str, file_name: str) -> bytes:
+        with zipfile.ZipFile(archive_file_path, "r") as archive:
+            return archive.read(
+                f"{DirectoryHandlerWithEncryption.METADATA_SUBDIRECTORY}/"
+                f"{file_name}"
+            )
+
+    @classmethod
+    def get_archive_chain(cls, archive_file_path: str) -> list:
+        """
+        Return
+        ----
+        list: Paths of the archive and its base archives, newest first. Base
+            archives are looked up in the directory of the given archive.
+        """
+        archive_directory = os.path.dirname(archive_file_path)
+        chain = [archive_file_path]
+        base_archive = cls.read_manifest(archive_file_path)["base_archive"]
+        while base_archive is not None:
+            base_archive_file_path = os.path.join(
+                archive_directory, base_archive
+            )
+            if not os.path.isfile(base_archive_file_path):
+                raise FileNotFoundError(
+                    f"Base archive \"{base_archive_file_path}\" is not found"
+                )
+            chain.append(base_archive_file_path)
+            base_archive = cls.read_manifest(base_archive_file_path)[
+                "base_archive"
+            ]
+        return chain
+
+    @classmethod
+    def iter_records(
+        cls,
+        archive_file_path: str,
+        key: bytes,
+        progress: Optional[OperationProgress] = None,
+    ) -> Iterator[tuple[str, bytes | None]]:
+        """
+        Stream the decrypted records of an archive and its base archives.
+
+        Records are read from the archives by a background thread into a
+        bounded queue, while the caller decrypts and verifies them. Memory
+        use is therefore bounded by the queue size, regardless of the size of
+        the archive.
+
+        Parameters
+        ----
+        archive_file_path : str
+            Path of the newest archive of the chain.
+        key : bytes
+            Key of the archived directory.
+        progress : OperationProgress | None
+            Reports the records read, and cancels reading between records.
+
+        Yield
+        ----
+        str: file name
+        bytes | None: decrypted data, or None if the record is corrupted
+        """
+        chain = cls.get_archive_chain(archive_file_path=archive_file_path)
+        manifest = cls.read_manifest(archive_file_path=archive_file_path)
+        cls._check_key(archive_file_path=archive_file_path, key=key)
+        records_hash = manifest["records"]
+        ## Assign each record to the newest archive which contains it
+        records_source = {}
+        for chain_archive_file_path in chain:
+            chain_manifest = cls.read_manifest(chain_archive_file_path)
+            for file_name in chain_manifest["included"]:
+                if file_name in records_hash:
+                    records_source.setdefault(
+                        file_name, chain_archive_file_path
+                    )
+        read_ahead_queue = queue.Queue(maxsize=cls.READ_AHEAD_QUEUE_SIZE)
+        is_stopped = threading.Event()
+        sentinel = object()
+
+        def put(item) -> bool:
+            while not is_stopped.is_set():
+                try:
+                    read_ahead_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_records():
+            try:
+                for chain_archive_file_path in chain:
+                    with zipfile.ZipFile(chain_archive_file_path) as archive:
+                        for file_name, source in records_source.items():
+                            if source != chain_archive_file_path:
+                                continue
+                            if not put((file_name, archive.read(file_name))):
+                                return
+                for file_name in records_hash:
+                    if file_name not in records_source:
+                        ## Case: record is listed but absent from the chain
+                        if not put((file_name, None)):
+                            return
+            except Exception as e:
+                put(e)
+            finally:
+                put(sentinel)
+
+        if progress is not None:
+            progress.start_stage(
+                stage="Reading archive", n_items_total=len(records_hash)
+            )
+        reader = threading.Thread(target=read_records, daemon=True)
+        reader.start()
+        try:
+            while True:
+                if progress is not None:
+                    progress.check_cancelled()
+                item = read_ahead_queue.get()
+                if item is sentinel:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                file_name, data_encrypted = item
+                data = None
+                if data_encrypted is not None:
+                    data = CipherHelper.unpack_and_decrypt(
+                        packed_data=data_encrypted, key=key
+                    )
+                    if (
+                        hashlib.sha256(data).hexdigest()
+                        != records_hash[file_name]
+                    ):
+                        data = None
+                if progress is not None:
+                    progress.advance(
+                        n_bytes=(
+                            0
+                            if data_encrypted is None
+                            else len(data_encrypted)
+                        )
+                    )
+                yield file_name, data
+        finally:
+            is_stopped.set()
+            reader.join()
+
+    @classmethod
+    def verify_archive(
+        cls,
+        archive_file_path: str,
+        key: bytes,
+        progress: Optional[OperationProgress] = None,
+    ) -> list:
+        """
+        Return
+        ----
+        list: Names of the records which are missing or corrupted.
+        """
+        return [
+            file_name
+            for file_name, data in cls.iter_records(
+                archive_file_path=archive_file_path,
+                key=key,
+                progress=progress,
+            )
+            if data is None
+        ]
+
+    @classmethod
+    def _check_key(cls, archive_file_path: str, key: bytes):
+        info_encrypted = cls.read_metadata(
+            archive_file_path=archive_file_path,
+            file_name=DirectoryHandlerWithEncryption.DIRECTORY_INFO_FILE_NAME,
+        )
+        info_bytes = CipherHelper.unpack_and_decrypt(
+            packed_data=info_encrypted, key=key
+        )
+        try:
+            DirectoryInfo.deserialized(data=info_bytes)
+        except ValueError:
+            raise ValueError(
+                f"Key is incorrect, or archive \"{archive_file_path}\" is "
+                "corrupted."
+            )
+
+    @classmethod
+    def _get_excluded_metadata(
+        cls, directory_handler: DirectoryHandlerWithEncryption
+    ) -> tuple:
+        return (
+            directory_handler.LOCK_FILE_NAME,
+            directory_handler.INDEX_FILE_NAME,
+            directory_handler.LAYOUT_FILE_NAME,
+        )
+
+    @classmethod
+    def _get_metadata_arcname(
+        cls, directory_handler: DirectoryHandlerWithEncryption, file_name: str
+    ) -> str:
+        return f"{directory_handler.METADATA_SUBDIRECTORY}/{file_name}"
+
+    @classmethod
+    def _get_hash_arcname(
+        cls, directory_handler: DirectoryHandlerWithEncryption, file_name: str
+    ) -> str:
+        return (
+            f"{directory_handler.HASHES_SUBDIRECTORY}/"
+            f"{file_name}.{directory_handler.HASH_FILE_EXTENSION}"
+        )
@@ -1,26 +1,55 @@
-import copy
+import contextlib
 import json
 import math
 import os
+from typing import Iterable, Iterator, Optional
 
-from rapidfuzz import fuzz
+from file_manipulation.directory_lock import DirectoryLock
+from file_manipulation.file_inventory import FileInventory
+from util.io_stats import IoStats
+from util.span_tracer import traced
 
 
 class DirectoryHandler:
     METADATA_SUBDIRECTORY = ".metadata"
+    LOCK_FILE_NAME = "lock"
 
-    def __init__(self, directory: str):
+    def __init__(
+        self,
+        directory: str,
+        io_stats: Optional[IoStats] = None,
+        inventory: Optional[FileInventory] = None,
+    ):
+        """
+        Parameters
+        ----
+        directory : str
+        io_stats : IoStats | None
+            Counters of the I/O, shared by the handlers of a vault. A new one
+            is created if None.
+        inventory : FileInventory | None
+            Names of the files, shared by the replicas of a vault. A new one
+            is created if None.
+        """
         self._directory = directory
+        self._io_stats = IoStats() if io_stats is None else io_stats
         os.makedirs(self._directory, exist_ok=True)
         os.makedirs(
             os.path.join(self._directory, self.METADATA_SUBDIRECTORY),
             exist_ok=True,
         )
-        self._files = set(
-            f
-            for f in os.listdir(self._directory)
-            if os.path.isfile(os.path.join(self._directory, f))
+        self._directory_lock = DirectoryLock(
+            file_path=os.path.join(
+                self._directory,
+                self.METADATA_SUBDIRECTORY,
+                self.LOCK_FILE_NAME,
+            )
         )
+        self._files = (
+            FileInventory() if inventory is None else inventory
+        ).add_replica()
+        with self._directory_lock.shared():
+            self._files.update(self._list_files())
 
     def __repr__(self) -> str:
         return f"{type(self).__name__}({json.dumps(self.__dict__)})"
@@ -32,58 +61,160 @@ class DirectoryHandler:
     def directory(self) -> str:
         return self._directory
 
+    @property
+    def io_stats(self) -> IoStats:
+        return self._io_stats
+
+    @property
+    def replica_index(self) -> int:
+        """Index of the bit of this directory in the bitmaps of `inventory`."""
+        return self._files.replica_index
+
     def file_exists(self, file_name: str) -> bool:
-        return file_name in self._files
+        with self.shared_lock():
+            return file_name in self._files
+
+    @contextlib.contextmanager
+    def shared_lock(self):
+        """
+        Hold the directory against writers of this and other processes,
+        while other readers go on. See `DirectoryLock`.
+        """
+        with self._directory_lock.shared() as is_acquired:
+            if is_acquired:
+                self._refresh(is_exclusive=False)
+            yield
+
+    @contextlib.contextmanager
+    def exclusive_lock(self):
+        """
+        Hold the directory against all other readers and writers of this and
+        other processes. See `DirectoryLock`.
+        """
+        with self._directory_lock.exclusive() as is_acquired:
+            if is_acquired:
+                self._refresh(is_exclusive=True)
+            yield
 
+    def get_file_modification_time_ns(self, file_name: str) -> int:
+        """
+        Raise
+        ----
+        FileNotFoundError: if the file does not exist
+        """
+        with self.shared_lock():
+            self._ensure_file_exists(file_name)
+            return os.stat(self.get_file_path(file_name=file_name)).st_mtime_ns
+
+    def get_file_path(self, file_name: str) -> str:
+        return os.path.join(
+            self._directory,
+            self._get_relative_path(
+                storage_name=self._get_storage_name(file_name=file_name)
+            ),
+        )
+
+    @traced
     def write_to_file(self, file_name: str, data: bytes):
-        self._files.add(file_name)
-        with open(os.path.join(self._directory, file_name), "wb") as f:
-            f.write(data)
+        with self.exclusive_lock():
+            self._files.add(file_name)
+            self._write_bytes(
+                file_path=self.get_file_path(file_name=file_name), data=data
+            )
+
+    @traced
+    def write_to_files(self, files: dict):
+        """
+        Write several files at once.
 
+        Parameters
+        ----
+        files : dict
+            Mapping from file name to data.
+        """
+        with self.exclusive_lock():
+            for file_name, data in files.items():
+                self._files.add(file_name)
+                self._write_bytes(
+                    file_path=self.get_file_path(file_name=file_name),
+                    data=data,
+                )
+
+    @traced
     def read_from_file(self, file_name: str) -> bytes:
-        self._ensure_file_exists(file_name)
-        with open(os.path.join(self._directory, file_name), "rb") as f:
-            return f.read()
+        with self.shared_lock():
+            self._ensure_file_exists(file_name)
+            return self._read_bytes(
+                file_path=self.get_file_path(file_name=file_name)
+            )
 
+    @traced
     def delete_file(self, file_name: str):
-        self._ensure_file_exists(file_name)
-        fpath = os.path.join(self._directory, file_name)
-        os.remove(fpath)
-        self._files.remove(file_name)
+        with self.exclusive_lock():
+            self._ensure_file_exists(file_name)
+            fpath = self.get_file_path(file_name=file_name)
+            self._remove_file(file_path=fpath)
+            self._files.remove(file_name)
 
-    def get_all_files_name(self) -> set:
-        return copy.deepcopy(self._files)
+    @traced
+    def get_all_files_name(self) -> frozenset:
+        with self.shared_lock():
+            return self._files.snapshot()
 
-    def write_metadata(self, file_name: str, data: bytes):
-        open(
-            os.path.join(
-                self._directory,
-                self.METADATA_SUBDIRECTORY,
-                file_name,
-            ),
-            "wb",
-        ).write(data)
+    def iter_files_name(self) -> Iterator[str]:
+        """Yield the names of the files in the order they are stored."""
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name in self._files:
+                    yield entry.name
 
-    def read_metadata(self, file_name: str) -> bytes | None:
-        try:
-            return open(
-                os.path.join(
+    @traced
+    def write_metadata(self, file_name: str, data: bytes):
+        with self.exclusive_lock():
+            self._write_bytes(
+                file_path=os.path.join(
                     self._directory,
                     self.METADATA_SUBDIRECTORY,
                     file_name,
                 ),
-                "rb",
-            ).read()
-        except FileNotFoundError:
-            return None
+                data=data,
+            )
+
+    @traced
+    def read_metadata(self, file_name: str) -> bytes | None:
+        with self.shared_lock():
+            try:
+                return self._read_bytes(
+                    file_path=os.path.join(
+                        self._directory,
+                        self.METADATA_SUBDIRECTORY,
+                        file_name,
+                    )
+                )
+            except FileNotFoundError:
+                return None
+
+    @traced
+    def delete_metadata(self, file_name: str):
+        file_path = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY, file_name
+        )
+        with self.exclusive_lock():
+            if os.path.isfile(file_path):
+                self._remove_file(file_path=file_path)
 
+    @traced
     def search_file_name(
         self, target_name: str, n_candidates: int = 9
     ) -> list:
-        name_and_score = [
-            (f, fuzz.ratio(target_name, f, processor=str.lower))
-            for f in self._files
-        ]
+        ## Imported on first search, which is the only user of rapidfuzz
+        from rapidfuzz import fuzz
+
+        with self.shared_lock():
+            name_and_score = [
+                (f, fuzz.ratio(target_name, f, processor=str.lower))
+                for f in self._files
+            ]
         name_and_score = [
             i for i in name_and_score if not math.isclose(i[1], 0)
         ]
@@ -98,6 +229,62 @@ class DirectoryHandler:
         candidates.sort(key=lambda x: x[1], reverse=True)
         return [i[0] for i in candidates]
 
+    def _list_files(self) -> Iterable[str]:
+        """Names of the files in the directory, listed on `__init__`."""
+        with os.scandir(self._directory) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+
+    def _refresh(self, is_exclusive: bool) -> bool:
+        """
+        Load the changes committed by other processes, once this process
+        takes the lock of the directory.
+
+        Return
+        ----
+        bool: whether files were added or deleted
+        """
+        return False
+
+    def _get_storage_name(self, file_name: str) -> str:
+        """Name under which a file is stored."""
+        return file_name
+
+    def _get_relative_path(self, storage_name: str) -> str:
+        """Path of a stored file, relative to the directory."""
+        return storage_name
+
     def _ensure_file_exists(self, file_name: str):
-        if not self.file_exists(file_name):
+        ## Called under the lock, so the inventory is refreshed already
+        if file_name not in self._files:
             raise FileNotFoundError(f"File {file_name} does not exist")
+
+    def _read_bytes(self, file_path: str, offset: int = 0) -> bytes:
+        """
+        Read a file of the directory from `offset` to its end, counting it in
+        `io_stats`.
+        """
+        with self._io_stats.timed(directory=self._directory, name="read"):
+            with open(file_path, "rb") as f:
+                if offset > 0:
+                    f.seek(offset)
+                data = f.read()
+        self._io_stats.add(directory=self._directory, name="n_reads")
+        self._io_stats.add(
+            directory=self._directory, name="n_bytes_read", value=len(data)
+        )
+        return data
+
+    def _write_bytes(self, file_path: str, data: bytes, mode: str = "wb"):
+        """Write a file of the directory, counting it in `io_stats`."""
+        with self._io_stats.timed(directory=self._directory, name="write"):
+            with open(file_path, mode) as f:
+                f.write(data)
+        self._io_stats.add(directory=self._directory, name="n_writes")
+        self._io_stats.add(
+            directory=self._directory, name="n_bytes_written", value=len(data)
+        )
+
+    def _remove_file(self, file_path: str):
+        with self._io_stats.timed(directory=self._directory, name="delete"):
+            os.remove(file_path)
+        self._io_stats.add(directory=self._directory, name="n_deletions")
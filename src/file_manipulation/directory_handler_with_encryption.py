@@ -2,12 +2,23 @@ from __future__ import annotations
 import binascii
 import dataclasses
 import datetime
+import hashlib
 import os
+from typing import Iterable, Iterator, Optional, TYPE_CHECKING
 
 from data_encryption.cipher_helper import CipherHelper
 from file_manipulation.directory_handler_with_file_hash import (
     DirectoryHandlerWithFileHash,
 )
+from file_manipulation.directory_watcher import DirectoryWatcher
+from file_manipulation.sharded_index import ShardedIndex
+from util.span_tracer import traced
+
+
+if TYPE_CHECKING:
+    from file_manipulation.file_inventory import FileInventory
+    from util.io_stats import IoStats
+    from util.operation_progress import OperationProgress
 
 
 @dataclasses.dataclass
@@ -78,113 +89,353 @@ class DirectoryInfo:
 class DirectoryHandlerWithEncryption(DirectoryHandlerWithFileHash):
     DIRECTORY_INFO_FILE_NAME = "directory_info"
     FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY = ".files_using_new_key_cache"
+    KEY_ID_PREFIX = b"key_id"
     STRING_ENCODING = "utf-8"
+    LAYOUT_FILE_NAME = "layout"
+    INDEX_FILE_NAME = "index"
+    INDEX_USING_NEW_KEY_FILE_NAME = "index.new_key"
+    ## Files are stored under their names, in the directory itself
+    FLAT_LAYOUT = "flat"
+    ## Files are stored under storage IDs, in subdirectories of the ID
+    ## prefixes. See `ShardedIndex`.
+    SHARDED_LAYOUT = "sharded"
+    ## Records of changes in the index, above which it is compacted
+    INDEX_COMPACTION_N_RECORDS = 1024
 
-    def __init__(self, directory: str, key: bytes):
-        super().__init__(directory=directory)
+    @traced
+    def __init__(
+        self,
+        directory: str,
+        key: bytes,
+        io_stats: Optional[IoStats] = None,
+        inventory: Optional[FileInventory] = None,
+        layout: str = FLAT_LAYOUT,
+    ):
+        """
+        Parameters
+        ----
+        layout : str
+            Layout of a new directory, `FLAT_LAYOUT` or `SHARDED_LAYOUT`. An
+            existing directory keeps its layout, until
+            `migrate_to_sharded_layout`.
+        """
+        assert layout in (self.FLAT_LAYOUT, self.SHARDED_LAYOUT)
+        self._key = key
+        self._layout = self.FLAT_LAYOUT
+        self._new_directory_layout = layout
+        ## Index of the sharded layout, or None for the flat layout
+        self._index: ShardedIndex | None = None
+        ## (inode, number of bytes) of the index when it was last read or
+        ## written by this handler
+        self._index_position = None
+        ## Names added to the index by other processes, whose files are not
+        ## written yet
+        self._pending_files_name = set()
+        self._shard_directories = set()
+        self._watcher: DirectoryWatcher | None = None
+        ## (inode, size, modification time) of the directory info when it
+        ## was last read or written by this handler
+        self._directory_info_signature = None
+        super().__init__(
+            directory=directory, io_stats=io_stats, inventory=inventory
+        )
         os.makedirs(
             os.path.join(
                 self._directory, self.FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY
             ),
             exist_ok=True,
         )
-        self._key = key
-        directory_info_path = os.path.join(
-            self._directory,
-            self.METADATA_SUBDIRECTORY,
-            self.DIRECTORY_INFO_FILE_NAME,
-        )
-        is_directory_info_present = os.path.isfile(directory_info_path)
-        if is_directory_info_present is True:
-            info_encrypted = open(directory_info_path, "rb").read()
-            info_bytes = CipherHelper.unpack_and_decrypt(
-                packed_data=info_encrypted, key=self._key
-            )
-            try:
-                self._directory_info = DirectoryInfo.deserialized(
-                    data=info_bytes
-                )
-            except ValueError:
-                raise ValueError(
-                    f"Key is incorrect, or data is corrupted in directory \"{self._directory}\"."
+        ## Other processes wait until the directory is recovered and listed
+        with self._directory_lock.exclusive():
+            directory_info = self._load_directory_info()
+            if directory_info is None:
+                directory_info = DirectoryInfo(
+                    modified=datetime.datetime.fromtimestamp(
+                        0, tz=datetime.timezone.utc
+                    ),
+                    next_nonce=0,
+                    key_changed=False,
                 )
-        else:
-            self._directory_info = DirectoryInfo(
-                modified=datetime.datetime.fromtimestamp(
-                    0, tz=datetime.timezone.utc
-                ),
-                next_nonce=0,
-                key_changed=False,
-            )
-        if self._directory_info.key_changed is True:
-            self._recover()
+            self._directory_info = directory_info
+            self._load_layout()
+            if self._directory_info.key_changed is True:
+                self._recover()
+            self._files.update(self._list_files_of_layout())
 
     @property
     def modified(self) -> datetime.datetime:
         return self._directory_info.modified
 
+    @property
+    def layout(self) -> str:
+        return self._layout
+
+    @property
+    def key_id(self) -> bytes:
+        """Fingerprint of the key, which does not reveal the key itself."""
+        return hashlib.sha256(self.KEY_ID_PREFIX + self._key).digest()
+
+    @traced
     def write_to_file(self, file_name: str, data: bytes):
-        self._write_file_hash(file_name=file_name, data=data)
-        nonce = self._get_nonce()
-        self._save_directory_info()
-        data_encrypted = CipherHelper.encrypt_and_pack(
-            data=data, key=self._key, nonce=nonce
-        )
-        open(os.path.join(self._directory, file_name), "wb").write(
-            data_encrypted
-        )
-        self._files.add(file_name)
+        with self.exclusive_lock():
+            is_indexed = self._index is None or file_name in self._files
+            self._write_file_hash(file_name=file_name, data=data)
+            nonce = self._get_nonce()
+            index_nonce = None if is_indexed else self._get_nonce()
+            self._save_directory_info()
+            if not is_indexed:
+                self._append_to_index(nonce=index_nonce, added=(file_name,))
+            data_encrypted = self._encrypt(data=data, nonce=nonce)
+            self._write_bytes(
+                file_path=self._get_file_path_to_write(file_name=file_name),
+                data=data_encrypted,
+            )
+            self._files.add(file_name)
 
+    @traced
+    def write_to_files(self, files: dict):
+        ## Reserve the nonces of the whole batch, and persist the directory
+        ## info once, before any data is written
+        with self.exclusive_lock():
+            added_files_name = []
+            if self._index is not None:
+                added_files_name = [f for f in files if f not in self._files]
+            self._write_files_hash(files=files)
+            first_nonce = self._directory_info.next_nonce
+            self._directory_info.next_nonce += len(files)
+            index_nonce = None
+            if len(added_files_name) > 0:
+                index_nonce = self._get_nonce()
+            self._save_directory_info()
+            if index_nonce is not None:
+                self._append_to_index(
+                    nonce=index_nonce, added=added_files_name
+                )
+            for nonce, (file_name, data) in enumerate(
+                files.items(), start=first_nonce
+            ):
+                data_encrypted = self._encrypt(data=data, nonce=nonce)
+                self._write_bytes(
+                    file_path=self._get_file_path_to_write(
+                        file_name=file_name
+                    ),
+                    data=data_encrypted,
+                )
+                self._files.add(file_name)
+
+    @traced
     def read_from_file(self, file_name: str) -> bytes:
-        data_encrypted = super(
-            DirectoryHandlerWithFileHash, self
-        ).read_from_file(file_name=file_name)
-        data = CipherHelper.unpack_and_decrypt(
-            packed_data=data_encrypted, key=self._key
-        )
-        if not self._check_file_hash(file_name=file_name, data=data):
-            raise ValueError("File hash does not match")
-        return data
+        with self.shared_lock():
+            data_encrypted = super(
+                DirectoryHandlerWithFileHash, self
+            ).read_from_file(file_name=file_name)
+            data = self._decrypt(packed_data=data_encrypted)
+            if not self._check_file_hash(file_name=file_name, data=data):
+                raise ValueError("File hash does not match")
+            return data
 
-    def change_key(self, new_key: bytes):
-        self.cleanup()
-        files_name = self.get_all_files_name()
-        new_nonce = 0
-        files_using_new_key_cache_abs_path = os.path.join(
-            self._directory, self.FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY
-        )
-        for file_name in files_name:
-            try:
-                data = self.read_from_file(file_name=file_name)
-            except FileNotFoundError | ValueError:
-                self.delete_file(file_name=file_name)
-                continue
-            data_encrypted = CipherHelper.encrypt_and_pack(
-                data=data, key=new_key, nonce=new_nonce
+    @traced
+    def delete_file(self, file_name: str):
+        with self.exclusive_lock():
+            super().delete_file(file_name=file_name)
+            index_nonce = None if self._index is None else self._get_nonce()
+            ## Saved even without index, so that other processes notice the
+            ## deletion. See `_refresh`.
+            self._save_directory_info()
+            if index_nonce is not None:
+                self._append_to_index(nonce=index_nonce, deleted=(file_name,))
+
+    def iter_files_name(self) -> Iterator[str]:
+        if self._index is None:
+            yield from super().iter_files_name()
+            return
+        files_name_of_id = {
+            self._index.get_storage_id(file_name=f): f for f in self._files
+        }
+        for shard_path in self._list_shard_paths():
+            with os.scandir(shard_path) as entries:
+                for entry in entries:
+                    file_name = files_name_of_id.get(entry.name, None)
+                    if file_name is not None and file_name in self._files:
+                        yield file_name
+
+    def watch_changes(self, watcher: Optional[DirectoryWatcher] = None):
+        """
+        Apply the changes of other processes and sync tools from the entries
+        reported by a watcher, rather than listing the directory again, and
+        see them even without a commit of this handler stack.
+
+        Parameters
+        ----
+        watcher : DirectoryWatcher | None
+            Watcher of this directory only. One is created if None.
+        """
+        with self.exclusive_lock():
+            self._watcher = (
+                DirectoryWatcher.create() if watcher is None else watcher
             )
-            open(
-                os.path.join(files_using_new_key_cache_abs_path, file_name),
-                "wb",
-            ).write(data_encrypted)
-            new_nonce += 1
+            self._watcher.watch(
+                directory=os.path.join(
+                    self._directory, self.METADATA_SUBDIRECTORY
+                ),
+                files_name=(
+                    self.DIRECTORY_INFO_FILE_NAME,
+                    self.INDEX_FILE_NAME,
+                    self.LAYOUT_FILE_NAME,
+                ),
+            )
+            self._watcher.watch(directory=self._directory)
 
-        self._key = new_key
-        self._directory_info.modified = datetime.datetime.now(
-            tz=datetime.timezone.utc
-        )
-        self._directory_info.next_nonce = new_nonce
-        self._directory_info.key_changed = True
-        self._save_directory_info()
+    @traced
+    def check_changes(self) -> bool:
+        """
+        Return
+        ----
+        bool: whether files were added or deleted by other processes since
+            the last check
+        """
+        with self._directory_lock.shared() as is_acquired:
+            if not is_acquired:
+                ## Case: the lock was taken, and the changes applied, by
+                ## another thread
+                return False
+            return self._refresh(is_exclusive=False)
 
-        self._move_files(
-            src=files_using_new_key_cache_abs_path, dst=self._directory
-        )
+    @traced
+    def migrate_to_sharded_layout(
+        self, progress: Optional[OperationProgress] = None
+    ):
+        """
+        Move the files of the flat layout into the sharded layout. Once the
+        index is written, an interrupted migration is completed by the next
+        `__init__`, so it is not cancellable.
+        """
+        with self.exclusive_lock():
+            if self._index is not None:
+                return
+            files_name = self.get_all_files_name()
+            self._index = ShardedIndex.generate()
+            self._write_index(files_name=files_name)
+            self.write_metadata(
+                file_name=self.LAYOUT_FILE_NAME,
+                data=self.SHARDED_LAYOUT.encode(self.STRING_ENCODING),
+            )
+            self._layout = self.SHARDED_LAYOUT
+            if progress is not None:
+                progress.start_stage(
+                    stage=f"Sharding \"{self._directory}\"",
+                    n_items_total=len(files_name),
+                )
+            for file_name in files_name:
+                self._move_to_shard(file_name=file_name)
+                if progress is not None:
+                    progress.advance()
 
-        self._directory_info.modified = datetime.datetime.now(
-            tz=datetime.timezone.utc
-        )
-        self._directory_info.key_changed = False
-        self._save_directory_info()
+    @traced
+    def change_key(
+        self, new_key: bytes, progress: Optional[OperationProgress] = None
+    ):
+        """
+        Re-encrypt every file with a new key. It can be cancelled until all
+        files are re-encrypted, leaving the directory unchanged.
+        """
+        new_nonce = self.prepare_key_change(new_key=new_key, progress=progress)
+        self.commit_key_change(new_key=new_key, new_nonce=new_nonce)
+
+    @traced
+    def prepare_key_change(
+        self, new_key: bytes, progress: Optional[OperationProgress] = None
+    ) -> int:
+        """
+        Write every file encrypted with a new key to a cache, without
+        changing the directory. Call `commit_key_change` with the returned
+        nonce to use the new key, or `abort_key_change` to drop the cache.
+
+        Return
+        ----
+        int: next nonce of the new key
+        """
+        with self.exclusive_lock():
+            ## Drop the files of an earlier change, which was interrupted
+            ## before its commit
+            self._delete_files_using_new_key_cache()
+            self.cleanup(progress=progress)
+            files_name = self.get_all_files_name()
+            new_nonce = 0
+            files_using_new_key_cache_abs_path = os.path.join(
+                self._directory, self.FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY
+            )
+            if progress is not None:
+                progress.start_stage(
+                    stage=f"Re-encrypting \"{self._directory}\"",
+                    n_items_total=len(files_name),
+                )
+            try:
+                for file_name in files_name:
+                    if progress is not None:
+                        progress.check_cancelled()
+                    try:
+                        data = self.read_from_file(file_name=file_name)
+                    except (FileNotFoundError, ValueError):
+                        self.delete_file(file_name=file_name)
+                        continue
+                    data_encrypted = self._encrypt(
+                        data=data, nonce=new_nonce, key=new_key
+                    )
+                    self._write_bytes(
+                        file_path=os.path.join(
+                            files_using_new_key_cache_abs_path,
+                            self._get_storage_name(file_name=file_name),
+                        ),
+                        data=data_encrypted,
+                    )
+                    new_nonce += 1
+                    if progress is not None:
+                        progress.advance(n_bytes=len(data_encrypted))
+                if self._index is not None:
+                    new_nonce = self._write_index(
+                        files_name=self.get_all_files_name(),
+                        file_name=self.INDEX_USING_NEW_KEY_FILE_NAME,
+                        nonce=new_nonce,
+                        key=new_key,
+                    )
+            except BaseException:
+                self.abort_key_change()
+                raise
+            return new_nonce
+
+    @traced
+    def abort_key_change(self):
+        self._delete_files_using_new_key_cache()
+
+    @traced
+    def commit_key_change(self, new_key: bytes, new_nonce: int):
+        """
+        Switch to the new key, once `prepare_key_change` is done. An
+        interrupted commit is completed by the next `__init__`.
+        """
+        with self.exclusive_lock():
+            files_using_new_key_cache_abs_path = os.path.join(
+                self._directory, self.FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY
+            )
+            self._key = new_key
+            self._directory_info.modified = datetime.datetime.now(
+                tz=datetime.timezone.utc
+            )
+            self._directory_info.next_nonce = new_nonce
+            self._directory_info.key_changed = True
+            self._save_directory_info()
+
+            self._move_files(
+                src=files_using_new_key_cache_abs_path, dst=self._directory
+            )
+            self._replace_index_using_new_key()
+
+            self._directory_info.modified = datetime.datetime.now(
+                tz=datetime.timezone.utc
+            )
+            self._directory_info.key_changed = False
+            self._save_directory_info()
 
     def _get_nonce(self):
         nonce = self._directory_info.next_nonce
@@ -197,21 +448,61 @@ class DirectoryHandlerWithEncryption(DirectoryHandlerWithFileHash):
             tz=datetime.timezone.utc
         )
         info_serialized = self._directory_info.serialized()
-        info_encrypted = CipherHelper.encrypt_and_pack(
-            data=info_serialized, key=self._key, nonce=nonce
-        )
+        info_encrypted = self._encrypt(data=info_serialized, nonce=nonce)
         os.makedirs(
             os.path.join(self._directory, self.METADATA_SUBDIRECTORY),
             exist_ok=True,
         )
-        open(
-            os.path.join(
+        self._write_bytes(
+            file_path=os.path.join(
                 self._directory,
                 self.METADATA_SUBDIRECTORY,
                 self.DIRECTORY_INFO_FILE_NAME,
             ),
-            "wb",
-        ).write(info_encrypted)
+            data=info_encrypted,
+        )
+        self._directory_info_signature = self._get_directory_info_signature()
+
+    def _encrypt(
+        self, data: bytes, nonce: int, key: Optional[bytes] = None
+    ) -> bytes:
+        """
+        `CipherHelper.encrypt_and_pack`, counted in `io_stats`.
+
+        Parameters
+        ----
+        data : bytes
+        nonce : int
+        key : bytes | None
+            The current key if None.
+        """
+        with self._io_stats.timed(directory=self._directory, name="encrypt"):
+            data_encrypted = CipherHelper.encrypt_and_pack(
+                data=data,
+                key=self._key if key is None else key,
+                nonce=nonce,
+            )
+        self._io_stats.add(directory=self._directory, name="n_encryptions")
+        self._io_stats.add(
+            directory=self._directory,
+            name="n_bytes_encrypted",
+            value=len(data),
+        )
+        return data_encrypted
+
+    def _decrypt(self, packed_data: bytes) -> bytes:
+        """`CipherHelper.unpack_and_decrypt`, counted in `io_stats`."""
+        with self._io_stats.timed(directory=self._directory, name="decrypt"):
+            data = CipherHelper.unpack_and_decrypt(
+                packed_data=packed_data, key=self._key
+            )
+        self._io_stats.add(directory=self._directory, name="n_decryptions")
+        self._io_stats.add(
+            directory=self._directory,
+            name="n_bytes_decrypted",
+            value=len(data),
+        )
+        return data
 
     def _delete_files_using_new_key_cache(self):
         files_using_new_key_cache_abs_path = os.path.join(
@@ -224,6 +515,7 @@ class DirectoryHandlerWithEncryption(DirectoryHandlerWithFileHash):
                 )
             except:
                 continue
+        self.delete_metadata(file_name=self.INDEX_USING_NEW_KEY_FILE_NAME)
 
     def _recover(self):
         files_using_new_key_cache_abs_path = os.path.join(
@@ -236,20 +528,468 @@ class DirectoryHandlerWithEncryption(DirectoryHandlerWithFileHash):
         self._move_files(
             src=files_using_new_key_cache_abs_path, dst=self._directory
         )
+        self._replace_index_using_new_key()
         self._directory_info.modified = datetime.datetime.now(
             tz=datetime.timezone.utc
         )
         self._directory_info.key_changed = False
         self._save_directory_info()
 
-    @classmethod
-    def _move_files(cls, src: str, dst: str):
+    def _move_files(self, src: str, dst: str):
+        """Move stored files to the same layout in another directory."""
         assert os.path.isdir(src), "Source is not a directory"
         assert os.path.isdir(dst), "Destination is not a directory"
         source_files_name = [
             f for f in os.listdir(src) if os.path.isfile(os.path.join(src, f))
         ]
         for file_name in source_files_name:
+            dst_path = os.path.join(
+                dst, self._get_relative_path(storage_name=file_name)
+            )
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.replace(os.path.join(src, file_name), dst_path)
+
+    def _replace_index_using_new_key(self):
+        metadata_directory = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY
+        )
+        index_using_new_key_path = os.path.join(
+            metadata_directory, self.INDEX_USING_NEW_KEY_FILE_NAME
+        )
+        if os.path.isfile(index_using_new_key_path):
+            os.replace(
+                index_using_new_key_path,
+                os.path.join(metadata_directory, self.INDEX_FILE_NAME),
+            )
+            self._index_position = None
+
+    def _list_files(self) -> Iterable[str]:
+        ## Listed by `_list_files_of_layout` once the directory info is read,
+        ## as the index of the sharded layout is encrypted
+        return ()
+
+    def _list_files_of_layout(self, is_writable: bool = True) -> Iterable[str]:
+        """
+        Parameters
+        ----
+        is_writable : bool
+            Whether the directory can be changed, to complete an interrupted
+            migration and compact the index. Only under the exclusive lock.
+        """
+        if self._layout == self.FLAT_LAYOUT:
+            files_name = super()._list_files()
+            if (
+                is_writable
+                and self._new_directory_layout == self.SHARDED_LAYOUT
+                and len(files_name) == 0
+                and self._directory_info.next_nonce == 0
+            ):
+                ## Case: new directory
+                self.migrate_to_sharded_layout()
+            return files_name
+        index_path = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY, self.INDEX_FILE_NAME
+        )
+        try:
+            index_inode = os.stat(index_path).st_ino
+            index_data = self._read_bytes(file_path=index_path)
+            (
+                self._index,
+                indexed_files_name,
+                n_records,
+                n_bytes,
+            ) = ShardedIndex.unpack(
+                data=index_data,
+                decrypt=lambda packed_data: self._decrypt(
+                    packed_data=packed_data
+                ),
+            )
+        except (FileNotFoundError, ValueError):
+            raise ValueError(
+                f"Key is incorrect, or index is corrupted in directory "
+                f"\"{self._directory}\"."
+            )
+        stored_ids = set()
+        for shard_path in self._list_shard_paths():
+            with os.scandir(shard_path) as entries:
+                stored_ids.update(e.name for e in entries if e.is_file())
+        flat_files_name = set(super()._list_files()) if is_writable else ()
+        files_name = []
+        for file_name in indexed_files_name:
+            if self._index.get_storage_id(file_name=file_name) in stored_ids:
+                files_name.append(file_name)
+            elif file_name in flat_files_name:
+                ## Case: migration to the sharded layout was interrupted
+                self._move_to_shard(file_name=file_name)
+                files_name.append(file_name)
+            ## Else: added to the index, but not written before a crash
+        self._index_position = (index_inode, n_bytes)
+        if is_writable and (
+            n_records > self.INDEX_COMPACTION_N_RECORDS
+            ## Case: record torn by a crash, after which records cannot be
+            ## appended
+            or n_bytes < len(index_data)
+        ):
+            self._write_index(files_name=files_name)
+        return files_name
+
+    def _refresh(self, is_exclusive: bool) -> bool:
+        if self._watcher is not None:
+            return self._apply_watched_changes(is_exclusive=is_exclusive)
+        ## Under the shared lock, a change of the directory info is enough
+        ## to tell that no other process committed, without reading it.
+        ## Under the exclusive lock, it is always read, as a modification
+        ## time may not change between two quick writes, and a nonce must
+        ## never be reused.
+        if (
+            not is_exclusive
+            and self._get_directory_info_signature()
+            == self._directory_info_signature
+        ):
+            return False
+        if not self._reload_directory_info():
+            return False
+        ## Case: another process committed changes. Each commit saves the
+        ## directory info with a new nonce.
+        layout = self._layout
+        self._load_layout()
+        if self._layout == layout and self._index is not None:
+            is_changed = self._refresh_from_index()
+            if is_changed is not None:
+                return is_changed
+        return self._reload_files(is_writable=is_exclusive)
+
+    def _apply_watched_changes(self, is_exclusive: bool) -> bool:
+        """
+        `_refresh` from the entries reported by the watcher, so that only
+        the changed files are checked.
+        """
+        changes = self._watcher.get_changes()
+        metadata_directory = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY
+        )
+        metadata_changes = changes.get(metadata_directory, set())
+        if (
+            is_exclusive
+            or metadata_changes is None
+            or self.DIRECTORY_INFO_FILE_NAME in metadata_changes
+        ) and (
+            is_exclusive
+            or self._get_directory_info_signature()
+            != self._directory_info_signature
+        ):
+            self._reload_directory_info()
+        layout = self._layout
+        if (
+            metadata_changes is None
+            or self.LAYOUT_FILE_NAME in metadata_changes
+        ):
+            self._load_layout()
+        if self._layout != layout:
+            return self._reload_files(is_writable=is_exclusive)
+        if self._index is None:
+            directory_changes = changes.get(self._directory, set())
+            if directory_changes is None:
+                ## Case: names are unknown
+                return self._reload_files(is_writable=is_exclusive)
+            return self._update_files(
+                files_name=directory_changes,
+                are_present=lambda file_name: os.path.isfile(
+                    os.path.join(self._directory, file_name)
+                ),
+            )
+        is_changed = False
+        if (
+            metadata_changes is None
+            or self.INDEX_FILE_NAME in metadata_changes
+        ):
+            is_changed = self._refresh_from_index()
+            if is_changed is None:
+                return self._reload_files(is_writable=is_exclusive)
+        if len(self._pending_files_name) > 0:
+            ## Files written after their names were added to the index, such
+            ## as by a sync tool
+            present_files_name = [
+                f
+                for f in self._pending_files_name
+                if os.path.isfile(self.get_file_path(file_name=f))
+            ]
+            self._pending_files_name.difference_update(present_files_name)
+            self._files.update(present_files_name)
+            is_changed = is_changed or len(present_files_name) > 0
+        return is_changed
+
+    def _reload_directory_info(self) -> bool:
+        """
+        Return
+        ----
+        bool: whether another process saved the directory info since
+        """
+        directory_info = self._load_directory_info()
+        if (
+            directory_info is None
+            or directory_info.next_nonce == self._directory_info.next_nonce
+        ):
+            return False
+        self._directory_info = directory_info
+        return True
+
+    def _reload_files(self, is_writable: bool) -> bool:
+        self._pending_files_name.clear()
+        files_name = set(self._list_files_of_layout(is_writable=is_writable))
+        ## Added ones, then deleted ones, without a set of the known files
+        changed_files_name = [f for f in files_name if f not in self._files]
+        changed_files_name += [f for f in self._files if f not in files_name]
+        return self._update_files(
+            files_name=changed_files_name,
+            are_present=lambda file_name: file_name in files_name,
+        )
+
+    def _update_files(self, files_name: Iterable[str], are_present) -> bool:
+        """
+        Parameters
+        ----
+        files_name : Iterable[str]
+            Names of the files which may have been added or deleted.
+        are_present : Callable
+            Tell whether a file of the names is in the directory.
+
+        Return
+        ----
+        bool: whether the files changed
+        """
+        is_changed = False
+        for file_name in files_name:
+            is_present = are_present(file_name)
+            if is_present and file_name not in self._files:
+                self._files.add(file_name)
+                is_changed = True
+            elif not is_present and file_name in self._files:
+                self._files.remove(file_name)
+                is_changed = True
+        return is_changed
+
+    def _refresh_from_index(self) -> bool | None:
+        """
+        Apply the changes appended to the index since it was last read,
+        without listing the shards.
+
+        Return
+        ----
+        bool | None: whether the files changed, or None if the index was
+            rewritten, and must be read whole
+        """
+        index_path = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY, self.INDEX_FILE_NAME
+        )
+        try:
+            index_inode = os.stat(index_path).st_ino
+        except FileNotFoundError:
+            return None
+        if (
+            self._index_position is None
+            or self._index_position[0] != index_inode
+        ):
+            return None
+        try:
+            changes, n_bytes = ShardedIndex.unpack_changes(
+                data=self._read_bytes(
+                    file_path=index_path, offset=self._index_position[1]
+                ),
+                decrypt=lambda packed_data: self._decrypt(
+                    packed_data=packed_data
+                ),
+            )
+        except ValueError:
+            ## Case: inode of a rewritten index reused
+            return None
+        self._index_position = (index_inode, self._index_position[1] + n_bytes)
+        is_changed = False
+        for added_files_name, deleted_files_name in changes:
+            for file_name in added_files_name:
+                if file_name in self._files:
+                    continue
+                if os.path.isfile(self.get_file_path(file_name=file_name)):
+                    self._files.add(file_name)
+                    is_changed = True
+                else:
+                    self._pending_files_name.add(file_name)
+            for file_name in deleted_files_name:
+                self._pending_files_name.discard(file_name)
+                if file_name in self._files:
+                    self._files.remove(file_name)
+                    is_changed = True
+        return is_changed
+
+    def _load_directory_info(self) -> DirectoryInfo | None:
+        """
+        Return
+        ----
+        DirectoryInfo | None: None if the directory has none yet
+
+        Raise
+        ----
+        ValueError: if the key is incorrect, or the directory info is
+            corrupted
+        """
+        directory_info_path = os.path.join(
+            self._directory,
+            self.METADATA_SUBDIRECTORY,
+            self.DIRECTORY_INFO_FILE_NAME,
+        )
+        self._directory_info_signature = self._get_directory_info_signature()
+        try:
+            info_encrypted = self._read_bytes(file_path=directory_info_path)
+        except FileNotFoundError:
+            return None
+        info_bytes = self._decrypt(packed_data=info_encrypted)
+        try:
+            return DirectoryInfo.deserialized(data=info_bytes)
+        except ValueError:
+            raise ValueError(
+                f"Key is incorrect, or data is corrupted in directory "
+                f"\"{self._directory}\". The main password may have been "
+                f"changed by another process."
+            )
+
+    def _get_directory_info_signature(self) -> tuple | None:
+        try:
+            stat = os.stat(
+                os.path.join(
+                    self._directory,
+                    self.METADATA_SUBDIRECTORY,
+                    self.DIRECTORY_INFO_FILE_NAME,
+                )
+            )
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _load_layout(self):
+        layout = self.read_metadata(file_name=self.LAYOUT_FILE_NAME)
+        if layout is None:
+            return
+        self._layout = layout.decode(self.STRING_ENCODING)
+        if self._layout not in (self.FLAT_LAYOUT, self.SHARDED_LAYOUT):
+            raise ValueError(
+                f"Unknown layout \"{self._layout}\" of directory "
+                f"\"{self._directory}\"."
+            )
+
+    def _list_shard_paths(self) -> list:
+        with os.scandir(self._directory) as entries:
+            return sorted(
+                entry.path
+                for entry in entries
+                if entry.is_dir() and ShardedIndex.is_shard_name(entry.name)
+            )
+
+    def _get_storage_name(self, file_name: str) -> str:
+        if self._index is None:
+            return file_name
+        return self._index.get_storage_id(file_name=file_name)
+
+    def _get_relative_path(self, storage_name: str) -> str:
+        if self._layout == self.FLAT_LAYOUT:
+            return storage_name
+        return ShardedIndex.get_relative_path(storage_id=storage_name)
+
+    def _get_file_path_to_write(self, file_name: str) -> str:
+        """`get_file_path`, whose shard is created if needed."""
+        file_path = self.get_file_path(file_name=file_name)
+        if self._index is not None:
+            shard_path = os.path.dirname(file_path)
+            if shard_path not in self._shard_directories:
+                os.makedirs(shard_path, exist_ok=True)
+                self._shard_directories.add(shard_path)
+        return file_path
+
+    def _move_to_shard(self, file_name: str):
+        """Move a file and its hash from the flat layout to its shard."""
+        flat_hash_path = os.path.join(
+            self._directory,
+            self.HASHES_SUBDIRECTORY,
+            f"{file_name}.{self.HASH_FILE_EXTENSION}",
+        )
+        if os.path.isfile(flat_hash_path):
             os.replace(
-                os.path.join(src, file_name), os.path.join(dst, file_name)
+                flat_hash_path, self._get_hash_file_path(file_name=file_name)
             )
+        os.replace(
+            os.path.join(self._directory, file_name),
+            self._get_file_path_to_write(file_name=file_name),
+        )
+
+    def _append_to_index(
+        self,
+        nonce: int,
+        added: Iterable[str] = (),
+        deleted: Iterable[str] = (),
+    ):
+        index_path = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY, self.INDEX_FILE_NAME
+        )
+        data = self._index.pack_changes(
+            encrypt=lambda data: self._encrypt(data=data, nonce=nonce),
+            added=added,
+            deleted=deleted,
+        )
+        self._write_bytes(file_path=index_path, data=data, mode="ab")
+        if self._index_position is not None:
+            self._index_position = (
+                self._index_position[0],
+                self._index_position[1] + len(data),
+            )
+
+    def _write_index(
+        self,
+        files_name: Iterable[str],
+        file_name: str = INDEX_FILE_NAME,
+        nonce: int | None = None,
+        key: bytes | None = None,
+    ) -> int | None:
+        """
+        Write the whole index, replacing the log of changes.
+
+        Parameters
+        ----
+        files_name : Iterable[str]
+        file_name : str
+            Name of the index in the metadata.
+        nonce : int | None
+            First nonce of `key`. If None, the nonces of the current key are
+            reserved.
+        key : bytes | None
+            The current key if None.
+
+        Return
+        ----
+        int | None: next nonce of `key`, if `nonce` is given
+        """
+        if nonce is None:
+            header_nonce = self._get_nonce()
+            changes_nonce = self._get_nonce()
+            self._save_directory_info()
+            next_nonce = None
+        else:
+            header_nonce = nonce
+            changes_nonce = nonce + 1
+            next_nonce = nonce + 2
+        data = self._index.pack_header(
+            encrypt=lambda data: self._encrypt(
+                data=data, nonce=header_nonce, key=key
+            )
+        ) + self._index.pack_changes(
+            encrypt=lambda data: self._encrypt(
+                data=data, nonce=changes_nonce, key=key
+            ),
+            added=sorted(files_name),
+        )
+        index_path = os.path.join(
+            self._directory, self.METADATA_SUBDIRECTORY, file_name
+        )
+        self._write_bytes(file_path=index_path + ".tmp", data=data)
+        os.replace(index_path + ".tmp", index_path)
+        if file_name == self.INDEX_FILE_NAME:
+            self._index_position = (os.stat(index_path).st_ino, len(data))
+        return next_nonce
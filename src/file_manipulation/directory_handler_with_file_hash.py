@@ -1,84 +1,157 @@
+from __future__ import annotations
 import hashlib
 import os
+from typing import Optional, TYPE_CHECKING
 
 from file_manipulation.directory_handler import DirectoryHandler
+from util.span_tracer import traced
+
+
+if TYPE_CHECKING:
+    from util.operation_progress import OperationProgress
 
 
 class DirectoryHandlerWithFileHash(DirectoryHandler):
     HASHES_SUBDIRECTORY = ".hashes"
     HASH_FILE_EXTENSION = "hash"
 
+    @traced
     def write_to_file(self, file_name: str, data: bytes):
-        self._write_file_hash(file_name=file_name, data=data)
-        super().write_to_file(file_name=file_name, data=data)
+        with self.exclusive_lock():
+            self._write_file_hash(file_name=file_name, data=data)
+            super().write_to_file(file_name=file_name, data=data)
+
+    @traced
+    def write_to_files(self, files: dict):
+        with self.exclusive_lock():
+            self._write_files_hash(files=files)
+            super().write_to_files(files=files)
 
+    @traced
     def read_from_file(self, file_name: str) -> bytes:
-        self._ensure_file_exists(file_name=file_name)
-        data = super().read_from_file(file_name=file_name)
-        if not self._check_file_hash(file_name=file_name, data=data):
-            raise ValueError("File hash does not match")
-        return data
+        with self.shared_lock():
+            self._ensure_file_exists(file_name=file_name)
+            data = super().read_from_file(file_name=file_name)
+            if not self._check_file_hash(file_name=file_name, data=data):
+                raise ValueError("File hash does not match")
+            return data
 
+    @traced
     def get_file_hash(self, file_name: str) -> bytes:
-        self._ensure_file_exists(file_name)
-        with open(
-            os.path.join(
-                self._directory,
-                self.HASHES_SUBDIRECTORY,
-                f"{file_name}.{self.HASH_FILE_EXTENSION}",
+        with self.shared_lock():
+            self._ensure_file_exists(file_name)
+            return self._read_bytes(
+                file_path=self.get_hash_file_path(file_name=file_name)
+            )
+
+    def get_hash_file_path(self, file_name: str) -> str:
+        return os.path.join(
+            self._directory,
+            self.HASHES_SUBDIRECTORY,
+            self._get_relative_hash_file_path(
+                storage_name=self._get_storage_name(file_name=file_name)
             ),
-            "rb",
-        ) as f:
-            return f.read()
+        )
 
+    @traced
     def delete_file(self, file_name: str):
-        self._ensure_file_exists(file_name=file_name)
-        super().delete_file(file_name=file_name)
-        self._delete_hash(file_name=file_name)
+        with self.exclusive_lock():
+            self._ensure_file_exists(file_name=file_name)
+            super().delete_file(file_name=file_name)
+            self._delete_hash(file_name=file_name)
 
-    def cleanup(self):
-        hash_directory_abs_path = os.path.join(
-            self._directory, self.HASHES_SUBDIRECTORY
-        )
-        os.makedirs(hash_directory_abs_path, exist_ok=True)
-        hash_files = [
-            f
-            for f in os.listdir(hash_directory_abs_path)
-            if os.path.isfile(os.path.join(hash_directory_abs_path, f))
-        ]
-        for f in self._files:
-            try:
-                hash_files.remove(f"{f}.{self.HASH_FILE_EXTENSION}")
-            except ValueError:
-                ## Case: hash file does not exist
-                self.delete_file(file_name=f)
-        for f in hash_files:
-            ## Case: hash file exists but file does not
-            os.remove(os.path.join(hash_directory_abs_path, f))
+    @traced
+    def cleanup(self, progress: Optional[OperationProgress] = None):
+        """
+        Delete the files without hash, and the hashes without file. It can be
+        cancelled at any file, as it is repeated on the next unlock.
+        """
+        with self.exclusive_lock():
+            hash_directory_abs_path = os.path.join(
+                self._directory, self.HASHES_SUBDIRECTORY
+            )
+            os.makedirs(hash_directory_abs_path, exist_ok=True)
+            hash_files = set()
+            for root, _, files in os.walk(hash_directory_abs_path):
+                relative_root = os.path.relpath(root, hash_directory_abs_path)
+                hash_files.update(
+                    os.path.normpath(os.path.join(relative_root, f))
+                    for f in files
+                )
+            if progress is not None:
+                progress.start_stage(
+                    stage=f"Cleaning up \"{self._directory}\"",
+                    n_items_total=len(self._files),
+                )
+            ## Files deleted meanwhile are skipped by the iteration
+            for f in self._files:
+                if progress is not None:
+                    progress.check_cancelled()
+                try:
+                    hash_files.remove(
+                        self._get_relative_hash_file_path(
+                            storage_name=self._get_storage_name(file_name=f)
+                        )
+                    )
+                except KeyError:
+                    ## Case: hash file does not exist
+                    self.delete_file(file_name=f)
+                if progress is not None:
+                    progress.advance()
+            for f in hash_files:
+                ## Case: hash file exists but file does not
+                self._remove_file(
+                    file_path=os.path.join(hash_directory_abs_path, f)
+                )
 
     def _get_hash_file_path(self, file_name: str) -> str:
-        hash_directory_abs_path = os.path.join(
-            self._directory, self.HASHES_SUBDIRECTORY
-        )
-        os.makedirs(hash_directory_abs_path, exist_ok=True)
-        return os.path.join(
-            hash_directory_abs_path, f"{file_name}.{self.HASH_FILE_EXTENSION}"
+        """`get_hash_file_path`, whose directory is created if needed."""
+        hash_path = self.get_hash_file_path(file_name=file_name)
+        os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+        return hash_path
+
+    def _get_relative_hash_file_path(self, storage_name: str) -> str:
+        return (
+            f"{self._get_relative_path(storage_name=storage_name)}."
+            f"{self.HASH_FILE_EXTENSION}"
         )
 
     def _write_file_hash(self, file_name: str, data: bytes):
-        data_hash = self._get_hash(data=data)
+        data_hash = self._hash(data=data)
         hash_path = self._get_hash_file_path(file_name=file_name)
-        open(hash_path, "wb").write(data_hash)
+        self._write_bytes(file_path=hash_path, data=data_hash)
+
+    def _write_files_hash(self, files: dict):
+        hash_paths = {
+            file_name: self.get_hash_file_path(file_name=file_name)
+            for file_name in files
+        }
+        for hash_directory in set(map(os.path.dirname, hash_paths.values())):
+            os.makedirs(hash_directory, exist_ok=True)
+        for file_name, data in files.items():
+            self._write_bytes(
+                file_path=hash_paths[file_name], data=self._hash(data=data)
+            )
 
     def _check_file_hash(self, file_name: str, data: bytes) -> bool:
-        data_hash = self._get_hash(data=data)
-        hash_path = self._get_hash_file_path(file_name=file_name)
-        return data_hash == open(hash_path, "rb").read()
+        data_hash = self._hash(data=data)
+        hash_path = self.get_hash_file_path(file_name=file_name)
+        return data_hash == self._read_bytes(file_path=hash_path)
 
     def _delete_hash(self, file_name: str):
-        hash_path = self._get_hash_file_path(file_name=file_name)
+        hash_path = self.get_hash_file_path(file_name=file_name)
         if os.path.isfile(hash_path):
-            os.remove(hash_path)
+            self._remove_file(file_path=hash_path)
+
+    def _hash(self, data: bytes) -> bytes:
+        """`_get_hash`, counted in `io_stats`."""
+        with self._io_stats.timed(directory=self._directory, name="hash"):
+            data_hash = self._get_hash(data=data)
+        self._io_stats.add(directory=self._directory, name="n_hashes")
+        self._io_stats.add(
+            directory=self._directory, name="n_bytes_hashed", value=len(data)
+        )
+        return data_hash
 
     @classmethod
     def _get_hash(cls, data: bytes) -> bytes:
@@ -1,42 +1,179 @@
+from __future__ import annotations
+import contextlib
+import contextvars
 import hashlib
-import shutil
+import json
+import os
+import threading
 import time
+from typing import Callable, Iterable, Iterator, Optional, TYPE_CHECKING
 
 from file_manipulation.directory_handler import DirectoryHandler
 from file_manipulation.directory_handler_with_encryption import (
     DirectoryHandlerWithEncryption,
 )
+from file_manipulation.file_inventory import FileInventory
+from file_manipulation.outbound_queue import OutboundQueue
+from util.io_stats import IoStats
+from util.span_tracer import traced
+
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    from util.operation_progress import OperationProgress
 
 
 class DirectoryHandlerWithReplication:
     REPLICA_ID_FILE_NAME = "replica_id"
+    QUORUMS_FILE_NAME = "quorums"
+    WRITE_BATCH_SIZE = 256
+    ## Seconds between two attempts to catch up the synchronous replicas
+    ## which are behind, while a write to them fails
+    CATCH_UP_RETRY_INTERVAL = 5.0
+    ## Under the metadata of the first synchronous replica
+    OUTBOUND_QUEUES_SUBDIRECTORY = "outbound_queues"
+    OUTBOUND_QUEUE_ID_NUM_CHARS = 32
+    ## Seconds between two attempts to drain the outbound queues, while an
+    ## asynchronous replica is not reachable
+    OUTBOUND_QUEUE_RETRY_INTERVAL = 5.0
 
-    def __init__(self, directories: list, key: bytes):
+    @traced
+    def __init__(
+        self,
+        directories: list,
+        key: bytes,
+        executor: Optional[concurrent.futures.Executor] = None,
+        progress: Optional[OperationProgress] = None,
+        io_stats: Optional[IoStats] = None,
+        layout: str = DirectoryHandlerWithEncryption.FLAT_LAYOUT,
+        asynchronous_directories: Iterable[str] = (),
+    ):
+        """
+        Writes and deletions return once the synchronous replicas are
+        written, or once the write quorum of them is. See `set_quorums`. The
+        asynchronous replicas, such as a mirror on a USB drive
+        or a network share, are fed in the background from an outbound queue
+        per replica, kept encrypted in the first synchronous replica. A
+        queue which was not drained is replayed on the next opening, before
+        the replicas are recovered, or whenever its replica is reachable
+        again.
+
+        Parameters
+        ----
+        directories : list
+            Directories of the replicas.
+        key : bytes
+            Key from which the key of each replica is derived.
+        executor : Executor | None
+            If given, writes and deletions are run on all synchronous
+            replicas concurrently by the executor. Otherwise they are run one
+            replica after another.
+        progress : OperationProgress | None
+            Reports the replicas opened and the files checked and repaired,
+            and cancels opening between two replicas or two files.
+        io_stats : IoStats | None
+            Counters of the I/O of all replicas. A new one is created if None.
+        layout : str
+            Layout of new replicas. See `DirectoryHandlerWithEncryption`.
+        asynchronous_directories : Iterable[str]
+            Directories among `directories` whose replicas are asynchronous.
+
+        Raise
+        ----
+        ValueError: if no replica is synchronous
+        """
         assert len(directories) > 0
+        asynchronous_directories = set(asynchronous_directories)
+        synchronous_directories = [
+            d for d in directories if d not in asynchronous_directories
+        ]
+        if len(synchronous_directories) == 0:
+            raise ValueError("At least one replica must be synchronous")
         self._directories = directories
-        directories_uid = []
-        for d in self._directories:
-            handler = DirectoryHandler(directory=d)
-            replica_id = handler.read_metadata(
-                file_name=self.REPLICA_ID_FILE_NAME
-            )
-            if replica_id is None:
-                replica_id = self._generate_replica_id()
-                handler.write_metadata(
-                    file_name=self.REPLICA_ID_FILE_NAME, data=replica_id
-                )
-            directories_uid.append(replica_id)
-        self._directory_handlers = [
-            DirectoryHandlerWithEncryption(
-                directory=d, key=hashlib.sha256(key + replica_id).digest()
+        self._key = key
+        self._executor = executor
+        self._io_stats = IoStats() if io_stats is None else io_stats
+        self._layout = layout
+        ## One inventory for all replicas, as they have nearly the same files
+        self._inventory = FileInventory()
+        if progress is not None:
+            progress.start_stage(
+                stage="Opening replicas", n_items_total=len(directories)
             )
-            for d, replica_id in zip(self._directories, directories_uid)
-        ]
+        self._directory_handlers = []
+        for d in synchronous_directories:
+            if progress is not None:
+                progress.check_cancelled()
+            self._directory_handlers.append(self._open_replica(directory=d))
+            if progress is not None:
+                progress.advance()
         self._directory_handlers.sort(
             key=lambda handler: handler.modified, reverse=True
         )
-        self.cleanup()
-        self.recover()
+        self._write_quorum, self._read_quorum = self._load_quorums()
+        self._lag_condition = threading.Condition()
+        ## Synchronous handler -> names of the files whose last change it
+        ## may not have, and number of its writes still running past the
+        ## write quorum
+        self._lagging_files = {h: set() for h in self._directory_handlers}
+        self._n_pending_writes = {h: 0 for h in self._directory_handlers}
+        ## File name -> sequence number of its last change, by which a
+        ## catch-up finds that the file changed while it was read. Kept only
+        ## while a replica is behind on the file.
+        self._file_versions = {}
+        self._n_changes = 0
+        self._catch_up_event = threading.Event()
+        self._catch_up_thread = None
+        self._is_closing = False
+        self._outbound_event = threading.Event()
+        self._outbound_thread = None
+        ## Directory of each asynchronous replica -> its outbound queue, and
+        ## its handler, or None while it is not reachable
+        self._outbound_queues = {}
+        self._asynchronous_handlers = {}
+        for d in directories:
+            if d not in asynchronous_directories:
+                continue
+            if progress is not None:
+                progress.check_cancelled()
+            queue_directory = os.path.join(
+                synchronous_directories[0],
+                DirectoryHandler.METADATA_SUBDIRECTORY,
+                self.OUTBOUND_QUEUES_SUBDIRECTORY,
+                hashlib.sha256(
+                    os.path.abspath(d).encode(OutboundQueue.STRING_ENCODING)
+                ).hexdigest()[: self.OUTBOUND_QUEUE_ID_NUM_CHARS],
+            )
+            ## A new replica is created. A known one is not reachable if its
+            ## directory is missing, such as an unmounted drive.
+            is_new = not os.path.isdir(queue_directory)
+            self._outbound_queues[d] = OutboundQueue(
+                directory=queue_directory,
+                key=OutboundQueue.get_key(key=key),
+                replica_directory=d,
+                io_stats=self._io_stats,
+            )
+            self._asynchronous_handlers[d] = None
+            try:
+                if is_new:
+                    self._asynchronous_handlers[d] = self._open_replica(
+                        directory=d
+                    )
+                self._drain_outbound_queue(directory=d)
+            except OSError:
+                self._io_stats.add(directory=d, name="n_drain_failures")
+            if progress is not None:
+                progress.advance()
+        self.cleanup(progress=progress)
+        self.recover(progress=progress)
+        if len(self._outbound_queues) > 0:
+            self._outbound_thread = threading.Thread(
+                target=self._drain_outbound_queues_in_background,
+                name="outbound_queues",
+                daemon=True,
+            )
+            self._outbound_thread.start()
 
     def __contains__(self, file_name: str) -> bool:
         return self.file_exists(file_name=file_name)
@@ -45,111 +182,927 @@ class DirectoryHandlerWithReplication:
     def directories(self) -> list:
         return self._directories
 
+    @property
+    def io_stats(self) -> IoStats:
+        return self._io_stats
+
+    def stats(self) -> dict:
+        """
+        Counters of the file I/O, hashing and encryption, per replica and
+        per operation. See `IoStats.stats`.
+        """
+        return self._io_stats.stats()
+
+    @property
+    def write_quorum(self) -> int:
+        return self._write_quorum
+
+    @property
+    def read_quorum(self) -> int:
+        return self._read_quorum
+
+    @property
+    def n_synchronous_replicas(self) -> int:
+        return len(self._directory_handlers)
+
+    @traced
+    def set_quorums(self, write_quorum: int, read_quorum: int):
+        """
+        Set the number of synchronous replicas which must be written before
+        a write or deletion returns, and the number which must be read and
+        agree on a file before it is returned. The other replicas are
+        written in the background, and caught up if a write to them fails.
+        A read returns the most recently written of the copies read, so
+        with a read quorum plus a write quorum above the number of
+        replicas, a read always sees the last write.
+
+        The quorums are kept in the metadata of the replicas, and lowered
+        to the number of synchronous replicas if some are removed.
+
+        Raise
+        ----
+        ValueError: if a quorum is not between 1 and the number of
+            synchronous replicas
+        """
+        n_replicas = len(self._directory_handlers)
+        for name, quorum in (("Write", write_quorum), ("Read", read_quorum)):
+            if not 1 <= quorum <= n_replicas:
+                raise ValueError(
+                    f"{name} quorum must be between 1 and {n_replicas}"
+                )
+        self.write_metadata(
+            file_name=self.QUORUMS_FILE_NAME,
+            data=json.dumps(
+                {"write": write_quorum, "read": read_quorum}
+            ).encode(OutboundQueue.STRING_ENCODING),
+        )
+        self._write_quorum = write_quorum
+        self._read_quorum = read_quorum
+
     def file_exists(self, file_name: str) -> bool:
-        return file_name in self._directory_handlers[0]
+        return file_name in self._get_reference_handler(file_name=file_name)
 
+    @traced
     def write_to_file(self, file_name: str, data: bytes):
-        for handler in self._directory_handlers:
-            handler.write_to_file(file_name=file_name, data=data)
+        self._put_to_outbound_queues(
+            operation=OutboundQueue.WRITE, files={file_name: data}
+        )
+        self._for_each_handler_in_quorum(
+            lambda handler: handler.write_to_file(
+                file_name=file_name, data=data
+            ),
+            files_name=(file_name,),
+        )
 
+    @traced
+    def write_to_files(self, files: dict):
+        self._put_to_outbound_queues(
+            operation=OutboundQueue.WRITE, files=files
+        )
+        self._for_each_handler_in_quorum(
+            lambda handler: handler.write_to_files(files=files),
+            files_name=files.keys(),
+        )
+
+    @traced
     def read_from_file(self, file_name: str) -> bytes:
+        """
+        Read the file from the replicas, until the read quorum of them
+        answers, and return the most recently written valid copy.
+
+        The replicas which are not behind on the file are read first. A
+        replica still catching up on it after a write past the write
+        quorum answers too, with its older copy or none, so that a read
+        quorum plus a write quorum above the number of replicas sees the
+        last write. The replicas which are not behind, and do not have a
+        valid copy or have an older one, are repaired.
+
+        Raise
+        ----
+        FileNotFoundError: if no replica which is not behind on the file
+            has a valid copy, or fewer replicas than the read quorum answer
+        """
+        up_to_date_handlers = self._get_up_to_date_handlers(
+            file_name=file_name
+        )
+        lagging_handlers = [
+            h for h in self._directory_handlers if h not in up_to_date_handlers
+        ]
         problematic_handlers = []
-        data = None
-        for handler in self._directory_handlers:
+        ## (Modification time, handler, data) of each valid copy
+        copies = []
+        n_answers = 0
+        for handler in up_to_date_handlers + lagging_handlers:
+            if n_answers >= self._read_quorum and len(copies) > 0:
+                break
+            is_lagging = handler in lagging_handlers
             try:
                 data = handler.read_from_file(file_name=file_name)
-            except FileNotFoundError | ValueError:
-                problematic_handlers.append(handler)
+                modification_time = (
+                    0
+                    if self._read_quorum == 1
+                    else handler.get_file_modification_time_ns(
+                        file_name=file_name
+                    )
+                )
+            except (FileNotFoundError, ValueError):
+                if is_lagging:
+                    ## Case: not caught up yet, which is its answer
+                    n_answers += 1
+                else:
+                    problematic_handlers.append(handler)
                 continue
-            else:
-                break
-        if data is None:
+            n_answers += 1
+            copies.append((modification_time, handler, data))
+        if not any(h not in lagging_handlers for _, h, _ in copies):
             raise FileNotFoundError(
                 f"File {file_name} is not found/invalid in all directories"
             )
+        if n_answers < self._read_quorum:
+            raise FileNotFoundError(
+                f"File {file_name} is valid in {len(copies)} directories, "
+                f"fewer than the read quorum of {self._read_quorum}"
+            )
+        _, _, data = max(copies, key=lambda copy: copy[0])
+        ## The replicas behind are left to the catch-up, as writes to them
+        ## may still be running
+        problematic_handlers += [
+            h for _, h, d in copies if d != data and h not in lagging_handlers
+        ]
         for handler in problematic_handlers:
             handler.write_to_file(file_name=file_name, data=data)
+            self._io_stats.add(directory=handler.directory, name="n_repairs")
         return data
 
+    @traced
     def delete_file(self, file_name: str):
-        for handler in self._directory_handlers:
+        def delete_file_of_handler(handler: DirectoryHandlerWithEncryption):
             try:
                 handler.delete_file(file_name=file_name)
             except FileNotFoundError:
-                continue
+                pass
 
-    def cleanup(self):
-        for handler in self._directory_handlers:
-            handler.cleanup()
+        self._put_to_outbound_queues(
+            operation=OutboundQueue.DELETE, files={file_name: None}
+        )
+        self._for_each_handler_in_quorum(
+            delete_file_of_handler, files_name=(file_name,)
+        )
 
-    def recover(self):
-        gathered_files_name = {}
-        for handler_index, handler in enumerate(self._directory_handlers):
-            files_name = handler.get_all_files_name()
-            for file_name in files_name:
-                if file_name not in gathered_files_name:
-                    gathered_files_name[file_name] = [handler_index]
-                else:
-                    gathered_files_name[file_name].append(handler_index)
-        for file_name, handler_indices in gathered_files_name.items():
+    @traced
+    def cleanup(self, progress: Optional[OperationProgress] = None):
+        for handler in self._get_reachable_handlers():
+            handler.cleanup(progress=progress)
+
+    @traced
+    def recover(self, progress: Optional[OperationProgress] = None):
+        """
+        Copy the files missing from, or differing in, some replicas from the
+        most recently modified replica which has them. The asynchronous
+        replicas which are not reachable are left to their outbound queues,
+        and the files only they have are skipped, counted as "skipped" in
+        `progress`.
+
+        Cancelling leaves the replicas consistent file by file, and the rest
+        is recovered the next time.
+        """
+        handlers = sorted(
+            self._get_reachable_handlers(),
+            key=lambda handler: handler.modified,
+            reverse=True,
+        )
+        ## Bits of the handlers in the presence bitmaps of the inventory
+        handler_bits = [1 << handler.replica_index for handler in handlers]
+        presence_snapshot = self._inventory.get_presence_snapshot()
+        if progress is not None:
+            progress.start_stage(
+                stage="Checking files", n_items_total=len(presence_snapshot)
+            )
+        for file_name, presence in presence_snapshot:
+            if progress is not None:
+                progress.check_cancelled()
+            handler_indices = [
+                i for i, bit in enumerate(handler_bits) if presence & bit
+            ]
+            if len(handler_indices) == 0:
+                ## Case: only in asynchronous replicas which are not
+                ## reachable, which are recovered when they are reachable
+                if progress is not None:
+                    progress.count(name="skipped")
+                    progress.advance()
+                continue
             reference_data = None
-            if len(handler_indices) != len(self._directory_handlers):
+            if len(handler_indices) != len(handlers):
                 if reference_data is None:
-                    reference_data = self._directory_handlers[
+                    reference_data = handlers[
                         handler_indices[0]
                     ].read_from_file(file_name=file_name)
-                for i in range(len(self._directory_handlers)):
+                for i in range(len(handlers)):
                     if i not in handler_indices:
-                        self._directory_handlers[i].write_to_file(
+                        handlers[i].write_to_file(
                             file_name=file_name, data=reference_data
                         )
-            reference_hash = self._directory_handlers[
-                handler_indices[0]
-            ].get_file_hash(file_name=file_name)
-            for handler in self._directory_handlers[1:]:
+                        self._io_stats.add(
+                            directory=handlers[i].directory,
+                            name="n_repairs",
+                        )
+                        if progress is not None:
+                            progress.count(name="repaired")
+            reference_hash = handlers[handler_indices[0]].get_file_hash(
+                file_name=file_name
+            )
+            for handler in handlers[1:]:
                 if (
                     handler.get_file_hash(file_name=file_name)
                     == reference_hash
                 ):
                     continue
                 if reference_data is None:
-                    reference_data = self._directory_handlers[
-                        0
-                    ].read_from_file(file_name=file_name)
+                    reference_data = handlers[0].read_from_file(
+                        file_name=file_name
+                    )
                 handler.write_to_file(file_name=file_name, data=reference_data)
+                self._io_stats.add(
+                    directory=handler.directory, name="n_repairs"
+                )
+                if progress is not None:
+                    progress.count(name="repaired")
+            if progress is not None:
+                progress.advance(
+                    n_bytes=(
+                        0 if reference_data is None else len(reference_data)
+                    )
+                )
 
-    def change_key(self, new_key: bytes):
+    def watch_changes(self):
+        """
+        Watch every replica for changes of other processes and sync tools.
+        See `DirectoryHandlerWithEncryption.watch_changes`.
+        """
         for handler in self._directory_handlers:
-            replica_id = handler.read_metadata(
-                file_name=self.REPLICA_ID_FILE_NAME
+            handler.watch_changes()
+
+    @traced
+    def check_changes(self) -> bool:
+        """
+        Return
+        ----
+        bool: whether files were added or deleted in any replica by other
+            processes since the last check
+        """
+        return any(
+            [handler.check_changes() for handler in self._directory_handlers]
+        )
+
+    @traced
+    def migrate_to_sharded_layout(
+        self, progress: Optional[OperationProgress] = None
+    ):
+        """
+        Move the files of every reachable replica of the flat layout into the
+        sharded layout. An interrupted migration is completed on the next
+        opening.
+        """
+        for handler in self._get_reachable_handlers():
+            handler.migrate_to_sharded_layout(progress=progress)
+
+    @traced
+    def change_key(
+        self, new_key: bytes, progress: Optional[OperationProgress] = None
+    ):
+        """
+        Re-encrypt every replica with a new key. It can be cancelled until
+        all replicas are re-encrypted, leaving every replica with the old
+        key. Only then are the replicas switched to the new key. Other
+        processes wait until every replica is switched.
+
+        Raise
+        ----
+        ValueError: if an asynchronous replica is not reachable, as it would
+            be left with the old key
+        """
+        self._drain_outbound_queues()
+        unreachable_directories = [
+            d
+            for d, h in self._asynchronous_handlers.items()
+            if h is None or not self._is_reachable(directory=d)
+        ]
+        if len(unreachable_directories) > 0:
+            raise ValueError(
+                "Asynchronous replicas {} are not reachable".format(
+                    unreachable_directories
+                )
             )
-            if replica_id is None:
-                replica_id = self._generate_replica_id()
-                handler.write_metadata(
-                    file_name=self.REPLICA_ID_FILE_NAME, data=replica_id
+        handlers = self._get_reachable_handlers()
+        with contextlib.ExitStack() as exit_stack:
+            ## Other processes must not write between the re-encryption and
+            ## the switch to the new key. Locked in the same order by every
+            ## process, so that none waits for another in a cycle, and the
+            ## queues before the replicas, as when they are drained.
+            for _, queue in sorted(self._outbound_queues.items()):
+                exit_stack.enter_context(queue.drain_lock())
+            for handler in sorted(handlers, key=lambda h: h.directory):
+                exit_stack.enter_context(handler.exclusive_lock())
+            ## Changes queued by other processes meanwhile
+            for d in self._outbound_queues:
+                self._drain_outbound_queue(directory=d)
+            replica_keys = []
+            for handler in handlers:
+                replica_id = handler.read_metadata(
+                    file_name=self.REPLICA_ID_FILE_NAME
+                )
+                if replica_id is None:
+                    replica_id = self._generate_replica_id()
+                    handler.write_metadata(
+                        file_name=self.REPLICA_ID_FILE_NAME, data=replica_id
+                    )
+                replica_keys.append(
+                    self._get_replica_key(key=new_key, replica_id=replica_id)
+                )
+            new_nonces = []
+            try:
+                for handler, replica_key in zip(handlers, replica_keys):
+                    new_nonces.append(
+                        handler.prepare_key_change(
+                            new_key=replica_key, progress=progress
+                        )
+                    )
+            except BaseException:
+                for handler in handlers:
+                    handler.abort_key_change()
+                raise
+            for handler, replica_key, new_nonce in zip(
+                handlers, replica_keys, new_nonces
+            ):
+                handler.commit_key_change(
+                    new_key=replica_key, new_nonce=new_nonce
                 )
-            handler.change_key(
-                new_key=hashlib.sha256(new_key + replica_id).digest()
+            for queue in self._outbound_queues.values():
+                queue.change_key(new_key=OutboundQueue.get_key(key=new_key))
+            self._key = new_key
+
+    def get_n_queued_changes(self) -> dict:
+        """
+        Return
+        ----
+        dict: Directory of each asynchronous replica -> number of changes
+            in its outbound queue
+        """
+        return {d: len(queue) for d, queue in self._outbound_queues.items()}
+
+    def close(self):
+        """
+        Stop catching up the synchronous replicas and draining the outbound
+        queues in the background, after waiting for the writes past the
+        write quorum and a last attempt at both. The replicas left behind
+        are recovered by the next opening, and the changes left in the
+        queues are applied once their replicas are reachable.
+        """
+        self._is_closing = True
+        for event, thread in (
+            (self._catch_up_event, self._catch_up_thread),
+            (self._outbound_event, self._outbound_thread),
+        ):
+            if thread is not None:
+                event.set()
+                thread.join()
+        self._catch_up_thread = None
+        self._outbound_thread = None
+        with self._lag_condition:
+            self._lag_condition.wait_for(
+                lambda: all(n == 0 for n in self._n_pending_writes.values())
             )
+        self._catch_up()
+        self._drain_outbound_queues()
+
+    def read_metadata(self, file_name: str) -> list:
+        """
+        Return
+        ----
+        list: Metadata of each synchronous replica, or None if the replica
+            does not have it, from the most recently modified replica
+        """
+        return [
+            handler.read_metadata(file_name=file_name)
+            for handler in self._directory_handlers
+        ]
 
-    def get_all_files_name(self) -> set:
-        return self._directory_handlers[0].get_all_files_name()
+    @traced
+    def write_metadata(self, file_name: str, data: bytes):
+        """Write metadata which is the same in all replicas."""
+        self._put_to_outbound_queues(
+            operation=OutboundQueue.WRITE_METADATA, files={file_name: data}
+        )
+        self._for_each_handler(
+            lambda handler: handler.write_metadata(
+                file_name=file_name, data=data
+            )
+        )
 
+    @traced
+    def delete_metadata(self, file_name: str):
+        self._put_to_outbound_queues(
+            operation=OutboundQueue.DELETE_METADATA, files={file_name: None}
+        )
+        self._for_each_handler(
+            lambda handler: handler.delete_metadata(file_name=file_name)
+        )
+
+    @classmethod
+    def read_metadata_of_directories(
+        cls, directories: list, file_name: str
+    ) -> bytes | None:
+        """
+        Read metadata before the replicas are opened, such as what the key
+        is derived from.
+
+        Return
+        ----
+        bytes | None: Metadata of the first replica which has it
+        """
+        for d in directories:
+            try:
+                with open(
+                    os.path.join(
+                        d, DirectoryHandler.METADATA_SUBDIRECTORY, file_name
+                    ),
+                    "rb",
+                ) as f:
+                    return f.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    @traced
+    def get_all_files_name(self) -> frozenset:
+        return self._get_listing_handler().get_all_files_name()
+
+    def iter_files_name(self) -> Iterator[str]:
+        return self._get_listing_handler().iter_files_name()
+
+    @traced
     def search_file_name(
         self, target_name: str, n_candidates: int = 9
     ) -> list:
-        return self._directory_handlers[0].search_file_name(
+        return self._get_listing_handler().search_file_name(
             target_name=target_name, n_candidates=n_candidates
         )
 
-    def create_archive(self, archive_file_path: str):
-        assert archive_file_path.endswith(".zip")
-        archive_file_path = archive_file_path.removesuffix(".zip")
-        shutil.make_archive(
-            base_name=archive_file_path,
-            format="zip",
-            root_dir=self._directories[0],
+    @traced
+    def create_archive(
+        self,
+        archive_file_path: str,
+        base_archive_file_path: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ):
+        from file_manipulation.directory_archiver import DirectoryArchiver
+
+        DirectoryArchiver.create_archive(
+            directory_handler=self._get_listing_handler(),
+            archive_file_path=archive_file_path,
+            base_archive_file_path=base_archive_file_path,
+            progress=progress,
+        )
+
+    @traced
+    def verify_archive(
+        self,
+        archive_file_path: str,
+        key: bytes,
+        progress: Optional[OperationProgress] = None,
+    ) -> list:
+        """
+        Return
+        ----
+        list: Names of the archived files which are missing or corrupted.
+        """
+        from file_manipulation.directory_archiver import DirectoryArchiver
+
+        return DirectoryArchiver.verify_archive(
+            archive_file_path=archive_file_path,
+            key=self._get_archive_key(
+                archive_file_path=archive_file_path, key=key
+            ),
+            progress=progress,
+        )
+
+    @traced
+    def restore_archive(
+        self,
+        archive_file_path: str,
+        key: bytes,
+        progress: Optional[OperationProgress] = None,
+    ) -> list:
+        """
+        Write the archived files to all replicas, overwriting existing files
+        of the same names. If cancelled, the files written so far are kept.
+
+        Return
+        ----
+        list: Names of the archived files which are missing or corrupted, and
+            therefore not restored.
+        """
+        from file_manipulation.directory_archiver import DirectoryArchiver
+
+        corrupted_files_name = []
+        files_batch = {}
+        for file_name, data in DirectoryArchiver.iter_records(
+            archive_file_path=archive_file_path,
+            key=self._get_archive_key(
+                archive_file_path=archive_file_path, key=key
+            ),
+            progress=progress,
+        ):
+            if data is None:
+                corrupted_files_name.append(file_name)
+                continue
+            files_batch[file_name] = data
+            if len(files_batch) >= self.WRITE_BATCH_SIZE:
+                self.write_to_files(files=files_batch)
+                files_batch = {}
+        if len(files_batch) > 0:
+            self.write_to_files(files=files_batch)
+        return corrupted_files_name
+
+    def _for_each_handler(self, function: Callable):
+        if self._executor is None:
+            for handler in self._directory_handlers:
+                function(handler)
+            return
+        import concurrent.futures
+
+        ## Run in a copy of the context, so that the I/O is counted in the
+        ## operation of the caller
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, function, handler
+            )
+            for handler in self._directory_handlers
+        ]
+        ## Wait for all replicas before raising the first error, if any
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def _for_each_handler_in_quorum(
+        self, function: Callable, files_name: Iterable[str]
+    ):
+        """
+        Run a change of files on the synchronous replicas until the write
+        quorum of them succeeds. The replicas which fail, or are still
+        running, are marked behind on the files, to be caught up.
+
+        Raise
+        ----
+        Exception: the first error, if fewer replicas than the write quorum
+            succeed
+        """
+        files_name = list(files_name)
+        handlers = self._directory_handlers
+        with self._lag_condition:
+            self._n_changes += 1
+            for file_name in files_name:
+                self._file_versions[file_name] = self._n_changes
+            for handler in handlers:
+                self._n_pending_writes[handler] += 1
+
+        def run(handler: DirectoryHandlerWithEncryption):
+            try:
+                function(handler)
+            finally:
+                with self._lag_condition:
+                    self._n_pending_writes[handler] -= 1
+                    self._lag_condition.notify_all()
+
+        n_succeeded = 0
+        errors = []
+        lagging_handlers = []
+        if self._executor is None:
+            for handler in handlers:
+                if n_succeeded >= self._write_quorum:
+                    lagging_handlers.append(handler)
+                    with self._lag_condition:
+                        self._n_pending_writes[handler] -= 1
+                    continue
+                try:
+                    run(handler)
+                except Exception as e:
+                    errors.append(e)
+                    lagging_handlers.append(handler)
+                else:
+                    n_succeeded += 1
+        else:
+            import concurrent.futures
+
+            ## Run in a copy of the context, so that the I/O is counted in
+            ## the operation of the caller
+            futures = {
+                self._executor.submit(
+                    contextvars.copy_context().run, run, handler
+                ): handler
+                for handler in handlers
+            }
+            for future in concurrent.futures.as_completed(futures):
+                if future.exception() is None:
+                    n_succeeded += 1
+                    if n_succeeded >= self._write_quorum:
+                        break
+                else:
+                    errors.append(future.exception())
+            lagging_handlers = [
+                handler
+                for future, handler in futures.items()
+                if not future.done() or future.exception() is not None
+            ]
+        with self._lag_condition:
+            for handler in lagging_handlers:
+                self._lagging_files[handler].update(files_name)
+            self._prune_file_versions(files_name=files_name)
+        if len(lagging_handlers) > 0:
+            self._start_catch_up()
+        if n_succeeded < self._write_quorum:
+            raise errors[0]
+
+    def _start_catch_up(self):
+        if self._catch_up_thread is None and not self._is_closing:
+            self._catch_up_thread = threading.Thread(
+                target=self._catch_up_in_background,
+                name="catch_up",
+                daemon=True,
+            )
+            self._catch_up_thread.start()
+        self._catch_up_event.set()
+
+    def _catch_up_in_background(self):
+        while not self._is_closing:
+            self._catch_up_event.wait(timeout=self.CATCH_UP_RETRY_INTERVAL)
+            self._catch_up_event.clear()
+            if self._is_closing:
+                break
+            self._catch_up()
+
+    def _catch_up(self):
+        """
+        Copy the files on which synchronous replicas are behind from a
+        replica which is not, once the writes to them have finished.
+        """
+        for handler in self._directory_handlers:
+            with self._lag_condition:
+                if self._n_pending_writes[handler] > 0:
+                    continue
+                files_name = list(self._lagging_files[handler])
+            for file_name in files_name:
+                try:
+                    self._catch_up_file(handler=handler, file_name=file_name)
+                except (OSError, ValueError):
+                    ## Case: replica not reachable. Tried again later, and
+                    ## the next opening recovers the replica.
+                    self._io_stats.add(
+                        directory=handler.directory, name="n_catch_up_failures"
+                    )
+
+    def _catch_up_file(
+        self, handler: DirectoryHandlerWithEncryption, file_name: str
+    ):
+        with self._lag_condition:
+            version = self._file_versions.get(file_name, 0)
+        reference_handler = self._get_reference_handler(
+            file_name=file_name, excluded_handler=handler
+        )
+        if reference_handler is None:
+            ## Case: every replica is behind on the file, which only the
+            ## next opening recovers
+            return
+        reference_data = None
+        is_same = False
+        if file_name in reference_handler:
+            is_same = file_name in handler and handler.get_file_hash(
+                file_name=file_name
+            ) == reference_handler.get_file_hash(file_name=file_name)
+            if not is_same:
+                reference_data = reference_handler.read_from_file(
+                    file_name=file_name
+                )
+        ## Writes to the replica wait meanwhile, and a write started since
+        ## the reference was read makes the copy outdated
+        with handler.exclusive_lock():
+            with self._lag_condition:
+                if (
+                    self._file_versions.get(file_name, 0) != version
+                    or self._n_pending_writes[handler] > 0
+                ):
+                    return
+            if reference_data is not None:
+                handler.write_to_file(file_name=file_name, data=reference_data)
+                self._io_stats.add(
+                    directory=handler.directory, name="n_catch_ups"
+                )
+            elif not is_same and file_name in handler:
+                handler.delete_file(file_name=file_name)
+                self._io_stats.add(
+                    directory=handler.directory, name="n_catch_ups"
+                )
+            with self._lag_condition:
+                self._lagging_files[handler].discard(file_name)
+                self._prune_file_versions(files_name=(file_name,))
+
+    def _prune_file_versions(self, files_name: Iterable[str]):
+        """
+        Forget the versions of the files on which no replica is behind.
+        Called with `_lag_condition` held. A version forgotten during a
+        write is 0, which never matches a later one, as the sequence only
+        grows.
+        """
+        for file_name in files_name:
+            if not any(
+                file_name in lagging_files
+                for lagging_files in self._lagging_files.values()
+            ):
+                self._file_versions.pop(file_name, None)
+
+    def _get_up_to_date_handlers(self, file_name: str) -> list:
+        """Synchronous handlers which are not behind on a file."""
+        with self._lag_condition:
+            return [
+                h
+                for h in self._directory_handlers
+                if file_name not in self._lagging_files[h]
+            ]
+
+    def _get_reference_handler(
+        self,
+        file_name: str,
+        excluded_handler: Optional[DirectoryHandlerWithEncryption] = None,
+    ) -> DirectoryHandlerWithEncryption | None:
+        """
+        Return
+        ----
+        DirectoryHandlerWithEncryption | None: The most recently modified
+            synchronous handler which is not behind on a file, other than
+            `excluded_handler`. If `excluded_handler` is None, the first
+            handler when all are behind.
+        """
+        for handler in self._get_up_to_date_handlers(file_name=file_name):
+            if handler is not excluded_handler:
+                return handler
+        if excluded_handler is None:
+            return self._directory_handlers[0]
+        return None
+
+    def _get_listing_handler(self) -> DirectoryHandlerWithEncryption:
+        """
+        The most recently modified synchronous handler which is not behind
+        on any file, or the first handler if all are.
+        """
+        with self._lag_condition:
+            for handler in self._directory_handlers:
+                if (
+                    len(self._lagging_files[handler]) == 0
+                    and self._n_pending_writes[handler] == 0
+                ):
+                    return handler
+        return self._directory_handlers[0]
+
+    def _load_quorums(self) -> tuple[int, int]:
+        """
+        Return
+        ----
+        int: write quorum, all synchronous replicas by default
+        int: read quorum, one replica by default
+        """
+        n_replicas = len(self._directory_handlers)
+        for handler in self._directory_handlers:
+            data = handler.read_metadata(file_name=self.QUORUMS_FILE_NAME)
+            if data is None:
+                continue
+            quorums = json.loads(data.decode(OutboundQueue.STRING_ENCODING))
+            return (
+                min(max(quorums["write"], 1), n_replicas),
+                min(max(quorums["read"], 1), n_replicas),
+            )
+        return n_replicas, 1
+
+    def _get_reachable_handlers(self) -> list:
+        """Handlers of the synchronous and reachable asynchronous replicas."""
+        return self._directory_handlers + [
+            h
+            for d, h in self._asynchronous_handlers.items()
+            if h is not None and self._is_reachable(directory=d)
+        ]
+
+    @classmethod
+    def _is_reachable(cls, directory: str) -> bool:
+        """
+        Whether a replica which was opened before is reachable. Checked
+        before writing it, as writing an unmounted drive or share would
+        create the replica again under its mount point.
+        """
+        return os.path.isdir(
+            os.path.join(directory, DirectoryHandler.METADATA_SUBDIRECTORY)
+        )
+
+    def _open_replica(self, directory: str) -> DirectoryHandlerWithEncryption:
+        handler = DirectoryHandler(
+            directory=directory, io_stats=self._io_stats
+        )
+        replica_id = handler.read_metadata(file_name=self.REPLICA_ID_FILE_NAME)
+        if replica_id is None:
+            replica_id = self._generate_replica_id()
+            handler.write_metadata(
+                file_name=self.REPLICA_ID_FILE_NAME, data=replica_id
+            )
+        return DirectoryHandlerWithEncryption(
+            directory=directory,
+            key=self._get_replica_key(key=self._key, replica_id=replica_id),
+            io_stats=self._io_stats,
+            inventory=self._inventory,
+            layout=self._layout,
+        )
+
+    def _put_to_outbound_queues(self, operation: str, files: dict):
+        ## Queued before the synchronous replicas are written, so that a
+        ## change committed to them is never lost by a crash
+        if len(self._outbound_queues) == 0:
+            return
+        for queue in self._outbound_queues.values():
+            queue.put(operation=operation, files=files)
+        self._outbound_event.set()
+
+    def _drain_outbound_queues_in_background(self):
+        while not self._is_closing:
+            self._outbound_event.wait(
+                timeout=self.OUTBOUND_QUEUE_RETRY_INTERVAL
+            )
+            self._outbound_event.clear()
+            if self._is_closing:
+                break
+            self._drain_outbound_queues()
+
+    def _drain_outbound_queues(self):
+        """Drain the queue of every reachable asynchronous replica."""
+        for d in self._outbound_queues:
+            try:
+                self._drain_outbound_queue(directory=d)
+            except (OSError, ValueError):
+                ## Case: replica disconnected, or queue corrupted. Tried
+                ## again later, and the next opening recovers the replica.
+                self._io_stats.add(directory=d, name="n_drain_failures")
+
+    def _drain_outbound_queue(self, directory: str):
+        """
+        Apply the changes of the outbound queue of an asynchronous replica,
+        in order, opening the replica first if it was not reachable.
+
+        Raise
+        ----
+        OSError: if the replica is not reachable
+        ValueError: if the queue is corrupted
+        """
+        queue = self._outbound_queues[directory]
+        with queue.drain_lock():
+            if not self._is_reachable(directory=directory):
+                ## Case: drive or share of the replica not mounted
+                raise FileNotFoundError(
+                    f"Replica \"{directory}\" is not reachable"
+                )
+            handler = self._asynchronous_handlers[directory]
+            if handler is None:
+                handler = self._open_replica(directory=directory)
+                self._asynchronous_handlers[directory] = handler
+            for entry_name, operation, files in queue.get_entries():
+                if operation == OutboundQueue.WRITE:
+                    handler.write_to_files(files=files)
+                elif operation == OutboundQueue.DELETE:
+                    for file_name in files:
+                        try:
+                            handler.delete_file(file_name=file_name)
+                        except FileNotFoundError:
+                            pass
+                elif operation == OutboundQueue.WRITE_METADATA:
+                    for file_name, data in files.items():
+                        handler.write_metadata(file_name=file_name, data=data)
+                elif operation == OutboundQueue.DELETE_METADATA:
+                    for file_name in files:
+                        handler.delete_metadata(file_name=file_name)
+                else:
+                    raise ValueError(f"Unknown queued operation {operation}")
+                queue.remove(entry_name=entry_name)
+                self._io_stats.add(
+                    directory=directory, name="n_drained_changes"
+                )
+
+    def _get_archive_key(self, archive_file_path: str, key: bytes) -> bytes:
+        from file_manipulation.directory_archiver import DirectoryArchiver
+
+        replica_id = DirectoryArchiver.read_metadata(
+            archive_file_path=archive_file_path,
+            file_name=self.REPLICA_ID_FILE_NAME,
         )
+        return self._get_replica_key(key=key, replica_id=replica_id)
+
+    @classmethod
+    def _get_replica_key(cls, key: bytes, replica_id: bytes) -> bytes:
+        return hashlib.sha256(key + replica_id).digest()
 
     def _generate_replica_id(self) -> bytes:
         return hashlib.sha256(time.time_ns().to_bytes(8, "big")).digest()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import contextlib
+import threading
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:
+    ## Case: Windows, where the lock only excludes the threads of this
+    ## process
+    fcntl = None
+
+
+class DirectoryLock:
+    """
+    Shared-reader / single-writer lock of a directory, across the threads of
+    this process and across processes.
+
+    Between processes, it is an `fcntl.flock` of a lock file, held shared
+    while any thread of this process reads and exclusively while a thread
+    writes. Between threads, readers share the lock, and a writer excludes
+    the other threads. A thread holding the exclusive lock may take either
+    lock again, but a thread holding the shared lock cannot take the
+    exclusive lock.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Parameters
+        ----
+        file_path : str
+            Path of the lock file, created on first use.
+        """
+        self._file_path = file_path
+        self._file = None
+        self._condition = threading.Condition()
+        ## Number of shared holders, in all threads
+        self._n_shared = 0
+        self._exclusive_owner = None
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def shared(self) -> Iterator[bool]:
+        """
+        Yield
+        ----
+        bool: whether the lock of the file was taken by this call, rather
+            than already held by this process
+        """
+        if self._exclusive_owner == threading.get_ident() or getattr(
+            self._local, "is_shared", False
+        ):
+            ## Case: held by this thread already
+            yield False
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self._exclusive_owner is None)
+            is_acquired = self._n_shared == 0
+            if is_acquired:
+                self._lock_file(operation="LOCK_SH")
+            self._n_shared += 1
+        self._local.is_shared = True
+        try:
+            yield is_acquired
+        finally:
+            self._local.is_shared = False
+            with self._condition:
+                self._n_shared -= 1
+                if self._n_shared == 0:
+                    self._lock_file(operation="LOCK_UN")
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self) -> Iterator[bool]:
+        """
+        Yield
+        ----
+        bool: whether the lock of the file was taken by this call, rather
+            than already held by this thread
+
+        Raise
+        ----
+        RuntimeError: if this thread holds the shared lock
+        """
+        if self._exclusive_owner == threading.get_ident():
+            yield False
+            return
+        if getattr(self._local, "is_shared", False):
+            raise RuntimeError(
+                "Cannot take the exclusive lock while holding the shared lock"
+            )
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._exclusive_owner is None and self._n_shared == 0
+            )
+            self._lock_file(operation="LOCK_EX")
+            self._exclusive_owner = threading.get_ident()
+        try:
+            yield True
+        finally:
+            with self._condition:
+                self._exclusive_owner = None
+                self._lock_file(operation="LOCK_UN")
+                self._condition.notify_all()
+
+    def _lock_file(self, operation: str):
+        if fcntl is None:
+            return
+        if self._file is None:
+            self._file = open(self._file_path, "ab")
+        fcntl.flock(self._file.fileno(), getattr(fcntl, operation))
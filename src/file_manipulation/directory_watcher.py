@@ -0,0 +1,198 @@
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import Iterable
+
+
+class DirectoryWatcher:
+    """
+    Report the entries of directories changed since the last report, so that
+    a change can be applied without listing the directories again.
+
+    `create` returns an `InotifyDirectoryWatcher` on Linux, or a
+    `PollingDirectoryWatcher` elsewhere.
+    """
+
+    @classmethod
+    def create(cls) -> DirectoryWatcher:
+        try:
+            return InotifyDirectoryWatcher()
+        except OSError:
+            return PollingDirectoryWatcher()
+
+    def watch(self, directory: str, files_name: Iterable[str] = ()):
+        """
+        Parameters
+        ----
+        directory : str
+            Directory whose entries are added, deleted, written and renamed.
+        files_name : Iterable[str]
+            Files of the directory which are rewritten in place, so that
+            polling the directory alone misses them.
+        """
+        raise NotImplementedError
+
+    def get_changes(self) -> dict:
+        """
+        Return
+        ----
+        dict: Directory -> names of its changed entries, or None if they
+            are unknown, of the directories changed since the last call
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InotifyDirectoryWatcher(DirectoryWatcher):
+    """Events of the directories from the Linux inotify API, via ctypes."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (
+        IN_MODIFY
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+    )
+    ## struct inotify_event: int wd; uint32_t mask, cookie, len; char name[]
+    EVENT_HEADER = struct.Struct("iIII")
+    READ_SIZE = 64 * 1024
+
+    def __init__(self):
+        """
+        Raise
+        ----
+        OSError: if inotify is not available
+        """
+        library_name = ctypes.util.find_library("c")
+        if library_name is None:
+            raise OSError("C library is not found")
+        self._libc = ctypes.CDLL(library_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        ## Watch descriptor -> directory
+        self._directories = {}
+
+    def watch(self, directory: str, files_name: Iterable[str] = ()):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), self.WATCH_MASK
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self._directories[wd] = directory
+
+    def get_changes(self) -> dict:
+        changes = {}
+        while True:
+            try:
+                data = os.read(self._fd, self.READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = self.EVENT_HEADER.unpack_from(
+                    data, offset
+                )
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(
+                    data[offset : offset + name_length].rstrip(b"\0")
+                )
+                offset += name_length
+                if mask & self.IN_Q_OVERFLOW:
+                    ## Case: events were dropped by the kernel
+                    return {d: None for d in self._directories.values()}
+                directory = self._directories.get(wd)
+                if directory is None:
+                    continue
+                if mask & (
+                    self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF
+                ):
+                    changes[directory] = None
+                    if mask & self.IN_IGNORED:
+                        del self._directories[wd]
+                    continue
+                names = changes.setdefault(directory, set())
+                if names is not None and name != "":
+                    names.add(name)
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
+
+class PollingDirectoryWatcher(DirectoryWatcher):
+    """
+    Changes found by comparing the modification times of the directories,
+    and of the files rewritten in place, on each call.
+    """
+
+    def __init__(self):
+        ## Directory -> its signature, and the signature of each file
+        self._signatures = {}
+
+    def watch(self, directory: str, files_name: Iterable[str] = ()):
+        self._signatures[directory] = (
+            self._get_signature(path=directory),
+            {
+                f: self._get_signature(path=os.path.join(directory, f))
+                for f in files_name
+            },
+        )
+
+    def get_changes(self) -> dict:
+        changes = {}
+        for directory, (signature, files_signature) in list(
+            self._signatures.items()
+        ):
+            new_signature = self._get_signature(path=directory)
+            changed_files_name = set()
+            for file_name, file_signature in files_signature.items():
+                new_file_signature = self._get_signature(
+                    path=os.path.join(directory, file_name)
+                )
+                if new_file_signature != file_signature:
+                    files_signature[file_name] = new_file_signature
+                    changed_files_name.add(file_name)
+            if new_signature != signature:
+                ## Case: entries added or deleted, which are not known
+                self._signatures[directory] = (new_signature, files_signature)
+                changes[directory] = None
+            elif len(changed_files_name) > 0:
+                changes[directory] = changed_files_name
+        return changes
+
+    @classmethod
+    def _get_signature(cls, path: str) -> tuple | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
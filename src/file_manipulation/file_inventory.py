@@ -0,0 +1,153 @@
+from __future__ import annotations
+import sys
+import threading
+from typing import Iterable, Iterator
+
+
+class FileInventory:
+    """
+    Names of the files of several replicas, each name stored once, with a
+    bitmap of the replicas which have the file.
+
+    Replicas of a vault have nearly the same files, so sharing the names
+    takes about the memory of one replica rather than one per replica. The
+    files of a replica are listed by filtering the shared names by its bit,
+    rather than kept as a set per replica.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        ## File name -> bitmap of the replicas which have the file
+        self._presence = {}
+        self._n_replicas = 0
+        ## Replica index -> number of files
+        self._n_files = []
+
+    def add_replica(self) -> ReplicaInventory:
+        """Return the view of a new replica, which has no files yet."""
+        with self._lock:
+            replica_index = self._n_replicas
+            self._n_replicas += 1
+            self._n_files.append(0)
+        return ReplicaInventory(inventory=self, replica_index=replica_index)
+
+    def get_n_names(self) -> int:
+        """Number of distinct file names across the replicas."""
+        return len(self._presence)
+
+    def contains(self, replica_index: int, file_name: str) -> bool:
+        return (self._presence.get(file_name, 0) >> replica_index) & 1 == 1
+
+    def add(self, replica_index: int, file_names: Iterable[str]):
+        bit = 1 << replica_index
+        with self._lock:
+            n_files = self._n_files[replica_index]
+            for file_name in file_names:
+                presence = self._presence.get(file_name, 0)
+                if presence & bit:
+                    continue
+                if presence == 0:
+                    file_name = sys.intern(file_name)
+                self._presence[file_name] = presence | bit
+                n_files += 1
+            self._n_files[replica_index] = n_files
+
+    def remove(self, replica_index: int, file_name: str):
+        """
+        Raise
+        ----
+        KeyError: if the replica does not have the file
+        """
+        bit = 1 << replica_index
+        with self._lock:
+            presence = self._presence.get(file_name, 0)
+            if not presence & bit:
+                raise KeyError(file_name)
+            presence &= ~bit
+            if presence == 0:
+                del self._presence[file_name]
+            else:
+                self._presence[file_name] = presence
+            self._n_files[replica_index] -= 1
+
+    def get_presence_snapshot(self) -> list:
+        """
+        Return
+        ----
+        list: (file name, bitmap of the replicas which have the file) of
+            every file name
+        """
+        with self._lock:
+            return list(self._presence.items())
+
+    def get_n_files(self, replica_index: int) -> int:
+        return self._n_files[replica_index]
+
+    def iter_files(self, replica_index: int) -> Iterator[str]:
+        """
+        Yield the files of a replica. The shared names are listed when the
+        iteration starts, so the replica may be changed meanwhile: a file
+        removed since is skipped, and a file added since may be missed.
+        """
+        bit = 1 << replica_index
+        with self._lock:
+            ## References to the shared names, not a set of the replica
+            files_name = list(self._presence)
+        for file_name in files_name:
+            if self._presence.get(file_name, 0) & bit:
+                yield file_name
+
+    def snapshot(self, replica_index: int) -> frozenset:
+        """
+        Return the files of a replica, which later changes do not affect.
+        It is built on each call, for callers which keep the set.
+        """
+        return frozenset(self.iter_files(replica_index=replica_index))
+
+
+class ReplicaInventory:
+    """
+    The files of one replica in a `FileInventory`, used like a set of file
+    names.
+    """
+
+    def __init__(self, inventory: FileInventory, replica_index: int):
+        self._inventory = inventory
+        self._replica_index = replica_index
+
+    def __contains__(self, file_name: str) -> bool:
+        return self._inventory.contains(
+            replica_index=self._replica_index, file_name=file_name
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return self._inventory.iter_files(replica_index=self._replica_index)
+
+    def __len__(self) -> int:
+        return self._inventory.get_n_files(replica_index=self._replica_index)
+
+    @property
+    def inventory(self) -> FileInventory:
+        return self._inventory
+
+    @property
+    def replica_index(self) -> int:
+        return self._replica_index
+
+    def add(self, file_name: str):
+        self._inventory.add(
+            replica_index=self._replica_index, file_names=(file_name,)
+        )
+
+    def update(self, file_names: Iterable[str]):
+        self._inventory.add(
+            replica_index=self._replica_index, file_names=file_names
+        )
+
+    def remove(self, file_name: str):
+        self._inventory.remove(
+            replica_index=self._replica_index, file_name=file_name
+        )
+
+    def snapshot(self) -> frozenset:
+        return self._inventory.snapshot(replica_index=self._replica_index)
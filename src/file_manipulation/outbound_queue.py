@@ -0,0 +1,206 @@
+from __future__ import annotations
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Iterator, Optional
+
+from data_encryption.cipher_helper import CipherHelper
+from file_manipulation.directory_lock import DirectoryLock
+from util.io_stats import IoStats
+
+
+class OutboundQueue:
+    """
+    Durable queue of the changes to apply to an asynchronous replica, kept
+    in a directory of a synchronous replica.
+
+    Each change is an entry file, named by its time of queueing and sorted
+    by it. An entry is encrypted under the key of the queue with a random
+    nonce, as entries are queued by several processes, and ends with the
+    SHA-256 of its content. It is written to a temporary file which is then
+    renamed, so a crash never leaves a partial entry.
+    """
+
+    WRITE = "write"
+    DELETE = "delete"
+    WRITE_METADATA = "write_metadata"
+    DELETE_METADATA = "delete_metadata"
+    LOCK_FILE_NAME = "lock"
+    TEMPORARY_FILE_SUFFIX = ".tmp"
+    SEQUENCE_NUM_DIGITS = 20
+    SUFFIX_NUM_BYTES = 4
+    DIGEST_NUM_BYTES = 32
+    STRING_ENCODING = "utf-8"
+
+    def __init__(
+        self,
+        directory: str,
+        key: bytes,
+        replica_directory: str,
+        io_stats: Optional[IoStats] = None,
+    ):
+        """
+        Parameters
+        ----
+        directory : str
+            Directory of the entries, created if it does not exist.
+        key : bytes
+            Key of the queue.
+        replica_directory : str
+            Directory of the asynchronous replica, under which the queued
+            changes are counted in `io_stats`.
+        io_stats : IoStats | None
+        """
+        self._directory = directory
+        self._key = key
+        self._replica_directory = replica_directory
+        self._io_stats = IoStats() if io_stats is None else io_stats
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_sequence = 0
+        ## Excludes the drains of other threads and processes, so that the
+        ## changes are applied once and in order
+        self._drain_lock = DirectoryLock(
+            file_path=os.path.join(self._directory, self.LOCK_FILE_NAME)
+        )
+
+    def __len__(self) -> int:
+        return len(self._list_entries_name())
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @classmethod
+    def get_key(cls, key: bytes) -> bytes:
+        """Key of the queues of a vault, derived from the key of the vault."""
+        return hashlib.sha256(key + b"outbound_queue").digest()
+
+    @contextlib.contextmanager
+    def drain_lock(self) -> Iterator[None]:
+        with self._drain_lock.exclusive():
+            yield
+
+    def put(self, operation: str, files: dict):
+        """
+        Parameters
+        ----
+        operation : str
+            `WRITE`, `DELETE`, `WRITE_METADATA` or `DELETE_METADATA`.
+        files : dict
+            File name -> data to write, or None to delete.
+        """
+        with self._lock:
+            sequence = max(time.time_ns(), self._last_sequence + 1)
+            self._last_sequence = sequence
+        entry_name = "{:0{}d}-{}".format(
+            sequence,
+            self.SEQUENCE_NUM_DIGITS,
+            secrets.token_hex(self.SUFFIX_NUM_BYTES),
+        )
+        data = self._pack_entry(operation=operation, files=files)
+        self._write_entry(entry_name=entry_name, data=data)
+        self._io_stats.add(
+            directory=self._replica_directory, name="n_queued_changes"
+        )
+        self._io_stats.add(
+            directory=self._replica_directory,
+            name="n_bytes_queued",
+            value=len(data),
+        )
+
+    def get_entries(self) -> list:
+        """
+        Return
+        ----
+        list: (entry name, operation, files) of each entry, in order
+
+        Raise
+        ----
+        ValueError: if an entry is corrupted, or the key is incorrect
+        """
+        entries = []
+        for entry_name in self._list_entries_name():
+            try:
+                with open(
+                    os.path.join(self._directory, entry_name), "rb"
+                ) as f:
+                    data = f.read()
+            except FileNotFoundError:
+                ## Case: drained by another process meanwhile
+                continue
+            operation, files = self._unpack_entry(data=data)
+            entries.append((entry_name, operation, files))
+        return entries
+
+    def remove(self, entry_name: str):
+        try:
+            os.remove(os.path.join(self._directory, entry_name))
+        except FileNotFoundError:
+            pass
+
+    def change_key(self, new_key: bytes):
+        """Re-encrypt the entries left in the queue with a new key."""
+        with self.drain_lock():
+            entries = self.get_entries()
+            self._key = new_key
+            for entry_name, operation, files in entries:
+                self._write_entry(
+                    entry_name=entry_name,
+                    data=self._pack_entry(operation=operation, files=files),
+                )
+
+    def _list_entries_name(self) -> list:
+        return sorted(
+            name
+            for name in os.listdir(self._directory)
+            if name != self.LOCK_FILE_NAME
+            and not name.endswith(self.TEMPORARY_FILE_SUFFIX)
+        )
+
+    def _write_entry(self, entry_name: str, data: bytes):
+        file_path = os.path.join(self._directory, entry_name)
+        temporary_file_path = file_path + self.TEMPORARY_FILE_SUFFIX
+        with open(temporary_file_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_file_path, file_path)
+
+    def _pack_entry(self, operation: str, files: dict) -> bytes:
+        content = json.dumps(
+            {
+                "operation": operation,
+                "files": {
+                    file_name: (
+                        None
+                        if data is None
+                        else base64.b64encode(data).decode("ascii")
+                    )
+                    for file_name, data in files.items()
+                },
+            }
+        ).encode(self.STRING_ENCODING)
+        return CipherHelper.encrypt_and_pack(
+            data=content + hashlib.sha256(content).digest(),
+            key=self._key,
+            nonce=secrets.token_bytes(CipherHelper.NONCE_NUM_BYTES),
+        )
+
+    def _unpack_entry(self, data: bytes) -> tuple[str, dict]:
+        data = CipherHelper.unpack_and_decrypt(packed_data=data, key=self._key)
+        content = data[: -self.DIGEST_NUM_BYTES]
+        digest = data[-self.DIGEST_NUM_BYTES :]
+        if hashlib.sha256(content).digest() != digest:
+            raise ValueError(
+                f"Entry of the outbound queue \"{self._directory}\" is "
+                "corrupted, or the key is incorrect"
+            )
+        entry = json.loads(content.decode(self.STRING_ENCODING))
+        return entry["operation"], {
+            file_name: None if data is None else base64.b64decode(data)
+            for file_name, data in entry["files"].items()
+        }
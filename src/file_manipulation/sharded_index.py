@@ -0,0 +1,166 @@
+from __future__ import annotations
+import hmac
+import json
+import os
+import secrets
+from typing import Callable, Iterable
+
+
+class ShardedIndex:
+    """
+    Map the names of the files of a sharded directory to storage IDs, which
+    are safe file names and reveal nothing of the names.
+
+    The ID of a name is its HMAC under a random key of the directory, so the
+    index only needs to keep the names. The names are kept in an append-only
+    log of encrypted records: a header with the HMAC key, then the names
+    added and deleted by each change. A name is added to the log before its
+    file is written, and deleted after its file is deleted, so that a name
+    without file, after a crash, is simply ignored.
+
+    Each record is framed by its length, so a record torn by a crash at the
+    end of the log is dropped.
+    """
+
+    VERSION = 1
+    ID_KEY_NUM_BYTES = 32
+    STORAGE_ID_NUM_BYTES = 16
+    SHARD_PREFIX_LENGTH = 2
+    LENGTH_NUM_BYTES = 4
+    BYTE_ORDER = "big"
+    STRING_ENCODING = "utf-8"
+
+    def __init__(self, id_key: bytes):
+        self._id_key = id_key
+
+    @classmethod
+    def generate(cls) -> ShardedIndex:
+        return cls(id_key=secrets.token_bytes(cls.ID_KEY_NUM_BYTES))
+
+    def get_storage_id(self, file_name: str) -> str:
+        return hmac.digest(
+            self._id_key, file_name.encode(self.STRING_ENCODING), "sha256"
+        )[: self.STORAGE_ID_NUM_BYTES].hex()
+
+    @classmethod
+    def get_relative_path(cls, storage_id: str) -> str:
+        """Path of a file in the directory, in the shard of its ID prefix."""
+        return os.path.join(storage_id[: cls.SHARD_PREFIX_LENGTH], storage_id)
+
+    @classmethod
+    def is_shard_name(cls, name: str) -> bool:
+        return len(name) == cls.SHARD_PREFIX_LENGTH and all(
+            c in "0123456789abcdef" for c in name
+        )
+
+    def pack_header(self, encrypt: Callable) -> bytes:
+        """
+        Parameters
+        ----
+        encrypt : Callable
+            Encrypt and pack bytes with the key of the directory.
+        """
+        return self._pack_record(
+            record={"version": self.VERSION, "id_key": self._id_key.hex()},
+            encrypt=encrypt,
+        )
+
+    def pack_changes(
+        self,
+        encrypt: Callable,
+        added: Iterable[str] = (),
+        deleted: Iterable[str] = (),
+    ) -> bytes:
+        return self._pack_record(
+            record={"added": list(added), "deleted": list(deleted)},
+            encrypt=encrypt,
+        )
+
+    @classmethod
+    def unpack(
+        cls, data: bytes, decrypt: Callable
+    ) -> tuple[ShardedIndex, set, int, int]:
+        """
+        Parameters
+        ----
+        data : bytes
+            The whole log.
+        decrypt : Callable
+            Unpack and decrypt bytes with the key of the directory.
+
+        Return
+        ----
+        ShardedIndex
+        set: names in the index
+        int: number of records of changes in the log
+        int: number of bytes of the complete records, from which the records
+            appended later are read by `unpack_changes`
+
+        Raise
+        ----
+        ValueError: if the key is incorrect, or the log is corrupted
+        """
+        records, n_bytes = cls._unpack_records(data=data, decrypt=decrypt)
+        if len(records) == 0 or records[0].get("version") != cls.VERSION:
+            raise ValueError("Index has no valid header")
+        index = cls(id_key=bytes.fromhex(records[0]["id_key"]))
+        names = set()
+        for record in records[1:]:
+            names.update(record["added"])
+            names.difference_update(record["deleted"])
+        return index, names, len(records) - 1, n_bytes
+
+    @classmethod
+    def unpack_changes(
+        cls, data: bytes, decrypt: Callable
+    ) -> tuple[list, int]:
+        """
+        Parameters
+        ----
+        data : bytes
+            Records of changes appended to the log.
+        decrypt : Callable
+
+        Return
+        ----
+        list: (names added, names deleted) of each record, in order
+        int: number of bytes of the complete records
+        """
+        records, n_bytes = cls._unpack_records(data=data, decrypt=decrypt)
+        return [(r["added"], r["deleted"]) for r in records], n_bytes
+
+    @classmethod
+    def _unpack_records(
+        cls, data: bytes, decrypt: Callable
+    ) -> tuple[list, int]:
+        records = []
+        offset = 0
+        while offset + cls.LENGTH_NUM_BYTES <= len(data):
+            length = int.from_bytes(
+                data[offset : offset + cls.LENGTH_NUM_BYTES],
+                byteorder=cls.BYTE_ORDER,
+                signed=False,
+            )
+            if offset + cls.LENGTH_NUM_BYTES + length > len(data):
+                ## Case: record torn by a crash while it was appended
+                break
+            offset += cls.LENGTH_NUM_BYTES
+            records.append(
+                json.loads(
+                    decrypt(data[offset : offset + length]).decode(
+                        cls.STRING_ENCODING
+                    )
+                )
+            )
+            offset += length
+        return records, offset
+
+    @classmethod
+    def _pack_record(cls, record: dict, encrypt: Callable) -> bytes:
+        packed = encrypt(json.dumps(record).encode(cls.STRING_ENCODING))
+        return (
+            len(packed).to_bytes(
+                cls.LENGTH_NUM_BYTES, byteorder=cls.BYTE_ORDER, signed=False
+            )
+            + packed
+        )
@@ -1,5 +1,29 @@
+from collections import deque
+import dataclasses
 from enum import Enum
-from typing import Callable, Optional
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from fsm.fsm_instrumentation import FsmInstrumentation
+
+
+@dataclasses.dataclass(frozen=True)
+class FsmEvent:
+    """Base class of the events dispatched by an event-driven `EnumFsm`."""
+
+
+@dataclasses.dataclass(frozen=True)
+class StateEntered(FsmEvent):
+    """Posted when the FSM starts, and after every transition."""
+
+    state: Enum
+
+
+class _StateEntry(NamedTuple):
+    stay_callback: Callable
+    enter_callback: Optional[Callable]
+    exit_callback: Optional[Callable]
+    transitions: Optional[frozenset]
 
 
 class EnumFsm:
@@ -8,36 +32,98 @@ class EnumFsm:
         start_state: Enum,
         exit_state: Enum,
         on_state_changed: Optional[Callable] = None,
+        is_event_driven: bool = False,
+        instrumentation: Optional[FsmInstrumentation] = None,
     ):
+        """
+        Parameters
+        ----
+        start_state : Enum
+        exit_state : Enum
+        on_state_changed : Callable | None
+            Called with `current_state` and `next_state` on every transition.
+        is_event_driven : bool
+            If False, the stay callback of the current state is called on
+            every `update`, and takes no argument. If True, events are queued
+            by `post_event`, and the stay callback is called with each event
+            by `dispatch`.
+        instrumentation : FsmInstrumentation | None
+            Records the dwell time of each state and the latencies of the
+            callbacks.
+        """
         self._on_state_changed = on_state_changed
         self._current_state = start_state
         self._exit_state = exit_state
+        self._is_event_driven = is_event_driven
+        self._instrumentation = instrumentation
         self._is_ready = False
         self._states = set()
         self._state_enter_callbacks = {}
         self._state_stay_callbacks = {}
         self._state_exit_callbacks = {}
+        self._state_transitions = {}
+        self._table = {}
+        self._events = deque()
 
     @property
     def current_state(self) -> Enum:
         return self._current_state
 
+    @property
+    def has_pending_events(self) -> bool:
+        return len(self._events) > 0
+
     def add_state(
         self,
         state: Enum,
         stay_callback: Callable,
         enter_callback: Optional[Callable] = None,
         exit_callback: Optional[Callable] = None,
+        transitions: Optional[Iterable[Enum]] = None,
     ):
+        """
+        Parameters
+        ----
+        transitions : Iterable[Enum] | None
+            States which this state may transition to. If None, any added
+            state is allowed.
+        """
         assert self._is_ready is False, "Cannot add state after FSM is ready"
         self._states.add(state)
         self._state_stay_callbacks[state] = stay_callback
         self._state_enter_callbacks[state] = enter_callback
         self._state_exit_callbacks[state] = exit_callback
+        self._state_transitions[state] = (
+            None if transitions is None else frozenset(transitions)
+        )
 
     def start(self):
+        """Validate the states and their transitions, once for all steps."""
         assert self._current_state in self._states
+        assert self._exit_state in self._states
+        for state, transitions in self._state_transitions.items():
+            if transitions is None:
+                continue
+            unknown_states = transitions - self._states
+            assert (
+                len(unknown_states) == 0
+            ), "Unknown transitions from state \"{}\": {}".format(
+                state, unknown_states
+            )
+        self._table = {
+            state: _StateEntry(
+                stay_callback=self._state_stay_callbacks[state],
+                enter_callback=self._state_enter_callbacks[state],
+                exit_callback=self._state_exit_callbacks[state],
+                transitions=self._state_transitions[state],
+            )
+            for state in self._states
+        }
         self._is_ready = True
+        if self._instrumentation is not None:
+            self._instrumentation.on_state_entered(state=self._current_state)
+        if self._is_event_driven is True:
+            self._events.append(StateEntered(state=self._current_state))
 
     def update(self) -> bool:
         """Advance the FSM by one step.
@@ -46,21 +132,76 @@ class EnumFsm:
             bool: True if the FSM is exited, False otherwise.
         """
         assert self._is_ready is True, "FSM is not ready"
-        next_state = self._state_stay_callbacks[self._current_state]()
-        assert (
-            next_state in self._states
-        ), "Invalid next state from state \"{}\"".format(self._current_state)
-        if next_state == self._current_state:
-            return self._current_state == self._exit_state
-        exit_function = self._state_exit_callbacks[self._current_state]
-        if exit_function is not None:
-            exit_function()
+        assert self._is_event_driven is False, "Use dispatch() instead"
+        next_state = self._call_callback(
+            "stay", self._table[self._current_state].stay_callback
+        )
+        if next_state != self._current_state:
+            self._transit(next_state=next_state)
+        return self._current_state == self._exit_state
+
+    def post_event(self, event: FsmEvent):
+        self._events.append(event)
+
+    def dispatch(self) -> bool:
+        """Dispatch the queued events to the current state, one by one.
+
+        Returns:
+            bool: True if the FSM is exited, False otherwise.
+        """
+        while len(self._events) > 0:
+            if self._current_state == self._exit_state:
+                self._events.clear()
+                break
+            event = self._events.popleft()
+            next_state = self._call_callback(
+                "stay", self._table[self._current_state].stay_callback, event
+            )
+            if next_state != self._current_state:
+                self._transit(next_state=next_state)
+        return self._current_state == self._exit_state
+
+    def _transit(self, next_state: Enum):
+        """
+        Events posted before the transition were meant for the previous state,
+        so they are discarded.
+        """
+        current_entry = self._table[self._current_state]
+        if (
+            current_entry.transitions is not None
+            and next_state not in current_entry.transitions
+        ) or next_state not in self._table:
+            raise ValueError(
+                "Invalid next state \"{}\" from state \"{}\"".format(
+                    next_state, self._current_state
+                )
+            )
+        if current_entry.exit_callback is not None:
+            self._call_callback("exit", current_entry.exit_callback)
         if self._on_state_changed is not None:
             self._on_state_changed(
                 current_state=self._current_state, next_state=next_state
             )
         self._current_state = next_state
-        enter_function = self._state_enter_callbacks[self._current_state]
+        if self._instrumentation is not None:
+            self._instrumentation.on_state_entered(state=next_state)
+        if self._is_event_driven is True:
+            self._events.clear()
+            self._events.append(StateEntered(state=next_state))
+        enter_function = self._table[next_state].enter_callback
         if enter_function is not None:
-            enter_function()
-        return self._current_state == self._exit_state
+            self._call_callback("enter", enter_function)
+
+    def _call_callback(self, callback_type: str, callback: Callable, *args):
+        if self._instrumentation is None:
+            return callback(*args)
+        state = self._current_state
+        start_time = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            self._instrumentation.on_callback_returned(
+                state=state,
+                callback_type=callback_type,
+                latency=time.perf_counter() - start_time,
+            )
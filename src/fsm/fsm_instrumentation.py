@@ -0,0 +1,203 @@
+from __future__ import annotations
+import bisect
+import datetime
+from enum import Enum
+import json
+import time
+
+
+class LatencyHistogram:
+    """Count latencies into fixed buckets, cheap enough for every call."""
+
+    ## Upper bounds of the buckets, in seconds. The last bucket is unbounded.
+    BUCKET_BOUNDS = (
+        0.0001,
+        0.00025,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+    )
+
+    def __init__(self):
+        self._counts = [0] * (len(self.BUCKET_BOUNDS) + 1)
+        self._n_samples = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
+
+    @property
+    def n_samples(self) -> int:
+        return self._n_samples
+
+    @property
+    def total_time(self) -> float:
+        return self._total_time
+
+    def add(self, latency: float):
+        self._counts[bisect.bisect_left(self.BUCKET_BOUNDS, latency)] += 1
+        self._n_samples += 1
+        self._total_time += latency
+        self._max_time = max(self._max_time, latency)
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Returns
+        ----
+        float
+            Upper bound of the bucket holding the percentile, in seconds.
+            The maximum latency for the unbounded bucket.
+        """
+        if self._n_samples == 0:
+            return 0.0
+        rank = percentile / 100 * self._n_samples
+        n_samples = 0
+        for bound, count in zip(self.BUCKET_BOUNDS, self._counts):
+            n_samples += count
+            if n_samples >= rank:
+                return min(bound, self._max_time)
+        return self._max_time
+
+    def to_dict(self) -> dict:
+        buckets = {}
+        for bound, count in zip(self.BUCKET_BOUNDS, self._counts):
+            if count > 0:
+                buckets[f"<={bound * 1000:g}ms"] = count
+        if self._counts[-1] > 0:
+            max_bound = self.BUCKET_BOUNDS[-1]
+            buckets[f">{max_bound * 1000:g}ms"] = self._counts[-1]
+        return {
+            "n_samples": self._n_samples,
+            "total_ms": round(self._total_time * 1000, 3),
+            "max_ms": round(self._max_time * 1000, 3),
+            "p50_ms": round(self.get_percentile(50) * 1000, 3),
+            "p99_ms": round(self.get_percentile(99) * 1000, 3),
+            "buckets": buckets,
+        }
+
+
+class _StateStats:
+    def __init__(self):
+        self.n_entries = 0
+        self.dwell_time = 0.0
+        self.callback_latencies = {
+            callback_type: LatencyHistogram()
+            for callback_type in FsmInstrumentation.CALLBACK_TYPES
+        }
+
+
+class FsmInstrumentation:
+    """
+    Record where an `EnumFsm` spends its time, per state.
+
+    - Dwell time: from entering a state to leaving it, including the time
+      waiting for input.
+    - Latency of the enter, stay and exit callbacks. Modal dialogs opened
+      by a callback are included, as the user waits for them too.
+
+    Pass an instance to `EnumFsm`. Without one, the FSM does not read the
+    clock at all.
+    """
+
+    CALLBACK_TYPES = ("enter", "stay", "exit")
+
+    def __init__(self):
+        self._stats = {}
+        self._current_state = None
+        self._state_entered_time = 0.0
+
+    def on_state_entered(self, state: Enum):
+        now = time.perf_counter()
+        self._add_dwell_time(now=now)
+        self._current_state = state
+        self._state_entered_time = now
+        self._get_state_stats(state=state).n_entries += 1
+
+    def on_callback_returned(
+        self, state: Enum, callback_type: str, latency: float
+    ):
+        self._get_state_stats(state=state).callback_latencies[
+            callback_type
+        ].add(latency)
+
+    def to_dict(self) -> dict:
+        """
+        Returns
+        ----
+        dict
+            State name -> stats, the states with the longest dwell time
+            first. The dwell time of the current state counts until now.
+        """
+        self._add_dwell_time(now=time.perf_counter())
+        return {
+            state.name: {
+                "n_entries": stats.n_entries,
+                "dwell_ms": round(stats.dwell_time * 1000, 3),
+                "n_stay_calls": stats.callback_latencies["stay"].n_samples,
+                "callback_latencies": {
+                    callback_type: histogram.to_dict()
+                    for callback_type, histogram in (
+                        stats.callback_latencies.items()
+                    )
+                    if histogram.n_samples > 0
+                },
+            }
+            for state, stats in sorted(
+                self._stats.items(),
+                key=lambda x: x[1].dwell_time,
+                reverse=True,
+            )
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{'dwell [ms]':>12} | {'entries':>7} | {'stay calls':>10} | "
+            f"{'callbacks [ms]':>14} | {'stay p99 [ms]':>13} | state"
+        ]
+        for state_name, stats in self.to_dict().items():
+            callback_latencies = stats["callback_latencies"]
+            callbacks_time = sum(
+                latencies["total_ms"]
+                for latencies in callback_latencies.values()
+            )
+            stay_p99 = callback_latencies.get("stay", {}).get("p99_ms", 0.0)
+            lines.append(
+                f"{stats['dwell_ms']:>12.1f} | {stats['n_entries']:>7} | "
+                f"{stats['n_stay_calls']:>10} | {callbacks_time:>14.1f} | "
+                f"{stay_p99:>13.1f} | {state_name}"
+            )
+        return "\n".join(lines)
+
+    def save(self, file_path: str):
+        """Append the stats as one JSON line, to compare sessions."""
+        record = {
+            "time": datetime.datetime.now(
+                tz=datetime.timezone.utc
+            ).isoformat(),
+            "states": self.to_dict(),
+        }
+        with open(file_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _add_dwell_time(self, now: float):
+        if self._current_state is None:
+            return
+        self._get_state_stats(state=self._current_state).dwell_time += (
+            now - self._state_entered_time
+        )
+        self._state_entered_time = now
+
+    def _get_state_stats(self, state: Enum) -> _StateStats:
+        stats = self._stats.get(state, None)
+        if stats is None:
+            stats = _StateStats()
+            self._stats[state] = stats
+        return stats
@@ -0,0 +1,269 @@
+from __future__ import annotations
+from collections import OrderedDict
+import csv
+import dataclasses
+import json
+import os
+from typing import Iterator
+import urllib.parse
+
+from password_vault.password_vault import PasswordVault
+
+
+@dataclasses.dataclass
+class ImportResult:
+    n_imported: int = 0
+    n_skipped: int = 0
+    n_renamed: int = 0
+    n_invalid: int = 0
+    conflicts: list = dataclasses.field(default_factory=list)
+
+
+class AccountImporter:
+    """
+    Import accounts exported by browsers and password managers.
+
+    CSV and JSON Lines files are parsed record by record. Records are written
+    to the vault in batches through `PasswordVault.update_accounts`.
+    """
+
+    BATCH_SIZE = 512
+    CONFLICT_POLICIES = ("skip", "overwrite", "rename")
+    FILE_FORMATS = ("csv", "json", "jsonl")
+    STRING_ENCODING = "utf-8"
+    ## Map column names of common exports (Chrome, Firefox, Bitwarden,
+    ## KeePass, 1Password) to the vault fields. Columns which are not listed
+    ## keep their own names, and columns mapped to "" are dropped.
+    DEFAULT_FIELDS_MAP = {
+        "name": PasswordVault.ACCOUNT_NAME_TAG,
+        "title": PasswordVault.ACCOUNT_NAME_TAG,
+        "account": PasswordVault.ACCOUNT_NAME_TAG,
+        "url": "url",
+        "uri": "url",
+        "login_uri": "url",
+        "website": "url",
+        "username": "username",
+        "login_username": "username",
+        "login": "username",
+        "user name": "username",
+        "email": "username",
+        "password": "password",
+        "login_password": "password",
+        "notes": "notes",
+        "note": "notes",
+        "extra": "notes",
+        "totp": "totp",
+        "login_totp": "totp",
+        "otpauth": "totp",
+        "id": "",
+        "guid": "",
+        "folderid": "",
+        "organizationid": "",
+        "collectionids": "",
+        "type": "",
+        "reprompt": "",
+        "favorite": "",
+        "creationdate": "",
+        "revisiondate": "",
+        "deleteddate": "",
+        "timecreated": "",
+        "timelastused": "",
+        "timepasswordchanged": "",
+        "httprealm": "",
+        "formactionorigin": "",
+    }
+    IGNORED_FIELDS = (
+        PasswordVault.ACCOUNT_MODIFICATION_DATE_TAG,
+        PasswordVault.ACCOUNT_UUID_TAG,
+    )
+
+    def __init__(
+        self,
+        password_vault: PasswordVault,
+        fields_map: dict | None = None,
+        conflict_policy: str = "skip",
+        batch_size: int = BATCH_SIZE,
+    ):
+        """
+        Parameters
+        ----
+        password_vault : PasswordVault
+            Vault to import the accounts into.
+        fields_map : dict | None
+            Extra mapping from lower-cased column names to vault fields, which
+            takes precedence over `DEFAULT_FIELDS_MAP`.
+        conflict_policy : str
+            What to do with an account whose name already exists in the
+            vault, or earlier in the imported file. One of "skip",
+            "overwrite" and "rename".
+        batch_size : int
+            Number of accounts written to the vault at once.
+        """
+        assert conflict_policy in self.CONFLICT_POLICIES
+        assert batch_size > 0
+        self._password_vault = password_vault
+        self._fields_map = dict(self.DEFAULT_FIELDS_MAP)
+        if fields_map is not None:
+            self._fields_map.update(
+                {k.lower(): v for k, v in fields_map.items()}
+            )
+        self._conflict_policy = conflict_policy
+        self._batch_size = batch_size
+
+    def import_file(
+        self, file_path: str, file_format: str | None = None
+    ) -> ImportResult:
+        if file_format is None:
+            file_format = os.path.splitext(file_path)[1].lstrip(".").lower()
+        if file_format not in self.FILE_FORMATS:
+            raise ValueError(f"Unsupported file format: \"{file_format}\"")
+        with open(
+            file_path, "r", encoding=self.STRING_ENCODING, newline=""
+        ) as f:
+            if file_format == "csv":
+                records = self.iter_csv_records(f)
+            elif file_format == "json":
+                records = self.iter_json_records(f)
+            else:
+                records = self.iter_json_lines_records(f)
+            return self.import_records(records=records)
+
+    def import_records(self, records) -> ImportResult:
+        """
+        Parameters
+        ----
+        records : Iterable[dict]
+            Flat mappings from column names to values.
+        """
+        result = ImportResult()
+        imported_names = set()
+        batch = OrderedDict()
+        for record in records:
+            details = self._map_fields(record=record)
+            if details is None:
+                result.n_invalid += 1
+                continue
+            account_name = details[PasswordVault.ACCOUNT_NAME_TAG]
+            if account_name in imported_names or (
+                account_name in self._password_vault
+            ):
+                result.conflicts.append(account_name)
+                if self._conflict_policy == "skip":
+                    result.n_skipped += 1
+                    continue
+                elif self._conflict_policy == "rename":
+                    account_name = self._get_free_account_name(
+                        account_name=account_name,
+                        imported_names=imported_names,
+                    )
+                    details[PasswordVault.ACCOUNT_NAME_TAG] = account_name
+                    result.n_renamed += 1
+                elif account_name in imported_names:
+                    ## Case: overwriting an account imported earlier
+                    result.n_imported -= 1
+            imported_names.add(account_name)
+            batch[account_name] = details
+            result.n_imported += 1
+            if len(batch) >= self._batch_size:
+                self._password_vault.update_accounts(
+                    details_list=list(batch.values())
+                )
+                batch.clear()
+        if len(batch) > 0:
+            self._password_vault.update_accounts(
+                details_list=list(batch.values())
+            )
+        return result
+
+    @classmethod
+    def iter_csv_records(cls, f) -> Iterator[dict]:
+        for row in csv.DictReader(f):
+            yield {k: v for k, v in row.items() if k is not None}
+
+    @classmethod
+    def iter_json_records(cls, f) -> Iterator[dict]:
+        """
+        Read a JSON export. It is either a list of flat objects, or a
+        Bitwarden export whose accounts are in the "items" field. Unlike CSV
+        and JSON Lines, the whole file is parsed at once.
+        """
+        data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("items", [])
+        for item in data:
+            yield cls._flatten_json_record(item=item)
+
+    @classmethod
+    def iter_json_lines_records(cls, f) -> Iterator[dict]:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            yield cls._flatten_json_record(item=json.loads(line))
+
+    @classmethod
+    def _flatten_json_record(cls, item: dict) -> dict:
+        record = {}
+        for k, v in item.items():
+            if k == "login" and isinstance(v, dict):
+                ## Bitwarden login object
+                for login_k, login_v in v.items():
+                    if login_k == "uris" and isinstance(login_v, list):
+                        if len(login_v) > 0:
+                            record["login_uri"] = login_v[0].get("uri")
+                    else:
+                        record[f"login_{login_k}"] = login_v
+            elif k == "fields" and isinstance(v, list):
+                ## Bitwarden custom fields
+                for field in v:
+                    if isinstance(field, dict) and "name" in field:
+                        record[field["name"]] = field.get("value")
+            elif isinstance(v, (dict, list)):
+                continue
+            else:
+                record[k] = v
+        return record
+
+    def _map_fields(self, record: dict) -> OrderedDict | None:
+        """
+        Return
+        ----
+        OrderedDict | None: Details of the account, or None if it has no
+            name, or a name which cannot be stored. See
+            `PasswordVault.is_valid_account_name`.
+        """
+        details = self._password_vault.get_blank_account()
+        for k, v in record.items():
+            if v is None or v == "":
+                continue
+            field = self._fields_map.get(k.strip().lower(), k.strip())
+            if field == "" or field in self.IGNORED_FIELDS:
+                continue
+            if field == PasswordVault.ACCOUNT_NAME_TAG and (
+                details[PasswordVault.ACCOUNT_NAME_TAG] != ""
+            ):
+                continue
+            details[field] = str(v)
+        if details[PasswordVault.ACCOUNT_NAME_TAG] == "":
+            details[PasswordVault.ACCOUNT_NAME_TAG] = (
+                urllib.parse.urlsplit(details.get("url", "")).hostname or ""
+            )
+        ## Rejected before any batch is written, as an invalid name fails
+        ## only when its file is written, in the middle of a batch
+        if not PasswordVault.is_valid_account_name(
+            account_name=details[PasswordVault.ACCOUNT_NAME_TAG]
+        ):
+            return None
+        return details
+
+    def _get_free_account_name(
+        self, account_name: str, imported_names: set
+    ) -> str:
+        i = 2
+        while True:
+            candidate = f"{account_name} ({i})"
+            if candidate not in imported_names and (
+                candidate not in self._password_vault
+            ):
+                return candidate
+            i += 1
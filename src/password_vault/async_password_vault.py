@@ -0,0 +1,281 @@
+from __future__ import annotations
+import asyncio
+from collections import OrderedDict
+import concurrent.futures
+import functools
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Optional,
+    TYPE_CHECKING,
+)
+
+from file_manipulation.directory_handler_with_encryption import (
+    DirectoryHandlerWithEncryption,
+)
+from password_vault.password_vault import PasswordVault
+
+
+if TYPE_CHECKING:
+    from util.operation_progress import OperationProgress
+
+
+class _ReadWriteLock:
+    """Let many readers, or a single writer, hold the lock at a time."""
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._n_readers = 0
+        self._is_writing = False
+
+    @property
+    def reading(self) -> _ReadWriteLockContext:
+        return _ReadWriteLockContext(
+            acquire=self._acquire_read, release=self._release_read
+        )
+
+    @property
+    def writing(self) -> _ReadWriteLockContext:
+        return _ReadWriteLockContext(
+            acquire=self._acquire_write, release=self._release_write
+        )
+
+    async def _acquire_read(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._is_writing)
+            self._n_readers += 1
+
+    async def _release_read(self):
+        async with self._condition:
+            self._n_readers -= 1
+            self._condition.notify_all()
+
+    async def _acquire_write(self):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: not self._is_writing and self._n_readers == 0
+            )
+            self._is_writing = True
+
+    async def _release_write(self):
+        async with self._condition:
+            self._is_writing = False
+            self._condition.notify_all()
+
+
+class _ReadWriteLockContext:
+    def __init__(self, acquire: Callable, release: Callable):
+        self._acquire = acquire
+        self._release = release
+
+    async def __aenter__(self):
+        await self._acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._release()
+
+
+class AsyncPasswordVault:
+    """
+    asyncio wrapper of `PasswordVault`.
+
+    File I/O and encryption run in a thread pool, so the event loop is never
+    blocked. Writes to the replicas of a vault run concurrently. Reads may
+    overlap with each other, while writes are exclusive, so results are the
+    same as calling the `PasswordVault` methods one after another.
+    """
+
+    MAX_IN_FLIGHT_OPERATIONS = 8
+
+    def __init__(
+        self,
+        password_vault: PasswordVault,
+        executor: concurrent.futures.Executor,
+        replica_executor: concurrent.futures.Executor | None = None,
+        max_in_flight_operations: int = MAX_IN_FLIGHT_OPERATIONS,
+    ):
+        """
+        Use `AsyncPasswordVault.open` instead, unless the executors are
+        managed by the caller.
+        """
+        self._password_vault = password_vault
+        self._executor = executor
+        self._replica_executor = replica_executor
+        self._semaphore = asyncio.Semaphore(max_in_flight_operations)
+        self._lock = _ReadWriteLock()
+
+    @classmethod
+    async def open(
+        cls,
+        directories: list,
+        main_password: str,
+        max_in_flight_operations: int = MAX_IN_FLIGHT_OPERATIONS,
+        layout: str = DirectoryHandlerWithEncryption.FLAT_LAYOUT,
+        asynchronous_directories: Iterable[str] = (),
+    ) -> AsyncPasswordVault:
+        """
+        Parameters
+        ----
+        layout : str
+            Layout of new replicas. See `PasswordVault`.
+        asynchronous_directories : Iterable[str]
+            Directories among `directories` whose replicas are written in
+            the background. See `PasswordVault`.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_in_flight_operations
+        )
+        ## A separate pool for the replicas, so that an operation never waits
+        ## for a worker of its own pool
+        replica_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(directories)
+        )
+        try:
+            password_vault = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                functools.partial(
+                    PasswordVault,
+                    directories=directories,
+                    main_password=main_password,
+                    replica_executor=replica_executor,
+                    layout=layout,
+                    asynchronous_directories=asynchronous_directories,
+                ),
+            )
+        except BaseException:
+            executor.shutdown(wait=False)
+            replica_executor.shutdown(wait=False)
+            raise
+        return cls(
+            password_vault=password_vault,
+            executor=executor,
+            replica_executor=replica_executor,
+            max_in_flight_operations=max_in_flight_operations,
+        )
+
+    async def close(self):
+        """
+        Close the vault, which writes the changes queued for asynchronous
+        replicas and the replicas behind, then shut the executors down.
+        """
+        async with self._lock.writing:
+            loop = asyncio.get_running_loop()
+            ## Before the shutdown, as the replica executor still runs the
+            ## writes past the write quorum
+            await loop.run_in_executor(
+                self._executor, self._password_vault.close
+            )
+            await loop.run_in_executor(None, self._shutdown_executors)
+
+    async def __aenter__(self) -> AsyncPasswordVault:
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __contains__(self, account_name: str) -> bool:
+        return account_name in self._password_vault
+
+    async def get_all_accounts_name(self) -> set:
+        return await self._read(self._password_vault.get_all_accounts_name)
+
+    async def search_account_name(
+        self, account_name: str, n_candidates: int = 9
+    ) -> list:
+        return await self._read(
+            self._password_vault.search_account_name,
+            account_name=account_name,
+            n_candidates=n_candidates,
+        )
+
+    async def get_account(self, account_name: str) -> OrderedDict:
+        return await self._read(
+            self._password_vault.get_account, account_name=account_name
+        )
+
+    def get_blank_account(self) -> OrderedDict:
+        return self._password_vault.get_blank_account()
+
+    async def update_account(self, details: OrderedDict):
+        await self._write(self._password_vault.update_account, details=details)
+
+    async def update_accounts(self, details_list: list):
+        await self._write(
+            self._password_vault.update_accounts, details_list=details_list
+        )
+
+    async def delete_account(self, account_name: str):
+        await self._write(
+            self._password_vault.delete_account, account_name=account_name
+        )
+
+    async def change_password(
+        self,
+        new_main_password: str,
+        progress: Optional[OperationProgress] = None,
+    ):
+        await self._write(
+            self._password_vault.change_password,
+            new_main_password=new_main_password,
+            progress=progress,
+        )
+
+    async def create_archive(
+        self,
+        archive_file_path: str,
+        base_archive_file_path: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ):
+        await self._read(
+            self._password_vault.create_archive,
+            archive_file_path=archive_file_path,
+            base_archive_file_path=base_archive_file_path,
+            progress=progress,
+        )
+
+    async def iter_accounts(
+        self,
+        n_workers: int = PasswordVault.ITER_ACCOUNTS_N_WORKERS,
+        window_size: int = PasswordVault.ITER_ACCOUNTS_WINDOW_SIZE,
+    ) -> AsyncIterator[tuple[str, OrderedDict]]:
+        """
+        Asynchronous version of `PasswordVault.iter_accounts`. Writes are
+        held back until the iteration finishes or the iterator is closed.
+        """
+        sentinel = object()
+        accounts = self._password_vault.iter_accounts(
+            n_workers=n_workers, window_size=window_size
+        )
+        loop = asyncio.get_running_loop()
+        async with self._lock.reading:
+            try:
+                while True:
+                    async with self._semaphore:
+                        item = await loop.run_in_executor(
+                            self._executor, next, accounts, sentinel
+                        )
+                    if item is sentinel:
+                        break
+                    yield item
+            finally:
+                await loop.run_in_executor(self._executor, accounts.close)
+
+    async def _read(self, function: Callable, **kwargs):
+        async with self._lock.reading:
+            return await self._run(function, **kwargs)
+
+    async def _write(self, function: Callable, **kwargs):
+        async with self._lock.writing:
+            return await self._run(function, **kwargs)
+
+    async def _run(self, function: Callable, **kwargs):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(function, **kwargs)
+            )
+
+    def _shutdown_executors(self):
+        self._executor.shutdown(wait=True)
+        if self._replica_executor is not None:
+            self._replica_executor.shutdown(wait=True)
@@ -1,12 +1,27 @@
-from collections import OrderedDict
+from __future__ import annotations
+from collections import deque, OrderedDict
 import datetime
 import hashlib
+import os
+from typing import Iterable, Iterator, Optional, TYPE_CHECKING
 import uuid
 
+from data_encryption.key_derivation import KdfParameters, KeyDerivation
 from util.dict_helper import DictHelper
+from file_manipulation.directory_handler_with_encryption import (
+    DirectoryHandlerWithEncryption,
+)
 from file_manipulation.directory_handler_with_replication import (
     DirectoryHandlerWithReplication,
 )
+from util.operation_progress import OperationCancelledError
+from util.io_stats import IoStats
+from util.span_tracer import traced
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    from util.operation_progress import OperationProgress
 
 
 class PasswordVault:
@@ -14,50 +29,263 @@ class PasswordVault:
     ACCOUNT_NAME_TAG = "account_name"
     ACCOUNT_MODIFICATION_DATE_TAG = "account_modification_date"
     ACCOUNT_UUID_TAG = "account_uuid"
+    ITER_ACCOUNTS_N_WORKERS = 4
+    ITER_ACCOUNTS_WINDOW_SIZE = 32
+    KEY_DERIVATION_FILE_NAME = "key_derivation"
+    ## Key derivation of a password change which is not committed yet
+    PENDING_KEY_DERIVATION_FILE_NAME = "key_derivation.pending"
+    ## Names of the subdirectories of the replicas, which accounts of the
+    ## flat layout, stored under their names, would clash with
+    RESERVED_ACCOUNT_NAMES = (
+        ".",
+        "..",
+        DirectoryHandlerWithEncryption.METADATA_SUBDIRECTORY,
+        DirectoryHandlerWithEncryption.HASHES_SUBDIRECTORY,
+        DirectoryHandlerWithEncryption.FILES_USING_NEW_KEY_CACHE_SUBDIRECTORY,
+    )
 
-    def __init__(self, directories: list, main_password: str):
-        main_password_bytes = main_password.encode(self.STRING_ENCODING)
-        key = hashlib.sha256(main_password_bytes).digest()
-        self._directory_handler = DirectoryHandlerWithReplication(
-            directories=directories, key=key
-        )
+    @traced
+    def __init__(
+        self,
+        directories: list,
+        main_password: str,
+        replica_executor: Optional[concurrent.futures.Executor] = None,
+        progress: Optional[OperationProgress] = None,
+        kdf_target_time: float = KeyDerivation.DEFAULT_TARGET_TIME,
+        layout: str = DirectoryHandlerWithEncryption.FLAT_LAYOUT,
+        asynchronous_directories: Iterable[str] = (),
+    ):
+        """
+        The key of the vault is random, and wrapped by a key derived from
+        the main password with scrypt. See `KeyDerivation`. Vaults created
+        before keep the key derived from the main password by SHA-256,
+        until the main password is changed.
+
+        Parameters
+        ----
+        progress : OperationProgress | None
+            Reports the unlocking progress, and cancels it. See
+            `DirectoryHandlerWithReplication`.
+        kdf_target_time : float
+            Seconds that the key derivation is calibrated to take, for a new
+            vault and on `change_password` of an old vault.
+        layout : str
+            Layout of new replicas, `DirectoryHandlerWithEncryption`
+            `FLAT_LAYOUT` or `SHARDED_LAYOUT`.
+        asynchronous_directories : Iterable[str]
+            Directories among `directories` whose replicas are written in
+            the background, such as a mirror on a USB drive. See
+            `DirectoryHandlerWithReplication`.
+        """
+        self._io_stats = IoStats()
+        self._kdf_target_time = kdf_target_time
+        with self._io_stats.operation(name="unlock"):
+            (
+                self._key,
+                self._kdf_parameters,
+                key_derivation_record,
+            ) = self._unwrap_key(
+                directories=directories,
+                main_password=main_password,
+                progress=progress,
+            )
+            self._directory_handler = DirectoryHandlerWithReplication(
+                directories=directories,
+                key=self._key,
+                executor=replica_executor,
+                progress=progress,
+                io_stats=self._io_stats,
+                layout=layout,
+                asynchronous_directories=asynchronous_directories,
+            )
+            if key_derivation_record is not None:
+                self._settle_key_derivation(record=key_derivation_record)
 
     def __contains__(self, file_name: str) -> bool:
         return self._directory_handler.file_exists(file_name=file_name)
 
-    def get_all_accounts_name(self) -> set:
+    def stats(self) -> dict:
+        """
+        Counters of the file I/O, hashing and encryption done by each
+        operation of this vault, in total and per replica, and their time.
+        See `IoStats.stats`.
+        """
+        return self._io_stats.stats()
+
+    def stats_report(self) -> str:
+        return self._io_stats.report()
+
+    def get_quorums(self) -> tuple[int, int, int]:
+        """
+        Return
+        ----
+        int: write quorum
+        int: read quorum
+        int: number of synchronous replicas
+        """
+        return (
+            self._directory_handler.write_quorum,
+            self._directory_handler.read_quorum,
+            self._directory_handler.n_synchronous_replicas,
+        )
+
+    @traced
+    def set_quorums(self, write_quorum: int, read_quorum: int):
+        """
+        Number of replicas written before a change returns, and read before
+        an account is returned. See
+        `DirectoryHandlerWithReplication.set_quorums`.
+        """
+        with self._io_stats.operation(name="set_quorums"):
+            self._directory_handler.set_quorums(
+                write_quorum=write_quorum, read_quorum=read_quorum
+            )
+
+    def get_n_queued_changes(self) -> dict:
+        """
+        Number of changes not yet written to each asynchronous replica. See
+        `DirectoryHandlerWithReplication.get_n_queued_changes`.
+        """
+        return self._directory_handler.get_n_queued_changes()
+
+    def close(self):
+        """
+        Try to write the queued changes to the asynchronous replicas, and
+        stop writing them in the background.
+        """
+        self._directory_handler.close()
+
+    @property
+    def kdf_parameters(self) -> KdfParameters | None:
+        """Parameters of the key derivation, or None if it is SHA-256."""
+        return self._kdf_parameters
+
+    def get_all_accounts_name(self) -> frozenset:
         return self._directory_handler.get_all_files_name()
 
+    @traced
     def search_account_name(
         self, account_name: str, n_candidates: int = 9
     ) -> list:
-        return self._directory_handler.search_file_name(
-            target_name=account_name, n_candidates=n_candidates
-        )
+        with self._io_stats.operation(name="search_account_name"):
+            return self._directory_handler.search_file_name(
+                target_name=account_name, n_candidates=n_candidates
+            )
 
+    @traced
     def update_account(self, details: OrderedDict):
+        """
+        Raise
+        ----
+        ValueError: if the account name is not valid. See
+            `is_valid_account_name`.
+        """
         account_name = details[self.ACCOUNT_NAME_TAG]
+        self._ensure_valid_account_name(account_name=account_name)
         details[
             self.ACCOUNT_MODIFICATION_DATE_TAG
         ] = datetime.date.today().isoformat()
         details_serialized = DictHelper.to_bytes(data=details)
-        self._directory_handler.write_to_file(
-            file_name=account_name, data=details_serialized
-        )
+        with self._io_stats.operation(name="update_account"):
+            self._directory_handler.write_to_file(
+                file_name=account_name, data=details_serialized
+            )
 
+    @traced
+    def update_accounts(self, details_list: list):
+        """
+        Update several accounts at once. It is much faster than calling
+        `update_account` for each account, because the directory info of
+        each replica is saved once per call rather than once per account.
+
+        Raise
+        ----
+        ValueError: if an account name is not valid, in which case no
+            account is updated
+        """
+        for details in details_list:
+            self._ensure_valid_account_name(
+                account_name=details[self.ACCOUNT_NAME_TAG]
+            )
+        modification_date = datetime.date.today().isoformat()
+        files = {}
+        for details in details_list:
+            details[self.ACCOUNT_MODIFICATION_DATE_TAG] = modification_date
+            files[details[self.ACCOUNT_NAME_TAG]] = DictHelper.to_bytes(
+                data=details
+            )
+        with self._io_stats.operation(name="update_accounts"):
+            self._directory_handler.write_to_files(files=files)
+
+    @traced
     def delete_account(self, account_name: str):
         try:
             self._ensure_account_exists(account_name=account_name)
-            self._directory_handler.delete_file(file_name=account_name)
+            with self._io_stats.operation(name="delete_account"):
+                self._directory_handler.delete_file(file_name=account_name)
         except FileNotFoundError:
             pass
 
+    @traced
     def get_account(self, account_name: str) -> OrderedDict:
         self._ensure_account_exists(account_name=account_name)
-        details_serialized = self._directory_handler.read_from_file(
-            file_name=account_name
+        with self._io_stats.operation(name="get_account"):
+            return self._read_account(account_name=account_name)
+
+    def iter_accounts(
+        self,
+        n_workers: int = ITER_ACCOUNTS_N_WORKERS,
+        window_size: int = ITER_ACCOUNTS_WINDOW_SIZE,
+    ) -> Iterator[tuple[str, OrderedDict]]:
+        """
+        Yield the name and details of every account, in the order the
+        accounts are stored.
+
+        Accounts are read and decrypted ahead by a pool of workers. At most
+        `window_size` accounts are held in memory at a time. In `stats`,
+        each account read is a call of operation "iter_accounts".
+        """
+        import concurrent.futures
+
+        assert n_workers > 0 and window_size > 0
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+        pending = deque()
+        try:
+            for account_name in self._directory_handler.iter_files_name():
+                pending.append(
+                    (
+                        account_name,
+                        executor.submit(
+                            self._read_account_of_iteration,
+                            account_name=account_name,
+                        ),
+                    )
+                )
+                if len(pending) >= window_size:
+                    account_name, future = pending.popleft()
+                    yield account_name, future.result()
+            while len(pending) > 0:
+                account_name, future = pending.popleft()
+                yield account_name, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @classmethod
+    def is_valid_account_name(cls, account_name: str) -> bool:
+        """
+        Whether an account name can be stored as a file name in the
+        replicas: not empty, without path separators, and not reserved.
+        """
+        return (
+            account_name != ""
+            and account_name not in cls.RESERVED_ACCOUNT_NAMES
+            and "\0" not in account_name
+            and all(
+                sep not in account_name
+                for sep in (os.sep, os.altsep)
+                if sep is not None
+            )
         )
-        return DictHelper.from_bytes(data=details_serialized)
 
     def get_blank_account(self) -> OrderedDict:
         return OrderedDict(
@@ -68,17 +296,355 @@ class PasswordVault:
             }
         )
 
-    def change_password(self, new_main_password: str):
-        new_main_password_bytes = new_main_password.encode(
-            self.STRING_ENCODING
+    @traced
+    def change_password(
+        self,
+        new_main_password: str,
+        progress: Optional[OperationProgress] = None,
+    ):
+        """
+        Re-encrypt the vault with a new random key, wrapped by the new main
+        password. If cancelled through `progress`, the main password is
+        unchanged.
+
+        Raise
+        ----
+        ValueError: if an asynchronous replica is not reachable, in which
+            case the main password is unchanged
+        """
+        if self._kdf_parameters is None:
+            parameters = KeyDerivation.calibrate(
+                target_time=self._kdf_target_time
+            )
+        else:
+            parameters = self._kdf_parameters.with_new_salt()
+        new_key = KeyDerivation.generate_key()
+        record = KeyDerivation.wrap_key(
+            key=new_key, password=new_main_password, parameters=parameters
         )
-        new_key = hashlib.sha256(new_main_password_bytes).digest()
-        self._directory_handler.change_key(new_key=new_key)
+        with self._io_stats.operation(name="change_password"):
+            ## Kept until the data is re-encrypted, so that a change
+            ## interrupted after that is completed by the next unlock
+            self._directory_handler.write_metadata(
+                file_name=self.PENDING_KEY_DERIVATION_FILE_NAME, data=record
+            )
+            try:
+                self._directory_handler.change_key(
+                    new_key=new_key, progress=progress
+                )
+            except (OperationCancelledError, ValueError):
+                self._directory_handler.delete_metadata(
+                    file_name=self.PENDING_KEY_DERIVATION_FILE_NAME
+                )
+                raise
+            self._directory_handler.write_metadata(
+                file_name=self.KEY_DERIVATION_FILE_NAME, data=record
+            )
+            self._directory_handler.delete_metadata(
+                file_name=self.PENDING_KEY_DERIVATION_FILE_NAME
+            )
+        self._key = new_key
+        self._kdf_parameters = parameters
+
+    def watch_changes(self):
+        """
+        Watch the replicas, so that `check_changes` only checks the files
+        changed by other processes and sync tools, with inotify on Linux,
+        or by polling the modification times otherwise.
+        """
+        self._directory_handler.watch_changes()
+
+    @traced
+    def check_changes(self) -> bool:
+        """
+        Return
+        ----
+        bool: whether accounts were added or deleted by other processes
+            since the last check, in which case the results of
+            `search_account_name` may have changed
+        """
+        with self._io_stats.operation(name="check_changes"):
+            return self._directory_handler.check_changes()
+
+    @traced
+    def migrate_to_sharded_layout(
+        self, progress: Optional[OperationProgress] = None
+    ):
+        """
+        Store the accounts under encoded names in hash-sharded
+        subdirectories, rather than under their names in the replicas. It is
+        not cancellable, and an interrupted migration is completed on the
+        next unlock.
+        """
+        with self._io_stats.operation(name="migrate_to_sharded_layout"):
+            self._directory_handler.migrate_to_sharded_layout(
+                progress=progress
+            )
+
+    @traced
+    def recalibrate_key_derivation(
+        self, main_password: str, target_time: float | None = None
+    ) -> KdfParameters:
+        """
+        Calibrate the cost of the key derivation again on this machine, and
+        wrap the key of the vault again. The data is not re-encrypted.
 
-    def create_archive(self, archive_file_path: str):
-        self._directory_handler.create_archive(
-            archive_file_path=archive_file_path
+        Parameters
+        ----
+        main_password : str
+        target_time : float | None
+            Seconds that the key derivation should take. Defaults to
+            `kdf_target_time` of `__init__`.
+
+        Raise
+        ----
+        ValueError: if the main password is incorrect, or the key is derived
+            by SHA-256, which only `change_password` can replace
+        """
+        if self._kdf_parameters is None:
+            raise ValueError(
+                "The key is derived by SHA-256. Change the main password to "
+                "derive it by scrypt."
+            )
+        record = next(
+            r
+            for r in self._directory_handler.read_metadata(
+                file_name=self.KEY_DERIVATION_FILE_NAME
+            )
+            if r is not None
+        )
+        key, _ = KeyDerivation.unwrap_key(
+            record=record, password=main_password
+        )
+        if key != self._key:
+            raise ValueError("Key derivation does not match the vault.")
+        parameters = KeyDerivation.calibrate(
+            target_time=(
+                self._kdf_target_time if target_time is None else target_time
+            )
+        )
+        with self._io_stats.operation(name="recalibrate_key_derivation"):
+            self._directory_handler.write_metadata(
+                file_name=self.KEY_DERIVATION_FILE_NAME,
+                data=KeyDerivation.wrap_key(
+                    key=self._key,
+                    password=main_password,
+                    parameters=parameters,
+                ),
+            )
+        self._kdf_parameters = parameters
+        return parameters
+
+    @traced
+    def create_archive(
+        self,
+        archive_file_path: str,
+        base_archive_file_path: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ):
+        """
+        If cancelled through `progress`, no archive is created.
+        """
+        with self._io_stats.operation(name="create_archive"):
+            self._directory_handler.create_archive(
+                archive_file_path=archive_file_path,
+                base_archive_file_path=base_archive_file_path,
+                progress=progress,
+            )
+
+    @traced
+    def verify_archive(
+        self,
+        archive_file_path: str,
+        main_password: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ) -> list:
+        """
+        Check that every account in an archive can be decrypted and matches
+        its hash, without extracting the archive.
+
+        Parameters
+        ----
+        archive_file_path : str
+            Path of the archive. Base archives of an incremental archive must
+            be in the same directory.
+        main_password : str | None
+            Main password at the time of archiving. Defaults to the current
+            main password.
+        progress : OperationProgress | None
+            Reports the accounts checked, and cancels checking.
+
+        Return
+        ----
+        list: Names of the accounts which are missing or corrupted.
+        """
+        with self._io_stats.operation(name="verify_archive"):
+            return self._directory_handler.verify_archive(
+                archive_file_path=archive_file_path,
+                key=self._get_archive_key(
+                    archive_file_path=archive_file_path,
+                    main_password=main_password,
+                ),
+                progress=progress,
+            )
+
+    @traced
+    def restore_archive(
+        self,
+        archive_file_path: str,
+        main_password: str | None = None,
+        progress: Optional[OperationProgress] = None,
+    ) -> list:
+        """
+        Restore the accounts in an archive into this vault. Existing accounts
+        of the same names are overwritten. Parameters are the same as
+        `verify_archive`.
+
+        Return
+        ----
+        list: Names of the accounts which are missing or corrupted, and
+            therefore not restored.
+        """
+        with self._io_stats.operation(name="restore_archive"):
+            return self._directory_handler.restore_archive(
+                archive_file_path=archive_file_path,
+                key=self._get_archive_key(
+                    archive_file_path=archive_file_path,
+                    main_password=main_password,
+                ),
+                progress=progress,
+            )
+
+    def _read_account(self, account_name: str) -> OrderedDict:
+        details_serialized = self._directory_handler.read_from_file(
+            file_name=account_name
+        )
+        return DictHelper.from_bytes(data=details_serialized)
+
+    def _read_account_of_iteration(self, account_name: str) -> OrderedDict:
+        with self._io_stats.operation(name="iter_accounts"):
+            return self._read_account(account_name=account_name)
+
+    def _unwrap_key(
+        self,
+        directories: list,
+        main_password: str,
+        progress: Optional[OperationProgress],
+    ) -> tuple[bytes, KdfParameters | None, bytes | None]:
+        """
+        Return
+        ----
+        bytes: key of the vault
+        KdfParameters | None: None if the key is derived by SHA-256
+        bytes | None: Record of the key derivation to be kept in the
+            replicas, or None if the key is derived by SHA-256
+        """
+        read_metadata = (
+            DirectoryHandlerWithReplication.read_metadata_of_directories
         )
+        error = None
+        records = [
+            read_metadata(directories=directories, file_name=file_name)
+            for file_name in (
+                self.KEY_DERIVATION_FILE_NAME,
+                self.PENDING_KEY_DERIVATION_FILE_NAME,
+            )
+        ]
+        for record in records:
+            if record is None:
+                continue
+            try:
+                key, parameters = KeyDerivation.unwrap_key(
+                    record=record, password=main_password
+                )
+            except ValueError as e:
+                error = e
+                continue
+            return key, parameters, record
+        if records[0] is not None:
+            raise error
+        if (
+            read_metadata(
+                directories=directories,
+                file_name=(
+                    DirectoryHandlerWithEncryption.DIRECTORY_INFO_FILE_NAME
+                ),
+            )
+            is not None
+        ):
+            ## Case: vault created before the key derivation, or whose first
+            ## password change did not re-encrypt the data
+            key = self._get_legacy_key(main_password=main_password)
+            return key, None, None
+        if error is not None:
+            raise error
+        ## Case: new vault
+        if progress is not None:
+            progress.start_stage(
+                stage="Calibrating the key derivation", n_items_total=1
+            )
+        parameters = KeyDerivation.calibrate(target_time=self._kdf_target_time)
+        key = KeyDerivation.generate_key()
+        record = KeyDerivation.wrap_key(
+            key=key, password=main_password, parameters=parameters
+        )
+        return key, parameters, record
+
+    def _settle_key_derivation(self, record: bytes):
+        """
+        Write the record of the key which opened the vault to the replicas
+        which do not have it, and drop the record of an interrupted password
+        change.
+        """
+        if any(
+            r != record
+            for r in self._directory_handler.read_metadata(
+                file_name=self.KEY_DERIVATION_FILE_NAME
+            )
+        ):
+            self._directory_handler.write_metadata(
+                file_name=self.KEY_DERIVATION_FILE_NAME, data=record
+            )
+        if any(
+            r is not None
+            for r in self._directory_handler.read_metadata(
+                file_name=self.PENDING_KEY_DERIVATION_FILE_NAME
+            )
+        ):
+            self._directory_handler.delete_metadata(
+                file_name=self.PENDING_KEY_DERIVATION_FILE_NAME
+            )
+
+    def _get_archive_key(
+        self, archive_file_path: str, main_password: str | None
+    ) -> bytes:
+        if main_password is None:
+            return self._key
+        from file_manipulation.directory_archiver import DirectoryArchiver
+
+        try:
+            record = DirectoryArchiver.read_metadata(
+                archive_file_path=archive_file_path,
+                file_name=self.KEY_DERIVATION_FILE_NAME,
+            )
+        except KeyError:
+            return self._get_legacy_key(main_password=main_password)
+        key, _ = KeyDerivation.unwrap_key(
+            record=record, password=main_password
+        )
+        return key
+
+    @classmethod
+    def _get_legacy_key(cls, main_password: str) -> bytes:
+        main_password_bytes = main_password.encode(cls.STRING_ENCODING)
+        return hashlib.sha256(main_password_bytes).digest()
+
+    @classmethod
+    def _ensure_valid_account_name(cls, account_name: str):
+        ## Checked before writing, as an account name is a file name in the
+        ## replicas, which must not leave them
+        if not cls.is_valid_account_name(account_name=account_name):
+            raise ValueError(f"Invalid account name: \"{account_name}\"")
 
     def _ensure_account_exists(self, account_name: str):
         if not self._directory_handler.file_exists(file_name=account_name):
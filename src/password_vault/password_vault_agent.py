@@ -0,0 +1,384 @@
+from __future__ import annotations
+import getpass
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import tempfile
+import time
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from password_vault.password_vault import PasswordVault
+
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordVaultAgentProtocol:
+    """
+    Each message is a frame of a 4-byte big-endian length followed by a UTF-8
+    JSON object.
+
+    Request: {"command": str, ...arguments}
+    Response: {"ok": true, "result": ...} or
+        {"ok": false, "error_type": str, "error": str}
+    """
+
+    HEADER_FORMAT = ">I"
+    HEADER_NUM_BYTES = struct.calcsize(HEADER_FORMAT)
+    MAX_FRAME_NUM_BYTES = 1 << 20
+    STRING_ENCODING = "utf-8"
+    ## Errors raised again on the client side with the same type
+    ERROR_TYPES = {
+        FileNotFoundError.__name__: FileNotFoundError,
+        ValueError.__name__: ValueError,
+    }
+
+    @classmethod
+    def send(cls, sock: socket.socket, message: dict):
+        payload = json.dumps(message).encode(cls.STRING_ENCODING)
+        if len(payload) > cls.MAX_FRAME_NUM_BYTES:
+            raise ValueError("Message is too large")
+        sock.sendall(struct.pack(cls.HEADER_FORMAT, len(payload)) + payload)
+
+    @classmethod
+    def receive(cls, sock: socket.socket) -> dict | None:
+        """
+        Return
+        ----
+        dict | None: message, or None if the peer closed the connection.
+        """
+        header = cls._receive_exactly(sock=sock, n=cls.HEADER_NUM_BYTES)
+        if header is None:
+            return None
+        (n,) = struct.unpack(cls.HEADER_FORMAT, header)
+        if n > cls.MAX_FRAME_NUM_BYTES:
+            raise ValueError("Message is too large")
+        payload = cls._receive_exactly(sock=sock, n=n)
+        if payload is None:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        return json.loads(payload.decode(cls.STRING_ENCODING))
+
+    @classmethod
+    def get_default_socket_path(cls) -> str:
+        runtime_directory = os.environ.get("XDG_RUNTIME_DIR")
+        if runtime_directory is None:
+            runtime_directory = os.path.join(
+                tempfile.gettempdir(), f"password-vault-{getpass.getuser()}"
+            )
+        return os.path.join(runtime_directory, "password-vault", "agent.sock")
+
+    @classmethod
+    def make_socket_directory(cls, socket_path: str):
+        """
+        Create the missing directories of a socket, accessible by the user
+        only, and check them. See `check_socket_directory`.
+        """
+        directory = os.path.dirname(os.path.abspath(socket_path))
+        missing_directories = []
+        while not os.path.lexists(directory):
+            missing_directories.append(directory)
+            directory = os.path.dirname(directory)
+        for directory in reversed(missing_directories):
+            try:
+                ## Created one by one, as `os.makedirs` applies the mode to
+                ## the last directory only
+                os.mkdir(directory, mode=0o700)
+            except FileExistsError:
+                ## Case: created by someone else meanwhile, which the check
+                ## rejects unless it is safe
+                pass
+        cls.check_socket_directory(socket_path=socket_path)
+
+    @classmethod
+    def check_socket_directory(cls, socket_path: str):
+        """
+        Check that no other user can replace the socket: its directory is
+        owned by the user and accessible by the user only, and every parent
+        directory is owned by the user or root, and writable by others only
+        if sticky, like /tmp.
+
+        Raise
+        ----
+        ValueError: if a directory is not safe
+        """
+        if not hasattr(os, "getuid"):
+            return
+        uid = os.getuid()
+        directory = os.path.dirname(os.path.abspath(socket_path))
+        directory_stat = os.lstat(directory)
+        if (
+            not stat.S_ISDIR(directory_stat.st_mode)
+            or directory_stat.st_uid != uid
+            or directory_stat.st_mode & 0o077 != 0
+        ):
+            raise ValueError(
+                f"Directory of the agent socket \"{directory}\" must be "
+                "owned by the user and accessible by the user only"
+            )
+        while directory != os.path.dirname(directory):
+            directory = os.path.dirname(directory)
+            directory_stat = os.stat(directory)
+            if directory_stat.st_uid not in (uid, 0) or (
+                directory_stat.st_mode & 0o022 != 0
+                and directory_stat.st_mode & stat.S_ISVTX == 0
+            ):
+                raise ValueError(
+                    f"Directory \"{directory}\" of the agent socket can be "
+                    "changed by other users"
+                )
+
+    @classmethod
+    def check_socket(cls, socket_path: str):
+        """
+        Check that the socket, and its directory, belong to the user, before
+        sending it account names. See `check_socket_directory`.
+
+        Raise
+        ----
+        ValueError: if the socket or its directory is not safe
+        """
+        cls.check_socket_directory(socket_path=socket_path)
+        if not hasattr(os, "getuid"):
+            return
+        socket_stat = os.lstat(socket_path)
+        if (
+            not stat.S_ISSOCK(socket_stat.st_mode)
+            or socket_stat.st_uid != os.getuid()
+        ):
+            raise ValueError(
+                f"Agent socket \"{socket_path}\" is not owned by the user"
+            )
+
+    @classmethod
+    def _receive_exactly(cls, sock: socket.socket, n: int) -> bytes | None:
+        chunks = []
+        n_remaining = n
+        while n_remaining > 0:
+            chunk = sock.recv(n_remaining)
+            if chunk == b"":
+                if n_remaining == n:
+                    return None
+                raise ConnectionError(
+                    "Connection closed in the middle of a frame"
+                )
+            chunks.append(chunk)
+            n_remaining -= len(chunk)
+        return b"".join(chunks)
+
+
+class PasswordVaultAgent:
+    """
+    Keep an unlocked password vault in memory, and answer lookups from other
+    processes of the same user over a Unix domain socket, like ssh-agent.
+
+    The agent stops after being idle for `idle_timeout` seconds, or after
+    serving `max_requests` requests, whichever comes first.
+    """
+
+    IDLE_TIMEOUT = 900
+    MAX_REQUESTS = 10000
+    CONNECTION_TIMEOUT = 5
+
+    def __init__(
+        self,
+        password_vault: PasswordVault,
+        socket_path: str | None = None,
+        idle_timeout: float = IDLE_TIMEOUT,
+        max_requests: int = MAX_REQUESTS,
+    ):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError(
+                "Unix domain sockets are not supported on this platform."
+            )
+        assert idle_timeout > 0 and max_requests > 0
+        self._password_vault = password_vault
+        self._socket_path = (
+            PasswordVaultAgentProtocol.get_default_socket_path()
+            if socket_path is None
+            else socket_path
+        )
+        self._idle_timeout = idle_timeout
+        self._max_requests = max_requests
+        self._n_requests = 0
+        self._is_stopped = False
+
+    @property
+    def socket_path(self) -> str:
+        return self._socket_path
+
+    def serve_forever(self):
+        ## Warm up the search, which imports its dependencies on first use
+        self._password_vault.search_account_name(
+            account_name="", n_candidates=1
+        )
+        server = self._bind()
+        logger.info(f"Agent is listening on \"{self._socket_path}\"")
+        last_active_time = time.monotonic()
+        try:
+            while (
+                self._is_stopped is False
+                and self._n_requests < self._max_requests
+            ):
+                idle_time = time.monotonic() - last_active_time
+                if idle_time >= self._idle_timeout:
+                    logger.info("Agent is idle for too long")
+                    break
+                server.settimeout(self._idle_timeout - idle_time)
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    self._serve_connection(connection=connection)
+                last_active_time = time.monotonic()
+        finally:
+            server.close()
+            try:
+                os.unlink(self._socket_path)
+            except FileNotFoundError:
+                pass
+            logger.info(f"Agent stopped after {self._n_requests} requests")
+
+    def _bind(self) -> socket.socket:
+        PasswordVaultAgentProtocol.make_socket_directory(
+            socket_path=self._socket_path
+        )
+        if os.path.exists(self._socket_path):
+            try:
+                PasswordVaultAgentClient(
+                    socket_path=self._socket_path
+                ).request(command="ping")
+            except ConnectionError:
+                ## Case: stale socket of an agent which did not exit cleanly
+                os.unlink(self._socket_path)
+            else:
+                raise ValueError(
+                    f"An agent is already listening on \"{self._socket_path}\""
+                )
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        previous_umask = os.umask(0o177)
+        try:
+            server.bind(self._socket_path)
+        finally:
+            os.umask(previous_umask)
+        server.listen()
+        return server
+
+    def _serve_connection(self, connection: socket.socket):
+        connection.settimeout(self.CONNECTION_TIMEOUT)
+        if not self._is_peer_trusted(connection=connection):
+            logger.warning("Rejected a connection from another user")
+            return
+        while self._n_requests < self._max_requests:
+            try:
+                request = PasswordVaultAgentProtocol.receive(sock=connection)
+            except (ConnectionError, ValueError, socket.timeout):
+                return
+            if request is None:
+                return
+            self._n_requests += 1
+            response = self._handle_request(request)
+            try:
+                PasswordVaultAgentProtocol.send(
+                    sock=connection, message=response
+                )
+            except OSError:
+                return
+            if self._is_stopped is True:
+                return
+
+    def _handle_request(self, request: dict) -> dict:
+        command = request.get("command")
+        try:
+            if command == "ping":
+                result = None
+            elif command == "get":
+                result = self._password_vault.get_account(
+                    account_name=str(request["account_name"])
+                )
+            elif command == "search":
+                result = self._password_vault.search_account_name(
+                    account_name=str(request["account_name"]),
+                    n_candidates=int(request.get("n_candidates", 9)),
+                )
+            elif command == "list":
+                result = sorted(self._password_vault.get_all_accounts_name())
+            elif command == "stop":
+                self._is_stopped = True
+                result = None
+            else:
+                raise ValueError(f"Unknown command: \"{command}\"")
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            return {
+                "ok": False,
+                "error_type": type(e).__name__,
+                "error": str(e),
+            }
+        return {"ok": True, "result": result}
+
+    @classmethod
+    def _is_peer_trusted(cls, connection: socket.socket) -> bool:
+        if not hasattr(socket, "SO_PEERCRED"):
+            ## The socket file is only accessible by its owner anyway
+            return True
+        credentials = connection.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", credentials)
+        return uid == os.getuid()
+
+
+class PasswordVaultAgentClient:
+    TIMEOUT = 5
+
+    def __init__(self, socket_path: str | None = None):
+        self._socket_path = (
+            PasswordVaultAgentProtocol.get_default_socket_path()
+            if socket_path is None
+            else socket_path
+        )
+
+    def request(self, command: str, **kwargs):
+        """
+        Send one request to the agent.
+
+        Raises
+        ----
+        FileNotFoundError | ValueError
+            Raised by the vault in the agent.
+        ConnectionError
+            The agent is not running, or its socket is not safe to use.
+        """
+        try:
+            PasswordVaultAgentProtocol.check_socket(
+                socket_path=self._socket_path
+            )
+        except ValueError as e:
+            raise ConnectionError(f"Agent socket is not trusted: {e}")
+        except OSError as e:
+            raise ConnectionError(f"Cannot reach the agent: {e}")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.TIMEOUT)
+                sock.connect(self._socket_path)
+                PasswordVaultAgentProtocol.send(
+                    sock=sock, message={"command": command, **kwargs}
+                )
+                response = PasswordVaultAgentProtocol.receive(sock=sock)
+        except ConnectionError:
+            raise
+        except OSError as e:
+            raise ConnectionError(f"Cannot reach the agent: {e}")
+        if response is None:
+            raise ConnectionError("Agent closed the connection")
+        if response["ok"] is not True:
+            error_type = PasswordVaultAgentProtocol.ERROR_TYPES.get(
+                response.get("error_type"), ValueError
+            )
+            raise error_type(response.get("error"))
+        return response["result"]
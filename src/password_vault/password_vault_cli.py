@@ -0,0 +1,711 @@
+from __future__ import annotations
+import argparse
+from functools import partial
+import getpass
+import json
+import logging
+import os
+import sys
+import time
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from password_vault.password_vault import PasswordVault
+    from util.operation_progress import OperationProgress, ProgressSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordVaultCli:
+    CACHES_DIRECTORY = "caches"
+    METADATA_FILE_NAME = "metadata.json"
+    DATA_REPLICA_DIRECTORIES_FIELD = "directories"
+    ASYNCHRONOUS_DATA_REPLICA_DIRECTORIES_FIELD = "asynchronous_directories"
+    MAIN_PASSWORD_ENVIRONMENT_VARIABLE = "PASSWORD_VAULT_MAIN_PASSWORD"
+    AGENT_SOCKET_ENVIRONMENT_VARIABLE = "PASSWORD_VAULT_AGENT_SOCKET"
+    ## Seconds between the logs of the progress of a long operation
+    PROGRESS_LOG_INTERVAL = 1.0
+    STRING_ENCODING = "utf-8"
+
+    def __init__(
+        self, password_vault_directory: str, start_time: float | None = None
+    ):
+        """
+        Parameters
+        ----
+        password_vault_directory : str
+            Directory of the app, where the GUI keeps its metadata.
+        start_time : float | None
+            `time.perf_counter()` at process start, used by "--timing".
+        """
+        self._metadata_file_path: str = os.path.join(
+            password_vault_directory,
+            self.CACHES_DIRECTORY,
+            self.METADATA_FILE_NAME,
+        )
+        self._start_time = (
+            time.perf_counter() if start_time is None else start_time
+        )
+        self._is_timing: bool = False
+        self._is_first_output_done: bool = False
+        self._password_vault = None
+        self._parser = self._build_parser()
+
+    def run(self, argv: list) -> int:
+        """
+        Return
+        ----
+        int: exit code
+        """
+        args = self._parser.parse_args(argv)
+        self._is_timing = args.timing
+        tracer = None
+        if args.trace is not None:
+            from util.span_tracer import SpanTracer
+
+            tracer = SpanTracer()
+            tracer.start()
+        try:
+            exit_code = args.command_function(args)
+            ## Flushed here, where a closed pipe is handled below
+            sys.stdout.flush()
+            return exit_code
+        except (FileNotFoundError, ValueError) as e:
+            logger.error("{}: {}".format(type(e).__name__, e))
+            return 1
+        except BrokenPipeError:
+            ## Case: the reader of the output exited, such as `head`. The
+            ## output is discarded, so that flushing it on exit does not
+            ## raise again, and the vault is still closed below.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 1
+        finally:
+            if self._password_vault is not None:
+                self._close_password_vault()
+            if tracer is not None:
+                tracer.stop()
+                tracer.save(file_path=args.trace)
+                logger.info(f"Saved the trace to \"{args.trace}\"")
+            if self._password_vault is not None and logger.isEnabledFor(
+                logging.DEBUG
+            ):
+                logger.debug(
+                    "I/O stats:\n" + self._password_vault.stats_report()
+                )
+            if self._is_timing:
+                self._log_elapsed_time(event="Exit")
+
+    def _build_parser(self) -> argparse.ArgumentParser:
+        parser = argparse.ArgumentParser(
+            description="Headless access to the password vault."
+        )
+        parser.add_argument(
+            "-d",
+            "--directory",
+            action="append",
+            dest="directories",
+            help=(
+                "Data replica directory. Can be repeated. Defaults to the "
+                "directories configured in the GUI."
+            ),
+        )
+        parser.add_argument(
+            "-a",
+            "--async-directory",
+            action="append",
+            dest="asynchronous_directories",
+            help=(
+                "Data replica directory written in the background, such as "
+                "a mirror on a USB drive. Can be repeated. Defaults to the "
+                "asynchronous directories configured in the GUI."
+            ),
+        )
+        parser.add_argument(
+            "--timing",
+            action="store_true",
+            help="Log the time to the first output and to exit.",
+        )
+        parser.add_argument(
+            "--trace",
+            metavar="FILE",
+            help=(
+                "Save the time spent in the handler stack as a trace, "
+                "viewable in ui.perfetto.dev or chrome://tracing."
+            ),
+        )
+        parser.add_argument(
+            "--agent-socket",
+            default=os.environ.get(self.AGENT_SOCKET_ENVIRONMENT_VARIABLE),
+            help=(
+                "Socket of a running agent, which answers get / search / "
+                "list without unlocking the vault again. Defaults to the "
+                "environment variable "
+                f"{self.AGENT_SOCKET_ENVIRONMENT_VARIABLE}."
+            ),
+        )
+        subparsers = parser.add_subparsers(required=True)
+
+        get_parser = subparsers.add_parser(
+            "get", help="Print the details of an account."
+        )
+        get_parser.add_argument("account_name", help="Name of the account.")
+        get_parser.add_argument(
+            "-f",
+            "--field",
+            help="Print the raw value of this field only.",
+        )
+        get_parser.set_defaults(command_function=self._get_command)
+
+        set_parser = subparsers.add_parser(
+            "set", help="Create an account, or update its fields."
+        )
+        set_parser.add_argument("account_name", help="Name of the account.")
+        set_parser.add_argument(
+            "fields",
+            nargs="*",
+            metavar="FIELD=VALUE",
+            help="Fields to be set.",
+        )
+        set_parser.add_argument(
+            "--stdin",
+            metavar="FIELD",
+            help="Read the value of this field from the standard input, so "
+            "that it does not appear in the process list.",
+        )
+        set_parser.set_defaults(command_function=self._set_command)
+
+        search_parser = subparsers.add_parser(
+            "search", help="Print the best matched account names."
+        )
+        search_parser.add_argument("account_name", help="Text to search.")
+        search_parser.add_argument(
+            "-n",
+            "--n-candidates",
+            type=int,
+            default=9,
+            help="Maximum number of account names to print.",
+        )
+        search_parser.set_defaults(command_function=self._search_command)
+
+        list_parser = subparsers.add_parser(
+            "list", help="Print the names of all accounts."
+        )
+        list_parser.set_defaults(command_function=self._list_command)
+
+        import_parser = subparsers.add_parser(
+            "import", help="Import accounts from a CSV / JSON export."
+        )
+        import_parser.add_argument("file", help="File to be imported.")
+        import_parser.add_argument(
+            "--format",
+            choices=("csv", "json", "jsonl"),
+            help="File format. Defaults to the file extension.",
+        )
+        import_parser.add_argument(
+            "--on-conflict",
+            choices=("skip", "overwrite", "rename"),
+            default="skip",
+            help="What to do with accounts whose names already exist.",
+        )
+        import_parser.add_argument(
+            "--map",
+            action="append",
+            default=[],
+            metavar="COLUMN=FIELD",
+            help="Map a column of the file to an account field.",
+        )
+        import_parser.set_defaults(command_function=self._import_command)
+
+        export_parser = subparsers.add_parser(
+            "export", help="Export the decrypted accounts."
+        )
+        export_parser.add_argument(
+            "-o",
+            "--output",
+            help="Output file, created readable by the owner only. "
+            "Defaults to the standard output.",
+        )
+        export_parser.add_argument(
+            "--format",
+            choices=("jsonl", "json"),
+            default="jsonl",
+            help="Output format.",
+        )
+        export_parser.set_defaults(command_function=self._export_command)
+
+        archive_parser = subparsers.add_parser(
+            "archive", help="Archive the encrypted accounts into a zip file."
+        )
+        archive_parser.add_argument(
+            "file", help="Archive to be created, ending with \".zip\"."
+        )
+        archive_parser.add_argument(
+            "-b",
+            "--base",
+            help="Previous archive of the vault, in the same directory. Only "
+            "the accounts changed since that archive are stored, unless the "
+            "main password was changed since.",
+        )
+        archive_parser.set_defaults(command_function=self._archive_command)
+
+        for command, help_text, command_function in (
+            (
+                "verify",
+                "Check that every account in an archive can be decrypted, "
+                "without extracting it.",
+                self._verify_command,
+            ),
+            (
+                "restore",
+                "Restore the accounts in an archive into the vault, "
+                "overwriting the accounts of the same names.",
+                self._restore_command,
+            ),
+        ):
+            archive_check_parser = subparsers.add_parser(
+                command, help=help_text
+            )
+            archive_check_parser.add_argument(
+                "file",
+                help="Archive. The base archives of an incremental archive "
+                "must be in the same directory.",
+            )
+            archive_check_parser.add_argument(
+                "--archive-password",
+                action="store_true",
+                help="Prompt for the main password at the time of archiving, "
+                "if it was changed since.",
+            )
+            archive_check_parser.set_defaults(
+                command_function=command_function
+            )
+
+        recalibrate_parser = subparsers.add_parser(
+            "recalibrate",
+            help="Calibrate the cost of the key derivation again, such as "
+            "after a hardware upgrade. The accounts are not re-encrypted.",
+        )
+        recalibrate_parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=300,
+            help="Time that unlocking should spend deriving the key.",
+        )
+        recalibrate_parser.set_defaults(
+            command_function=self._recalibrate_command
+        )
+
+        migrate_layout_parser = subparsers.add_parser(
+            "migrate-layout",
+            help="Store the accounts under encoded names in hash-sharded "
+            "subdirectories of the replicas.",
+        )
+        migrate_layout_parser.set_defaults(
+            command_function=self._migrate_layout_command
+        )
+
+        quorums_parser = subparsers.add_parser(
+            "quorums",
+            help="Show, or set, the number of replicas which must be written "
+            "before a change returns, and read before an account is returned.",
+        )
+        quorums_parser.add_argument(
+            "-w",
+            "--write",
+            type=int,
+            help="Write quorum. The other replicas are written in the "
+            "background.",
+        )
+        quorums_parser.add_argument(
+            "-r",
+            "--read",
+            type=int,
+            help="Read quorum. The most recently written copy is returned.",
+        )
+        quorums_parser.set_defaults(command_function=self._quorums_command)
+
+        agent_parser = subparsers.add_parser(
+            "agent",
+            help="Unlock the vault once, and serve get / search / list "
+            "requests on a Unix domain socket.",
+        )
+        agent_parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=900,
+            help="Stop after being idle for this number of seconds.",
+        )
+        agent_parser.add_argument(
+            "--max-requests",
+            type=int,
+            default=10000,
+            help="Stop after serving this number of requests.",
+        )
+        agent_parser.set_defaults(command_function=self._agent_command)
+        return parser
+
+    def _agent_command(self, args: argparse.Namespace) -> int:
+        from password_vault.password_vault_agent import PasswordVaultAgent
+
+        agent = PasswordVaultAgent(
+            password_vault=self._open_password_vault(args=args),
+            socket_path=args.agent_socket,
+            idle_timeout=args.idle_timeout,
+            max_requests=args.max_requests,
+        )
+        self._print(
+            f"{self.AGENT_SOCKET_ENVIRONMENT_VARIABLE}={agent.socket_path}; "
+            f"export {self.AGENT_SOCKET_ENVIRONMENT_VARIABLE};"
+        )
+        sys.stdout.flush()
+        agent.serve_forever()
+        return 0
+
+    def _get_command(self, args: argparse.Namespace) -> int:
+        details = self._request_agent(
+            args=args, command="get", account_name=args.account_name
+        )
+        if details is None:
+            password_vault = self._open_password_vault(args=args)
+            details = password_vault.get_account(
+                account_name=args.account_name
+            )
+        if args.field is None:
+            self._print(json.dumps(details, indent=4))
+        elif args.field in details:
+            self._print(details[args.field])
+        else:
+            raise ValueError(
+                f"Field \"{args.field}\" does not exist in account "
+                f"\"{args.account_name}\""
+            )
+        return 0
+
+    def _set_command(self, args: argparse.Namespace) -> int:
+        from password_vault.password_vault import PasswordVault
+
+        fields = {}
+        for f in args.fields:
+            key, sep, value = f.partition("=")
+            if sep == "" or key == "":
+                raise ValueError(f"Invalid field: \"{f}\"")
+            fields[key] = value
+        if args.stdin is not None:
+            fields[args.stdin] = sys.stdin.readline().rstrip("\r\n")
+        if PasswordVault.ACCOUNT_NAME_TAG in fields:
+            raise ValueError(
+                f"Field \"{PasswordVault.ACCOUNT_NAME_TAG}\" cannot be set"
+            )
+        if not PasswordVault.is_valid_account_name(
+            account_name=args.account_name
+        ):
+            raise ValueError(f"Invalid account name: \"{args.account_name}\"")
+        password_vault = self._open_password_vault(args=args)
+        if args.account_name in password_vault:
+            details = password_vault.get_account(
+                account_name=args.account_name
+            )
+        else:
+            details = password_vault.get_blank_account()
+            details[PasswordVault.ACCOUNT_NAME_TAG] = args.account_name
+        details.update(fields)
+        password_vault.update_account(details=details)
+        logger.info(f"Updated account:\"{args.account_name}\"")
+        return 0
+
+    def _search_command(self, args: argparse.Namespace) -> int:
+        account_names = self._request_agent(
+            args=args,
+            command="search",
+            account_name=args.account_name,
+            n_candidates=args.n_candidates,
+        )
+        if account_names is None:
+            password_vault = self._open_password_vault(args=args)
+            account_names = password_vault.search_account_name(
+                account_name=args.account_name,
+                n_candidates=args.n_candidates,
+            )
+        self._print("\n".join(account_names))
+        return 0
+
+    def _list_command(self, args: argparse.Namespace) -> int:
+        account_names = self._request_agent(args=args, command="list")
+        if account_names is None:
+            password_vault = self._open_password_vault(args=args)
+            account_names = sorted(password_vault.get_all_accounts_name())
+        self._print("\n".join(account_names))
+        return 0
+
+    def _request_agent(self, args: argparse.Namespace, command: str, **kwargs):
+        """
+        Return
+        ----
+        Any: result from the agent, or None if no agent is available.
+        """
+        if args.agent_socket is None:
+            return None
+        from password_vault.password_vault_agent import (
+            PasswordVaultAgentClient,
+        )
+
+        try:
+            return PasswordVaultAgentClient(
+                socket_path=args.agent_socket
+            ).request(command=command, **kwargs)
+        except ConnectionError as e:
+            logger.debug(f"Agent is not available: {e}")
+            return None
+
+    def _import_command(self, args: argparse.Namespace) -> int:
+        from password_vault.account_importer import AccountImporter
+
+        fields_map = {}
+        for m in args.map:
+            column, sep, field = m.partition("=")
+            if sep == "":
+                raise ValueError(f"Invalid field mapping: \"{m}\"")
+            fields_map[column] = field
+        importer = AccountImporter(
+            password_vault=self._open_password_vault(args=args),
+            fields_map=fields_map,
+            conflict_policy=args.on_conflict,
+        )
+        result = importer.import_file(
+            file_path=args.file, file_format=args.format
+        )
+        self._print(
+            f"Imported: {result.n_imported}, "
+            f"skipped: {result.n_skipped}, "
+            f"renamed: {result.n_renamed}, "
+            f"invalid: {result.n_invalid}"
+        )
+        for account_name in result.conflicts:
+            logger.info(f"Conflicting account name: \"{account_name}\"")
+        return 0
+
+    def _export_command(self, args: argparse.Namespace) -> int:
+        password_vault = self._open_password_vault(args=args)
+        if args.output is None:
+            f = None
+            write = partial(self._print, end="")
+        else:
+            f = open(
+                os.open(
+                    args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+                ),
+                "w",
+                encoding=self.STRING_ENCODING,
+            )
+            write = f.write
+        n_accounts = 0
+        try:
+            if args.format == "json":
+                write("[")
+            for _, details in password_vault.iter_accounts():
+                if args.format == "json":
+                    write(",\n" if n_accounts > 0 else "\n")
+                write(json.dumps(details))
+                if args.format == "jsonl":
+                    write("\n")
+                n_accounts += 1
+            if args.format == "json":
+                write("\n]\n")
+        finally:
+            if f is not None:
+                f.close()
+        logger.info(f"Exported {n_accounts} accounts")
+        return 0
+
+    def _archive_command(self, args: argparse.Namespace) -> int:
+        if not args.file.endswith(".zip"):
+            raise ValueError(f"Archive \"{args.file}\" must end with \".zip\"")
+        password_vault = self._open_password_vault(args=args)
+        password_vault.create_archive(
+            archive_file_path=args.file,
+            base_archive_file_path=args.base,
+            progress=self._make_progress(),
+        )
+        logger.info(f"Archived the vault to \"{args.file}\"")
+        return 0
+
+    def _verify_command(self, args: argparse.Namespace) -> int:
+        password_vault = self._open_password_vault(args=args)
+        bad_accounts_name = password_vault.verify_archive(
+            archive_file_path=args.file,
+            main_password=self._get_archive_password(args=args),
+            progress=self._make_progress(),
+        )
+        for account_name in bad_accounts_name:
+            self._print(account_name)
+        if len(bad_accounts_name) > 0:
+            logger.error(
+                f"{len(bad_accounts_name)} accounts in the archive are "
+                "missing or corrupted"
+            )
+            return 1
+        logger.info(f"Archive \"{args.file}\" is intact")
+        return 0
+
+    def _restore_command(self, args: argparse.Namespace) -> int:
+        password_vault = self._open_password_vault(args=args)
+        bad_accounts_name = password_vault.restore_archive(
+            archive_file_path=args.file,
+            main_password=self._get_archive_password(args=args),
+            progress=self._make_progress(),
+        )
+        for account_name in bad_accounts_name:
+            self._print(account_name)
+        if len(bad_accounts_name) > 0:
+            logger.error(
+                f"{len(bad_accounts_name)} accounts in the archive are "
+                "missing or corrupted, and not restored"
+            )
+            return 1
+        logger.info(f"Restored the archive \"{args.file}\"")
+        return 0
+
+    def _recalibrate_command(self, args: argparse.Namespace) -> int:
+        main_password = self._get_main_password()
+        password_vault = self._open_password_vault(
+            args=args, main_password=main_password
+        )
+        parameters = password_vault.recalibrate_key_derivation(
+            main_password=main_password, target_time=args.target_ms / 1000
+        )
+        logger.info(
+            "Key derivation: scrypt, N = {}, r = {}, p = {}, {} MiB".format(
+                parameters.n,
+                parameters.r,
+                parameters.p,
+                parameters.memory_size // 2**20,
+            )
+        )
+        return 0
+
+    def _migrate_layout_command(self, args: argparse.Namespace) -> int:
+        password_vault = self._open_password_vault(args=args)
+        password_vault.migrate_to_sharded_layout()
+        logger.info("Migrated to the sharded layout")
+        return 0
+
+    def _quorums_command(self, args: argparse.Namespace) -> int:
+        password_vault = self._open_password_vault(args=args)
+        write_quorum, read_quorum, n_replicas = password_vault.get_quorums()
+        if args.write is not None or args.read is not None:
+            write_quorum = write_quorum if args.write is None else args.write
+            read_quorum = read_quorum if args.read is None else args.read
+            password_vault.set_quorums(
+                write_quorum=write_quorum, read_quorum=read_quorum
+            )
+        self._print(
+            f"Write quorum: {write_quorum} of {n_replicas} replicas\n"
+            f"Read quorum: {read_quorum} of {n_replicas} replicas"
+        )
+        return 0
+
+    def _open_password_vault(
+        self, args: argparse.Namespace, main_password: str | None = None
+    ) -> PasswordVault:
+        ## Imported here, so that requests answered by an agent do not load
+        ## the handler stack and the crypto library
+        from password_vault.password_vault import PasswordVault
+
+        directories = args.directories
+        if directories is None:
+            directories = self._load_directories(
+                field=self.DATA_REPLICA_DIRECTORIES_FIELD
+            )
+        asynchronous_directories = args.asynchronous_directories
+        if asynchronous_directories is None:
+            asynchronous_directories = self._load_directories(
+                field=self.ASYNCHRONOUS_DATA_REPLICA_DIRECTORIES_FIELD
+            )
+        directories = directories + [
+            d for d in asynchronous_directories if d not in directories
+        ]
+        if len(directories) == 0:
+            raise ValueError(
+                "Must specify at least one directory to store the account "
+                "data."
+            )
+        if main_password is None:
+            main_password = self._get_main_password()
+        self._password_vault = PasswordVault(
+            directories=directories,
+            main_password=main_password,
+            asynchronous_directories=asynchronous_directories,
+        )
+        return self._password_vault
+
+    def _close_password_vault(self):
+        self._password_vault.close()
+        n_queued_changes = self._password_vault.get_n_queued_changes()
+        for directory, n_changes in n_queued_changes.items():
+            if n_changes > 0:
+                logger.info(
+                    f"{n_changes} changes are queued for \"{directory}\", "
+                    "to be written when it is reachable"
+                )
+
+    def _get_main_password(self) -> str:
+        main_password = os.environ.get(self.MAIN_PASSWORD_ENVIRONMENT_VARIABLE)
+        if main_password is None:
+            main_password = getpass.getpass("Enter the main password: ")
+        if main_password == "":
+            raise ValueError("Password cannot be empty.")
+        return main_password
+
+    def _get_archive_password(self, args: argparse.Namespace) -> str | None:
+        if not args.archive_password:
+            return None
+        main_password = getpass.getpass(
+            "Enter the main password of the archive: "
+        )
+        if main_password == "":
+            raise ValueError("Password cannot be empty.")
+        return main_password
+
+    def _make_progress(self) -> OperationProgress:
+        """
+        Progress of a long operation, logged at most every
+        `PROGRESS_LOG_INTERVAL` seconds, and at the end of each stage.
+        """
+        from util.operation_progress import OperationProgress
+
+        last_log_time = None
+
+        def log_progress(snapshot: ProgressSnapshot):
+            nonlocal last_log_time
+            current_time = time.perf_counter()
+            is_stage_done = snapshot.n_items_done == snapshot.n_items_total
+            if (
+                not is_stage_done
+                and last_log_time is not None
+                and current_time - last_log_time < self.PROGRESS_LOG_INTERVAL
+            ):
+                return
+            last_log_time = current_time
+            logger.info(snapshot.describe())
+
+        return OperationProgress(callback=log_progress)
+
+    def _print(self, text: str, end: str = "\n"):
+        sys.stdout.write(text + end)
+        if self._is_first_output_done is False:
+            self._is_first_output_done = True
+            if self._is_timing:
+                sys.stdout.flush()
+                self._log_elapsed_time(event="First output")
+
+    def _log_elapsed_time(self, event: str):
+        elapsed_time = time.perf_counter() - self._start_time
+        logger.info(f"{event} after {elapsed_time * 1000:.1f} ms")
+
+    def _load_directories(self, field: str) -> list:
+        if not os.path.isfile(self._metadata_file_path):
+            return []
+        with open(self._metadata_file_path, "r") as f:
+            return json.load(f).get(field, [])
@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import dataclasses
 import datetime
 import enum
 from enum import Enum
@@ -6,6 +7,8 @@ from functools import partial
 import json
 import logging
 import os
+import queue
+import threading
 import time
 import tkinter as tk
 import tkinter.font
@@ -14,9 +17,13 @@ import tkinter.messagebox
 import tkinter.scrolledtext
 import tkinter.simpledialog
 import traceback
+from typing import Callable, Optional
 
-from fsm.enum_fsm import EnumFsm
-from password_vault.password_vault import PasswordVault
+from fsm.enum_fsm import EnumFsm, FsmEvent, StateEntered
+from fsm.fsm_instrumentation import FsmInstrumentation
+from util.console_buffer import ConsoleBuffer
+from util.incremental_list_box import IncrementalListBox
+from util.operation_progress import OperationCancelledError, OperationProgress
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +36,7 @@ class FsmState(Enum):
     ADD_DATA_REPLICA_DIRECTORY = enum.auto()
     DELETE_DATA_REPLICA_DIRECTORY = enum.auto()
     ASK_MAIN_PASSWORD = enum.auto()
+    UNLOCK_VAULT = enum.auto()
     MAIN_MENU = enum.auto()
     SEARCH_ACCOUNT = enum.auto()
     CHANGE_PASSWORD = enum.auto()
@@ -36,16 +44,85 @@ class FsmState(Enum):
     EXIT = enum.auto()
 
 
+@dataclasses.dataclass(frozen=True)
+class UserInputChanged(FsmEvent):
+    text: str
+
+
+@dataclasses.dataclass(frozen=True)
+class InputConfirmed(FsmEvent):
+    text: str
+
+
+@dataclasses.dataclass(frozen=True)
+class CommandButtonPressed(FsmEvent):
+    command: str
+
+
+@dataclasses.dataclass(frozen=True)
+class KeyPressed(FsmEvent):
+    key: str
+
+
+@dataclasses.dataclass(frozen=True)
+class AccountNameSelected(FsmEvent):
+    account_name: str
+
+
+@dataclasses.dataclass(frozen=True)
+class UnlockFinished(FsmEvent):
+    ## PasswordVault, or None if unlocking failed
+    password_vault: object
+    error: Optional[Exception]
+
+
+@dataclasses.dataclass(frozen=True)
+class PasswordChangeFinished(FsmEvent):
+    is_archived: bool
+    error: Optional[Exception]
+
+
 class PasswordVaultGui:
     CACHES_DIRECTORY = "caches"
     METADATA_FILE_NAME = "metadata.json"
+    FSM_PROFILE_FILE_NAME = "fsm_profile.jsonl"
     DATA_REPLICA_DIRECTORIES_FIELD = "directories"
+    ## Edited in the metadata file, as a mirror is rarely added
+    ASYNCHRONOUS_DATA_REPLICA_DIRECTORIES_FIELD = "asynchronous_directories"
     STRING_ENCODING = "utf-8"
     CONSOLE_MAX_LINES = 200
     ACCOUNT_NAMES_VIEW_N_CANDIDATES = 64
     MAX_IDLING_TIME = 300
+    OPERATION_PROGRESS_INTERVAL_MS = 250
+    CHANGES_CHECK_INTERVAL_MS = 1000
 
-    def __init__(self, password_vault_directory: str):
+    def __init__(
+        self,
+        password_vault_directory: str,
+        on_window_shown: Optional[Callable] = None,
+        is_fsm_profiled: bool = False,
+    ):
+        """
+        Parameters
+        ----
+        password_vault_directory : str
+            Directory of the app, where the caches are kept.
+        on_window_shown : Callable | None
+            Called once, after the window is drawn for the first time.
+        is_fsm_profiled : bool
+            If True, the time spent in each state and its callbacks is
+            logged on exit, and appended to `FSM_PROFILE_FILE_NAME` in the
+            caches.
+        """
+        self._on_window_shown = on_window_shown
+        self._fsm_instrumentation = (
+            FsmInstrumentation() if is_fsm_profiled is True else None
+        )
+        self._fsm_profile_file_path: str = os.path.join(
+            password_vault_directory,
+            self.CACHES_DIRECTORY,
+            self.FSM_PROFILE_FILE_NAME,
+        )
         self._metadata_file_path: str = os.path.join(
             password_vault_directory,
             self.CACHES_DIRECTORY,
@@ -54,6 +131,13 @@ class PasswordVaultGui:
         self._metadata: dict = {}
         self._intra_state_variables: dict = {}
         self._inter_state_variables: dict = {}
+        ## Progress and thread of the operation running in a worker
+        self._operation_progress: Optional[OperationProgress] = None
+        self._operation_thread: Optional[threading.Thread] = None
+        ## Event of the operation received from the worker, which the FSM
+        ## may not have handled yet
+        self._operation_result: Optional[FsmEvent] = None
+        self._password_vault = None
 
         os.makedirs(
             os.path.join(password_vault_directory, self.CACHES_DIRECTORY),
@@ -66,99 +150,226 @@ class PasswordVaultGui:
         self._init_tkinter()
 
     def loop(self):
-        is_exited = False
-        prev_fsm_state = FsmState.ENTRANCE
-        prev_fsm_state_start_time = time.time()
-
-        def on_closing_window():
-            nonlocal is_exited
-            is_exited = True
-
-        def check_and_handle_idling():
-            nonlocal prev_fsm_state, prev_fsm_state_start_time
-            current_state = self._fsm.current_state
-            if current_state == prev_fsm_state:
-                if (
-                    time.time() - prev_fsm_state_start_time
-                    > self.MAX_IDLING_TIME
-                ):
-                    on_closing_window()
-            else:
-                prev_fsm_state = current_state
-                prev_fsm_state_start_time = time.time()
-
-        self._root.protocol("WM_DELETE_WINDOW", on_closing_window)
+        """
+        Run the Tk main loop until the FSM exits or the window is closed.
+
+        The FSM is stepped only when something may have changed: after an
+        input event, after a state transition, or when a scheduled timer
+        fires. The app exits after `MAX_IDLING_TIME` seconds without input
+        or state transitions.
+        """
+        self._is_exited = False
+        self._is_fsm_stepping = False
+        self._is_fsm_step_pending = False
+        self._fsm_step_timer = None
+        self._idling_timer = None
+        self._operation_progress_timer = None
+        self._changes_check_timer = None
+        self._root.protocol("WM_DELETE_WINDOW", self._exit)
+        self._root.report_callback_exception = self._on_callback_exception
+        self._reset_idling_timer()
+        self._schedule_fsm_step()
+        if self._on_window_shown is not None:
+            self._root.after_idle(self._on_window_shown)
+            self._on_window_shown = None
         try:
-            while is_exited is False:
-                is_exited = self._fsm.update()
-                self._root.update_idletasks()
-                self._root.update()
-                check_and_handle_idling()
-        except Exception as e:
-            logger.info("{}: {}".format(type(e).__name__, e))
-            traceback.print_exc()
+            self._root.mainloop()
         finally:
+            if self._fsm_instrumentation is not None:
+                logger.info(
+                    "FSM profile:\n" + self._fsm_instrumentation.report()
+                )
+                self._fsm_instrumentation.save(
+                    file_path=self._fsm_profile_file_path
+                )
+            if self._operation_thread is not None:
+                ## Case: exited during an operation, which is cancelled by
+                ## `_exit` and stops at its next safe point
+                self._operation_thread.join()
+                self._receive_unlocked_password_vault()
+            if self._password_vault is not None:
+                self._password_vault.close()
+            if self._password_vault is not None and logger.isEnabledFor(
+                logging.DEBUG
+            ):
+                logger.debug(
+                    "I/O stats:\n" + self._password_vault.stats_report()
+                )
             logger.info("Bye")
-            self._root.quit()
+
+    def _schedule_fsm_step(self, delay_ms: int | None = None):
+        """
+        Step the FSM when Tk is idle, or after `delay_ms` milliseconds.
+        Several requests before the step are merged into one step.
+        """
+        if self._is_exited is True:
+            return
+        if self._is_fsm_stepping is True:
+            ## Case: requested by an event handled in a dialog, which runs a
+            ## nested event loop inside a step
+            self._is_fsm_step_pending = True
+            return
+        if self._fsm_step_timer is not None:
+            if delay_ms is not None:
+                return
+            self._root.after_cancel(self._fsm_step_timer)
+        if delay_ms is None:
+            self._fsm_step_timer = self._root.after_idle(self._step_fsm)
+        else:
+            self._fsm_step_timer = self._root.after(delay_ms, self._step_fsm)
+
+    def _step_fsm(self):
+        self._fsm_step_timer = None
+        if self._is_exited is True:
+            return
+        previous_state = self._fsm.current_state
+        self._is_fsm_stepping = True
+        try:
+            is_exited = self._fsm.dispatch()
+        finally:
+            self._is_fsm_stepping = False
+        if is_exited is True:
+            self._exit()
+            return
+        if self._fsm.current_state != previous_state:
+            self._reset_idling_timer()
+        if (
+            self._fsm.has_pending_events is True
+            or self._is_fsm_step_pending is True
+        ):
+            ## Case: events were posted by the last callback
+            self._is_fsm_step_pending = False
+            self._schedule_fsm_step()
+
+    def _post_event(self, event: FsmEvent):
+        self._fsm.post_event(event)
+        self._on_input_event()
+
+    def _on_input_event(self):
+        self._reset_idling_timer()
+        self._schedule_fsm_step()
+
+    def _reset_idling_timer(self):
+        if self._idling_timer is not None:
+            self._root.after_cancel(self._idling_timer)
+        self._idling_timer = self._root.after(
+            self.MAX_IDLING_TIME * 1000, self._on_idling_timeout
+        )
+
+    def _on_idling_timeout(self):
+        self._idling_timer = None
+        logger.info("Exit after idling for {} s".format(self.MAX_IDLING_TIME))
+        self._exit()
+
+    def _exit(self):
+        if self._is_exited is True:
+            return
+        self._is_exited = True
+        for timer in (
+            self._fsm_step_timer,
+            self._idling_timer,
+            self._operation_progress_timer,
+            self._changes_check_timer,
+        ):
+            if timer is not None:
+                self._root.after_cancel(timer)
+        self._fsm_step_timer = None
+        self._idling_timer = None
+        self._operation_progress_timer = None
+        self._changes_check_timer = None
+        if self._operation_progress is not None:
+            self._operation_progress.cancel()
+        self._root.quit()
+
+    def _on_callback_exception(self, exc_type, exc_value, exc_traceback):
+        logger.info("{}: {}".format(exc_type.__name__, exc_value))
+        traceback.print_exception(exc_type, exc_value, exc_traceback)
+        self._exit()
 
     def _init_fsm(self):
         self._fsm = EnumFsm(
             start_state=FsmState.ENTRANCE,
             exit_state=FsmState.EXIT,
             on_state_changed=self._on_fsm_state_changed,
+            is_event_driven=True,
+            instrumentation=self._fsm_instrumentation,
         )
         self._fsm.add_state(
             state=FsmState.ENTRANCE,
             stay_callback=self._entrance_state_stay_callback,
+            transitions=[FsmState.LOAD_METADATA],
         )
         self._fsm.add_state(
             state=FsmState.LOAD_METADATA,
             stay_callback=self._load_metadata_state_stay_callback,
+            transitions=[FsmState.MANAGE_DATA_REPLICA_DIRECTORIES],
         )
         self._fsm.add_state(
             state=FsmState.MANAGE_DATA_REPLICA_DIRECTORIES,
             enter_callback=self._manage_data_replica_directories_state_enter_callback,
             stay_callback=self._manage_data_replica_directories_state_stay_callback,
             exit_callback=self._manage_data_replica_directories_state_exit_callback,
+            transitions=[
+                FsmState.ASK_MAIN_PASSWORD,
+                FsmState.ADD_DATA_REPLICA_DIRECTORY,
+                FsmState.DELETE_DATA_REPLICA_DIRECTORY,
+            ],
         )
         self._fsm.add_state(
             state=FsmState.ADD_DATA_REPLICA_DIRECTORY,
             stay_callback=self._add_data_replica_directory_state_stay_callback,
+            transitions=[FsmState.MANAGE_DATA_REPLICA_DIRECTORIES],
         )
         self._fsm.add_state(
             state=FsmState.DELETE_DATA_REPLICA_DIRECTORY,
             enter_callback=self._delete_data_replica_directory_state_enter_callback,
             stay_callback=self._delete_data_replica_directory_state_stay_callback,
+            transitions=[FsmState.MANAGE_DATA_REPLICA_DIRECTORIES],
         )
         self._fsm.add_state(
             state=FsmState.ASK_MAIN_PASSWORD,
             enter_callback=self._ask_main_password_state_enter_callback,
             stay_callback=self._ask_main_password_state_stay_callback,
+            transitions=[FsmState.UNLOCK_VAULT, FsmState.EXIT],
+        )
+        self._fsm.add_state(
+            state=FsmState.UNLOCK_VAULT,
+            enter_callback=self._unlock_vault_state_enter_callback,
+            stay_callback=self._unlock_vault_state_stay_callback,
+            exit_callback=self._unlock_vault_state_exit_callback,
+            transitions=[FsmState.MAIN_MENU, FsmState.ASK_MAIN_PASSWORD],
         )
         self._fsm.add_state(
             state=FsmState.MAIN_MENU,
             enter_callback=self._main_menu_state_enter_callback,
             stay_callback=self._main_menu_state_stay_callback,
             exit_callback=self._main_menu_state_exit_callback,
+            transitions=[FsmState.SEARCH_ACCOUNT, FsmState.CHANGE_PASSWORD],
         )
         self._fsm.add_state(
             state=FsmState.SEARCH_ACCOUNT,
             enter_callback=self._search_accounts_state_enter_callback,
             stay_callback=self._search_accounts_state_stay_callback,
             exit_callback=self._search_accounts_state_exit_callback,
+            transitions=[FsmState.MAIN_MENU, FsmState.MANAGE_ACCOUNT],
         )
         self._fsm.add_state(
             state=FsmState.CHANGE_PASSWORD,
             stay_callback=self._change_password_state_stay_callback,
+            exit_callback=self._change_password_state_exit_callback,
+            transitions=[FsmState.MAIN_MENU],
         )
         self._fsm.add_state(
             state=FsmState.MANAGE_ACCOUNT,
             enter_callback=self._manage_account_state_enter_callback,
             stay_callback=self._manage_account_state_stay_callback,
             exit_callback=self._manage_account_state_exit_callback,
+            transitions=[FsmState.SEARCH_ACCOUNT, FsmState.EXIT],
         )
         self._fsm.add_state(
-            state=FsmState.EXIT, stay_callback=self._exit_state_stay_callback
+            state=FsmState.EXIT,
+            stay_callback=self._exit_state_stay_callback,
+            transitions=[],
         )
 
         self._fsm.start()
@@ -188,17 +399,21 @@ class PasswordVaultGui:
         self._console = tkinter.scrolledtext.ScrolledText(
             info_frame, wrap="word", font=self._normal_font, spacing3=4
         )
+        self._console_buffer = ConsoleBuffer(
+            text_widget=self._console, max_lines=self.CONSOLE_MAX_LINES
+        )
         self._account_names_list_box = tk.Listbox(
             info_frame, bd=0, highlightthickness=0, selectmode="browse"
         )
         self._account_names_scroll_bar = tk.Scrollbar(info_frame)
-        self._account_names_list_box.config(
-            yscrollcommand=self._account_names_scroll_bar.set,
-            font=self._account_names_view_font,
-        )
+        self._account_names_list_box.config(font=self._account_names_view_font)
         self._account_names_scroll_bar.config(
             command=self._account_names_list_box.yview
         )
+        self._account_names_view = IncrementalListBox(
+            list_box=self._account_names_list_box,
+            scroll_bar=self._account_names_scroll_bar,
+        )
 
         ## \[[Dis](https://stackoverflow.com/a/40539365)\] Vertical scrollbar for frame in Tkinter, Python
         ## \[[Dis](https://stackoverflow.com/a/3092341)\] Adding a scrollbar to a group of widgets in Tkinter
@@ -292,43 +507,39 @@ class PasswordVaultGui:
 
     def _command_button_pressed_callback(self, button_idx: int):
         command_button_pressed = self._command_buttons[button_idx]["text"]
-        self._intra_state_variables[
-            "command_button_pressed"
-        ] = command_button_pressed.lower()
         logger.debug("Button: {}".format(command_button_pressed))
+        self._post_event(
+            CommandButtonPressed(command=command_button_pressed.lower())
+        )
 
     def _on_user_input_changed(self, name, index, mode):
-        self._intra_state_variables[
-            "user_input"
-        ] = self._user_input_field.get()
+        self._post_event(UserInputChanged(text=self._user_input_field.get()))
 
     def _on_confirm_input(self, *args):
         confirmed_input = self._user_input_field.get()
-        self._intra_state_variables["confirmed_input"] = confirmed_input
+        logger.debug("User Input: {}".format(confirmed_input))
+        self._post_event(InputConfirmed(text=confirmed_input))
         self._user_input_field.set("")
         self._input_entry.focus()
-        logger.debug("User Input: {}".format(confirmed_input))
 
     def _on_delete_button_pressed(self, *args):
-        self._intra_state_variables["delete_button_pressed"] = True
         logger.debug("Keyboard: \"delete\" button pressed")
+        self._post_event(KeyPressed(key="delete"))
 
     def _on_escape_button_pressed(self, *args):
-        self._intra_state_variables["escape_button_pressed"] = True
         logger.debug("Keyboard: \"escape\" button pressed")
+        self._post_event(KeyPressed(key="escape"))
 
     def _on_tab_button_pressed(self, *args):
-        self._intra_state_variables["tab_button_pressed"] = True
         logger.debug("Keyboard: \"tab\" button pressed")
+        self._post_event(KeyPressed(key="tab"))
 
     def _on_account_names_list_box_selected(self, event):
         selections = self._account_names_list_box.curselection()
         if len(selections):
             account_name = self._account_names_list_box.get(selections[0])
-            self._intra_state_variables["account_name_selected"] = account_name
             logger.debug("Account name selected: {}".format(account_name))
-        else:
-            self._intra_state_variables.pop("account_name_selected", None)
+            self._post_event(AccountNameSelected(account_name=account_name))
 
     def _activate_console_view(self):
         self._deactivate_account_names_list_box_view()
@@ -347,7 +558,7 @@ class PasswordVaultGui:
         self._account_names_scroll_bar.pack(side="right", fill="both")
 
     def _deactivate_account_names_list_box_view(self):
-        self._account_names_list_box.delete(0, "end")
+        self._account_names_view.clear()
         self._account_names_list_box.pack_forget()
         self._account_names_scroll_bar.pack_forget()
 
@@ -390,11 +601,15 @@ class PasswordVaultGui:
         self._account_canvas.pack_forget()
         self._account_scroll_bar.pack_forget()
 
-    def _entrance_state_stay_callback(self) -> FsmState:
+    def _entrance_state_stay_callback(self, event: FsmEvent) -> FsmState:
+        if not isinstance(event, StateEntered):
+            return FsmState.ENTRANCE
         self._console_print(text="Welcome to the password vault.")
         return FsmState.LOAD_METADATA
 
-    def _load_metadata_state_stay_callback(self) -> FsmState:
+    def _load_metadata_state_stay_callback(self, event: FsmEvent) -> FsmState:
+        if not isinstance(event, StateEntered):
+            return FsmState.LOAD_METADATA
         if os.path.isfile(self._metadata_file_path):
             self._metadata = json.load(open(self._metadata_file_path, "r"))
         else:
@@ -427,9 +642,12 @@ class PasswordVaultGui:
             states=["normal", "normal", "normal"],
         )
 
-    def _manage_data_replica_directories_state_stay_callback(self) -> FsmState:
-        command = self._intra_state_variables.pop("confirmed_input", None)
-        if command is not None:
+    def _manage_data_replica_directories_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        command = None
+        if isinstance(event, InputConfirmed):
+            command = event.text
             if command == "":
                 command = "next"
             elif command == "1":
@@ -439,10 +657,8 @@ class PasswordVaultGui:
             else:
                 self._console_print("Invalid input: \"{}\"".format(command))
                 return FsmState.MANAGE_DATA_REPLICA_DIRECTORIES
-        else:
-            command = self._intra_state_variables.pop(
-                "command_button_pressed", None
-            )
+        elif isinstance(event, CommandButtonPressed):
+            command = event.command
         if command == "next":
             if len(self._metadata[self.DATA_REPLICA_DIRECTORIES_FIELD]) == 0:
                 self._console_print(
@@ -462,7 +678,11 @@ class PasswordVaultGui:
             texts=["", "", ""], states=["disabled", "disabled", "disabled"]
         )
 
-    def _add_data_replica_directory_state_stay_callback(self) -> FsmState:
+    def _add_data_replica_directory_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        if not isinstance(event, StateEntered):
+            return FsmState.ADD_DATA_REPLICA_DIRECTORY
         data_replica_directory = tkinter.filedialog.askdirectory(
             parent=self._root,
             initialdir=os.path.expanduser("~"),
@@ -477,13 +697,16 @@ class PasswordVaultGui:
     def _delete_data_replica_directory_state_enter_callback(self):
         self._console_print("Enter the index of the directory to delete it.")
 
-    def _delete_data_replica_directory_state_stay_callback(self) -> FsmState:
-        command = self._intra_state_variables.pop("confirmed_input", None)
-        if command is None:
+    def _delete_data_replica_directory_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        if not isinstance(event, InputConfirmed):
             return FsmState.DELETE_DATA_REPLICA_DIRECTORY
-        is_command_valid = command.isdecimal()
-        is_command_valid &= int(command) > 0 and int(command) <= len(
-            self._metadata[self.DATA_REPLICA_DIRECTORIES_FIELD]
+        command = event.text
+        is_command_valid = command.isdecimal() and (
+            int(command) > 0
+            and int(command)
+            <= len(self._metadata[self.DATA_REPLICA_DIRECTORIES_FIELD])
         )
         if not is_command_valid:
             self._console_print("Invalid input: \"{}\"".format(command))
@@ -503,26 +726,211 @@ class PasswordVaultGui:
             "write this password down, or disclose it to anyone."
         )
 
-    def _ask_main_password_state_stay_callback(self) -> FsmState:
+    def _ask_main_password_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        if not isinstance(event, StateEntered):
+            return FsmState.ASK_MAIN_PASSWORD
         pw = tkinter.simpledialog.askstring(
             "Password", "Enter the main password:", show="*"
         )
         if pw is None or pw == "":
             self._console_print("Password cannot be empty.")
             return FsmState.EXIT
-        logger.info("Wait until the password vault is initialized.")
+        self._inter_state_variables["main_password"] = pw
+        return FsmState.UNLOCK_VAULT
+
+    def _unlock_vault_state_enter_callback(self):
+        self._console_print(
+            "Unlocking the password vault. Press \"Cancel\" or Escape to "
+            "stop."
+        )
+        self._configure_common_buttons(
+            texts=["", "Cancel", ""], states=["disabled", "normal", "disabled"]
+        )
+        main_password = self._inter_state_variables.pop("main_password")
+        directories = list(self._metadata[self.DATA_REPLICA_DIRECTORIES_FIELD])
+        asynchronous_directories = list(
+            self._metadata.get(
+                self.ASYNCHRONOUS_DATA_REPLICA_DIRECTORIES_FIELD, []
+            )
+        )
+        directories += [
+            d for d in asynchronous_directories if d not in directories
+        ]
+        progress = OperationProgress()
+
+        def unlock(results: queue.SimpleQueue):
+            password_vault, error = None, None
+            try:
+                ## Imported in the worker, as it loads the whole handler
+                ## stack and the crypto library
+                from password_vault.password_vault import PasswordVault
+
+                password_vault = PasswordVault(
+                    directories=directories,
+                    main_password=main_password,
+                    progress=progress,
+                    asynchronous_directories=asynchronous_directories,
+                )
+            except Exception as e:
+                error = e
+            results.put(
+                UnlockFinished(password_vault=password_vault, error=error)
+            )
+
+        self._start_operation(target=unlock, progress=progress)
+
+    def _start_operation(self, target: Callable, progress: OperationProgress):
+        """
+        Run a long operation in a worker thread, while Tk polls its progress.
+
+        Parameters
+        ----
+        target : Callable
+            Called in the worker with a queue, on which it puts the event
+            posted to the FSM when it is done.
+        progress : OperationProgress
+            Progress of the operation, cancelled on exit.
+        """
+        results = queue.SimpleQueue()
+        self._operation_progress = progress
+        self._operation_result = None
+        self._intra_state_variables["operation_results"] = results
+        self._intra_state_variables["operation_progress_counts"] = None
+        self._operation_thread = threading.Thread(
+            target=target, args=(results,), daemon=True
+        )
+        self._operation_thread.start()
+        self._operation_progress_timer = self._root.after(
+            self.OPERATION_PROGRESS_INTERVAL_MS, self._poll_operation_progress
+        )
+
+    def _stop_operation(self):
+        """Called on leaving the state of the operation."""
+        if self._operation_progress_timer is not None:
+            self._root.after_cancel(self._operation_progress_timer)
+            self._operation_progress_timer = None
+        self._operation_progress = None
+        self._operation_thread = None
+        self._operation_result = None
+
+    def _receive_unlocked_password_vault(self):
+        """
+        Take the vault of an unlocking which finished while the window was
+        closed, before the FSM handled it, so that it is closed on exit and
+        its outbound queues are drained.
+        """
+        event = self._operation_result
+        if event is None:
+            try:
+                event = self._intra_state_variables[
+                    "operation_results"
+                ].get_nowait()
+            except (KeyError, queue.Empty):
+                return
+        if (
+            isinstance(event, UnlockFinished)
+            and event.password_vault is not None
+        ):
+            self._password_vault = event.password_vault
+
+    def _poll_operation_progress(self):
+        """
+        Show the progress of the worker in the console, and post its result
+        to the FSM. Tk is only touched from its own thread.
+        """
+        self._operation_progress_timer = None
+        snapshot = self._operation_progress.snapshot()
+        ## The elapsed time always changes, so only the counts are compared
+        snapshot_counts = (
+            snapshot.stage,
+            snapshot.n_items_done,
+            snapshot.counts,
+        )
+        if (
+            snapshot_counts
+            != self._intra_state_variables["operation_progress_counts"]
+        ):
+            self._intra_state_variables["operation_progress_counts"] = (
+                snapshot_counts
+            )
+            if snapshot.stage != "":
+                self._console_print(text=snapshot.describe())
         try:
-            self._password_vault = PasswordVault(
-                directories=self._metadata[
-                    self.DATA_REPLICA_DIRECTORIES_FIELD
-                ],
-                main_password=pw,
+            event = self._intra_state_variables[
+                "operation_results"
+            ].get_nowait()
+        except queue.Empty:
+            ## Case: still running, which is not idling
+            self._reset_idling_timer()
+            self._operation_progress_timer = self._root.after(
+                self.OPERATION_PROGRESS_INTERVAL_MS,
+                self._poll_operation_progress,
             )
-        except ValueError as e:
-            self._console_print(text=str(e))
+            return
+        self._operation_result = event
+        self._post_event(event)
+
+    def _unlock_vault_state_stay_callback(self, event: FsmEvent) -> FsmState:
+        if (isinstance(event, KeyPressed) and event.key == "escape") or (
+            isinstance(event, CommandButtonPressed)
+            and event.command == "cancel"
+        ):
+            if self._operation_progress.is_cancelled is False:
+                self._operation_progress.cancel()
+                self._console_print("Cancelling...")
+            return FsmState.UNLOCK_VAULT
+        if not isinstance(event, UnlockFinished):
+            return FsmState.UNLOCK_VAULT
+        if isinstance(event.error, OperationCancelledError):
+            self._console_print("Unlocking is cancelled.")
             return FsmState.ASK_MAIN_PASSWORD
+        if isinstance(event.error, ValueError):
+            ## Case: wrong password, or corrupted replica
+            self._console_print(text=str(event.error))
+            return FsmState.ASK_MAIN_PASSWORD
+        if event.error is not None:
+            raise event.error
+        self._password_vault = event.password_vault
+        self._password_vault.watch_changes()
+        self._console_print("The password vault is unlocked.")
         return FsmState.MAIN_MENU
 
+    def _start_changes_check(self):
+        """
+        Check for changes of other processes while the search results are
+        shown, which are the only view they affect. Other states leave no
+        timer running.
+        """
+        self._changes_check_timer = self._root.after(
+            self.CHANGES_CHECK_INTERVAL_MS, self._check_changes
+        )
+
+    def _stop_changes_check(self):
+        if self._changes_check_timer is not None:
+            self._root.after_cancel(self._changes_check_timer)
+            self._changes_check_timer = None
+
+    def _check_changes(self):
+        """
+        Search the accounts again when other processes or sync tools added
+        or deleted accounts. It is not input, so the idling timer goes on.
+        """
+        self._changes_check_timer = None
+        if self._password_vault.check_changes() is True:
+            self._fsm.post_event(
+                UserInputChanged(text=self._user_input_field.get())
+            )
+            self._schedule_fsm_step()
+        self._start_changes_check()
+
+    def _unlock_vault_state_exit_callback(self):
+        self._stop_operation()
+        self._configure_common_buttons(
+            texts=["", "", ""], states=["disabled", "disabled", "disabled"]
+        )
+
     def _main_menu_state_enter_callback(self):
         self._activate_console_view()
         self._title_label.config(text="Main Menu")
@@ -537,9 +945,10 @@ class PasswordVaultGui:
             states=["normal", "normal", "disabled"],
         )
 
-    def _main_menu_state_stay_callback(self) -> FsmState:
-        command = self._intra_state_variables.pop("confirmed_input", None)
-        if command is not None:
+    def _main_menu_state_stay_callback(self, event: FsmEvent) -> FsmState:
+        command = None
+        if isinstance(event, InputConfirmed):
+            command = event.text
             if command == "" or command == "1":
                 command = "search"
             elif command == "2":
@@ -547,10 +956,8 @@ class PasswordVaultGui:
             else:
                 self._console_print("Invalid input: \"{}\".".format(command))
                 return FsmState.MAIN_MENU
-        else:
-            command = self._intra_state_variables.pop(
-                "command_button_pressed", None
-            )
+        elif isinstance(event, CommandButtonPressed):
+            command = event.command
         if command == "search":
             return FsmState.SEARCH_ACCOUNT
         elif command == "change password":
@@ -570,67 +977,95 @@ class PasswordVaultGui:
         )
         self._intra_state_variables["account_candidates"] = []
         self._activate_account_names_list_box_view()
-
-    def _search_accounts_state_stay_callback(self) -> FsmState:
-        command = None
-        if (
-            self._intra_state_variables.pop("escape_button_pressed", False)
-            is True
+        self._start_changes_check()
+
+    def _search_accounts_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        if (isinstance(event, KeyPressed) and event.key == "escape") or (
+            isinstance(event, CommandButtonPressed)
+            and event.command == "cancel"
         ):
-            command = "cancel"
-        else:
-            command = self._intra_state_variables.pop(
-                "command_button_pressed", None
-            )
-        if command == "cancel":
             return FsmState.MAIN_MENU
 
-        account_selected = self._intra_state_variables.pop(
-            "confirmed_input", ""
-        )
-        if account_selected == "":
-            account_selected = self._intra_state_variables.get(
-                "account_name_selected", ""
-            )
+        account_selected = ""
+        if isinstance(event, InputConfirmed):
+            account_selected = event.text
+        elif isinstance(event, AccountNameSelected):
+            account_selected = event.account_name
         if account_selected != "":
             self._inter_state_variables["account_name"] = account_selected
             return FsmState.MANAGE_ACCOUNT
 
-        tab_button_pressed = self._intra_state_variables.pop(
-            "tab_button_pressed", None
-        )
-        if tab_button_pressed is not None:
+        if isinstance(event, KeyPressed) and event.key == "tab":
             candidates = self._intra_state_variables["account_candidates"]
             if len(candidates) > 0:
                 self._user_input_field.set(candidates[0])
                 self._input_entry.focus()
-
-        user_input = self._intra_state_variables.pop("user_input", None)
-        if user_input is not None:
+        elif isinstance(event, UserInputChanged):
             account_candidates = self._password_vault.search_account_name(
-                account_name=user_input,
+                account_name=event.text,
                 n_candidates=self.ACCOUNT_NAMES_VIEW_N_CANDIDATES,
             )
             self._intra_state_variables[
                 "account_candidates"
             ] = account_candidates
-            self._account_names_list_box.delete(0, "end")
-            for account_name in account_candidates:
-                self._account_names_list_box.insert("end", account_name)
+            self._account_names_view.set_items(items=account_candidates)
         return FsmState.SEARCH_ACCOUNT
 
     def _search_accounts_state_exit_callback(self):
+        self._stop_changes_check()
         self._title_label.config(text="")
 
-    def _change_password_state_stay_callback(self) -> FsmState:
+    def _change_password_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        if isinstance(event, StateEntered):
+            return self._start_password_change()
+        if (isinstance(event, KeyPressed) and event.key == "escape") or (
+            isinstance(event, CommandButtonPressed)
+            and event.command == "cancel"
+        ):
+            if self._operation_progress.is_cancelled is False:
+                self._operation_progress.cancel()
+                self._console_print("Cancelling...")
+            return FsmState.CHANGE_PASSWORD
+        if not isinstance(event, PasswordChangeFinished):
+            return FsmState.CHANGE_PASSWORD
+        if event.is_archived is True:
+            self._console_print(
+                "Archive of the existing password vault created."
+            )
+        if isinstance(event.error, OperationCancelledError):
+            self._console_print(
+                "Changing the password is cancelled. The password is "
+                "unchanged."
+            )
+            return FsmState.MAIN_MENU
+        if isinstance(event.error, ValueError):
+            ## Case: an asynchronous replica is not reachable
+            self._console_print(text=str(event.error))
+            return FsmState.MAIN_MENU
+        if event.error is not None:
+            raise event.error
+        self._console_print("Password changed successfully.")
+        return FsmState.MAIN_MENU
+
+    def _start_password_change(self) -> FsmState:
+        """
+        Ask for the directory of the archive and the new password, then
+        archive the vault and change the password in a worker.
+        """
         self._console_print(
-            "Select the directory for storing the the archive of the existing password vault."
+            "Select the directory for storing the archive of the existing "
+            "password vault."
         )
         archive_directory = tkinter.filedialog.askdirectory(
             parent=self._root,
             initialdir=".",
             title="Directory of the archive",
         )
+        archive_file_path, base_archive_file_path = None, None
         if archive_directory == "":
             self._console_print(
                 "Archive of the existing password vault will NOT be created."
@@ -643,11 +1078,11 @@ class PasswordVaultGui:
             archive_file_path = os.path.join(
                 archive_directory, archive_file_name
             )
-            self._password_vault.create_archive(
-                archive_file_path=archive_file_path
-            )
-            self._console_print(
-                "Archive of the existing password vault created."
+            ## Incremental if the latest archive in the directory was taken
+            ## under the current key, such as by the "archive" command of the
+            ## CLI since the last change of password. Complete otherwise.
+            base_archive_file_path = self._get_latest_archive_file_path(
+                archive_directory=archive_directory
             )
         pw = tkinter.simpledialog.askstring(
             "New Password", "Enter the new password:", show="*"
@@ -655,11 +1090,65 @@ class PasswordVaultGui:
         if pw is None or pw == "":
             self._console_print("Password cannot be empty.")
             return FsmState.MAIN_MENU
-        self._password_vault.change_password(new_main_password=pw)
-        self._console_print("Password changed successfully.")
-        return FsmState.MAIN_MENU
+        self._console_print(
+            "Changing the password. Press \"Cancel\" or Escape to stop."
+        )
+        self._configure_common_buttons(
+            texts=["", "Cancel", ""], states=["disabled", "normal", "disabled"]
+        )
+        password_vault = self._password_vault
+        progress = OperationProgress()
+
+        def change_password(results: queue.SimpleQueue):
+            is_archived, error = False, None
+            try:
+                if archive_file_path is not None:
+                    password_vault.create_archive(
+                        archive_file_path=archive_file_path,
+                        base_archive_file_path=base_archive_file_path,
+                        progress=progress,
+                    )
+                    is_archived = True
+                password_vault.change_password(
+                    new_main_password=pw, progress=progress
+                )
+            except Exception as e:
+                error = e
+            results.put(
+                PasswordChangeFinished(is_archived=is_archived, error=error)
+            )
+
+        self._start_operation(target=change_password, progress=progress)
+        return FsmState.CHANGE_PASSWORD
+
+    def _change_password_state_exit_callback(self):
+        self._stop_operation()
+        self._configure_common_buttons(
+            texts=["", "", ""], states=["disabled", "disabled", "disabled"]
+        )
+
+    @staticmethod
+    def _get_latest_archive_file_path(archive_directory: str) -> Optional[str]:
+        """
+        Return
+        ----
+        str | None: path of the latest archive created by
+            `_change_password_state_stay_callback` in the directory, whose
+            name sorts by its time of creation, or None if there is none
+        """
+        archive_files_name = [
+            file_name
+            for file_name in os.listdir(archive_directory)
+            if file_name.startswith("password_vault_")
+            and file_name.endswith(".zip")
+        ]
+        if len(archive_files_name) == 0:
+            return None
+        return os.path.join(archive_directory, max(archive_files_name))
 
     def _manage_account_state_enter_callback(self):
+        from password_vault.password_vault import PasswordVault
+
         def on_delete_row(
             frame: tk.Frame, account_fields: OrderedDict, idx: int
         ):
@@ -804,24 +1293,20 @@ class PasswordVaultGui:
             ipady=4,
         )
 
-    def _manage_account_state_stay_callback(self) -> FsmState:
+    def _manage_account_state_stay_callback(
+        self, event: FsmEvent
+    ) -> FsmState:
+        from password_vault.password_vault import PasswordVault
+
         command = None
-        if (
-            self._intra_state_variables.pop("escape_button_pressed", False)
-            is True
-        ):
+        if isinstance(event, KeyPressed) and event.key == "escape":
             command = "cancel"
-        elif (
-            self._intra_state_variables.pop("delete_button_pressed", False)
-            is True
-        ):
+        elif isinstance(event, KeyPressed) and event.key == "delete":
             command = "delete"
-        elif self._intra_state_variables.pop("confirmed_input", None) == "":
+        elif isinstance(event, InputConfirmed) and event.text == "":
             command = "confirm"
-        else:
-            command = self._intra_state_variables.pop(
-                "command_button_pressed", None
-            )
+        elif isinstance(event, CommandButtonPressed):
+            command = event.command
         if command is None:
             return FsmState.MANAGE_ACCOUNT
 
@@ -859,10 +1344,15 @@ class PasswordVaultGui:
             new_account_name = updated_account_details[
                 PasswordVault.ACCOUNT_NAME_TAG
             ]
-            if new_account_name == "":
+            if not PasswordVault.is_valid_account_name(
+                account_name=new_account_name
+            ):
                 tkinter.messagebox.showerror(
                     title="Invalid Value",
-                    message=f"\"{PasswordVault.ACCOUNT_NAME_TAG}\" cannot be empty",
+                    message=(
+                        f"\"{PasswordVault.ACCOUNT_NAME_TAG}\" cannot be "
+                        "empty, contain path separators, or be reserved"
+                    ),
                 )
                 return FsmState.MANAGE_ACCOUNT
             if new_account_name == account_name:
@@ -928,7 +1418,7 @@ class PasswordVaultGui:
         self._title_label.config(text="")
         self._inter_state_variables.pop("account_name", None)
 
-    def _exit_state_stay_callback(self) -> FsmState:
+    def _exit_state_stay_callback(self, event: FsmEvent) -> FsmState:
         return FsmState.EXIT
 
     def _console_print(
@@ -945,24 +1435,10 @@ class PasswordVaultGui:
             suffix = "\n"
         print_content = f"{prefix}{text}{suffix}"
         logger.debug(print_content)
-        self._console.configure(state="normal")
-        self._console.insert(tk.END, print_content)
-        self._console.configure(state="disabled")
-        self._console.see(tk.END)
-        self._console_remove_obsolete_lines()
-
-    def _console_remove_obsolete_lines(self):
-        n_lines = int(self._console.index("end").split(".")[0]) - 1
-        if n_lines > self.CONSOLE_MAX_LINES:
-            del_n = n_lines - self.CONSOLE_MAX_LINES
-            self._console.configure(state="normal")
-            self._console.delete("1.0", f"{del_n + 1}.0")
-            self._console.configure(state="disabled")
+        self._console_buffer.write(text=print_content)
 
     def _console_clear(self):
-        self._console.configure(state="normal")
-        self._console.delete("1.0", tk.END)
-        self._console.configure(state="disabled")
+        self._console_buffer.clear()
 
     def _configure_common_buttons(self, texts: list, states: list):
         assert len(self._command_buttons) == len(texts) and len(texts) == len(
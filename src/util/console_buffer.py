@@ -0,0 +1,67 @@
+from collections import deque
+import tkinter as tk
+
+
+class ConsoleBuffer:
+    """
+    Keep the last `max_lines` lines of a read-only `tk.Text` console in a
+    ring buffer, and write them to the widget once per frame.
+
+    Texts written between two frames are inserted in one batch, with one
+    state toggle of the widget. The number of lines in the widget is
+    tracked here, so the widget is never asked for it.
+    """
+
+    def __init__(self, text_widget: tk.Text, max_lines: int):
+        self._text_widget = text_widget
+        self._max_lines = max_lines
+        ## Complete lines, then the line being written, which may be empty
+        self._lines = deque([""], maxlen=max_lines + 1)
+        self._pending_texts = []
+        self._n_pending_lines = 0
+        self._n_widget_lines = 0
+        self._flush_timer = None
+
+    def write(self, text: str):
+        lines = text.split("\n")
+        self._lines[-1] += lines[0]
+        self._lines.extend(lines[1:])
+        self._pending_texts.append(text)
+        self._n_pending_lines += len(lines) - 1
+        if self._flush_timer is None:
+            self._flush_timer = self._text_widget.after_idle(self.flush)
+
+    def clear(self):
+        self._lines.clear()
+        self._lines.append("")
+        self._pending_texts.clear()
+        self._n_pending_lines = 0
+        self._text_widget.configure(state="normal")
+        self._text_widget.delete("1.0", tk.END)
+        self._text_widget.configure(state="disabled")
+        self._n_widget_lines = 0
+
+    def flush(self):
+        if self._flush_timer is not None:
+            self._text_widget.after_cancel(self._flush_timer)
+            self._flush_timer = None
+        if len(self._pending_texts) == 0:
+            return
+        self._text_widget.configure(state="normal")
+        if self._n_pending_lines >= self._max_lines:
+            ## Case: the widget would be trimmed entirely, so rewrite it from
+            ## the buffer, without inserting the lines trimmed from it
+            self._text_widget.delete("1.0", tk.END)
+            self._text_widget.insert(tk.END, "\n".join(self._lines))
+            self._n_widget_lines = len(self._lines) - 1
+        else:
+            self._text_widget.insert(tk.END, "".join(self._pending_texts))
+            self._n_widget_lines += self._n_pending_lines
+            n_obsolete_lines = self._n_widget_lines - self._max_lines
+            if n_obsolete_lines > 0:
+                self._text_widget.delete("1.0", f"{n_obsolete_lines + 1}.0")
+                self._n_widget_lines = self._max_lines
+        self._text_widget.configure(state="disabled")
+        self._text_widget.see(tk.END)
+        self._pending_texts.clear()
+        self._n_pending_lines = 0
@@ -0,0 +1,102 @@
+import difflib
+import tkinter as tk
+import tkinter.font
+
+
+class IncrementalListBox:
+    """
+    Show a list of strings in a `tk.Listbox`, updating the widget with the
+    fewest row insertions and deletions instead of refilling it.
+
+    Only the rows which fit in the widget, plus `N_OVERSCAN_ROWS`, are
+    inserted. More rows are inserted when the view is scrolled to the end.
+    The selected row stays selected if it is still in the list.
+    """
+
+    N_OVERSCAN_ROWS = 8
+
+    def __init__(self, list_box: tk.Listbox, scroll_bar: tk.Scrollbar):
+        self._list_box = list_box
+        self._scroll_bar = scroll_bar
+        self._items = []
+        ## Rows in the widget, always a prefix of `_items` after rendering
+        self._displayed_items = []
+        self._n_rows_to_display = 0
+        self._render_timer = None
+        self._list_box.config(yscrollcommand=self._on_scrolled)
+        self._list_box.bind("<Configure>", self._on_resized, add="+")
+
+    @property
+    def items(self) -> list:
+        return self._items
+
+    def set_items(self, items: list):
+        self._items = list(items)
+        self._n_rows_to_display = self._get_n_visible_rows()
+        self._render()
+
+    def clear(self):
+        self.set_items(items=[])
+
+    def _render(self):
+        n_rows = min(len(self._items), self._n_rows_to_display)
+        target_items = self._items[:n_rows]
+        if target_items == self._displayed_items:
+            return
+        selected_item = self._get_selected_item()
+
+        matcher = difflib.SequenceMatcher(
+            a=self._displayed_items, b=target_items, autojunk=False
+        )
+        ## From the end, so that the indices of the earlier rows stay valid
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if i2 > i1:
+                self._list_box.delete(i1, i2 - 1)
+            if j2 > j1:
+                self._list_box.insert(i1, *target_items[j1:j2])
+        self._displayed_items = target_items
+
+        if selected_item is not None and selected_item in target_items:
+            self._list_box.selection_set(target_items.index(selected_item))
+
+    def _get_selected_item(self):
+        selections = self._list_box.curselection()
+        if len(selections) == 0:
+            return None
+        return self._displayed_items[selections[0]]
+
+    def _get_n_visible_rows(self) -> int:
+        font = tkinter.font.nametofont(self._list_box.cget("font"))
+        row_height = max(1, font.metrics("linespace"))
+        n_visible_rows = self._list_box.winfo_height() // row_height + 1
+        return n_visible_rows + self.N_OVERSCAN_ROWS
+
+    def _on_scrolled(self, first: str, last: str):
+        self._scroll_bar.set(first, last)
+        if float(last) >= 1.0 and len(self._displayed_items) < len(
+            self._items
+        ):
+            ## Case: scrolled to the last inserted row
+            self._n_rows_to_display += self._get_n_visible_rows()
+            self._schedule_render()
+
+    def _on_resized(self, event: tk.Event):
+        first_visible_row = max(0, self._list_box.nearest(0))
+        n_rows_to_display = first_visible_row + self._get_n_visible_rows()
+        if n_rows_to_display > self._n_rows_to_display:
+            self._n_rows_to_display = n_rows_to_display
+            self._schedule_render()
+
+    def _schedule_render(self):
+        ## Not rendered in the widget callbacks, which may be called while
+        ## the widget is being updated
+        if self._render_timer is None:
+            self._render_timer = self._list_box.after_idle(
+                self._on_render_timer
+            )
+
+    def _on_render_timer(self):
+        self._render_timer = None
+        self._render()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+import contextlib
+import contextvars
+import threading
+import time
+
+
+## Name of the outermost operation being run in the current context
+_current_operation = contextvars.ContextVar(
+    "io_stats_current_operation", default=None
+)
+
+
+class IoStats:
+    """
+    Count the file I/O, hashing and encryption done by a handler stack, per
+    replica directory and per operation.
+
+    An operation is the outermost public call being run, such as
+    "get_account", so that the work done by the layers below it, in every
+    replica, is attributed to it. Work outside of any operation is
+    attributed to `OTHER_OPERATION`.
+
+    Counters whose names end with `TIME_SUFFIX` are durations in seconds.
+    """
+
+    OTHER_OPERATION = "other"
+    TIME_SUFFIX = "_time"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        ## (operation, directory) -> counter name -> value
+        self._counters = {}
+        ## operation -> [number of calls, total time]
+        self._operations = {}
+
+    def add(self, directory: str, name: str, value: int | float = 1):
+        operation = _current_operation.get()
+        if operation is None:
+            operation = self.OTHER_OPERATION
+        with self._lock:
+            counters = self._counters.get((operation, directory), None)
+            if counters is None:
+                counters = {}
+                self._counters[(operation, directory)] = counters
+            counters[name] = counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timed(self, directory: str, name: str):
+        """Add the time spent in the block to counter `name` + "_time"."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(
+                directory=directory,
+                name=name + self.TIME_SUFFIX,
+                value=time.perf_counter() - start_time,
+            )
+
+    @contextlib.contextmanager
+    def operation(self, name: str):
+        """
+        Attribute the work done in the block to operation `name`, unless
+        the block is inside another operation.
+        """
+        if _current_operation.get() is not None:
+            yield
+            return
+        token = _current_operation.set(name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            _current_operation.reset(token)
+            with self._lock:
+                calls = self._operations.setdefault(name, [0, 0.0])
+                calls[0] += 1
+                calls[1] += elapsed_time
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._operations.clear()
+
+    def stats(self) -> dict:
+        """
+        Return
+        ----
+        dict: with keys
+            "operations": operation -> number of calls, total time, counters
+                summed over the replicas, and counters per replica.
+            "replicas": directory -> counters summed over the operations.
+        """
+        with self._lock:
+            counters_items = [
+                (key, dict(counters))
+                for key, counters in self._counters.items()
+            ]
+            operations = {
+                name: list(calls) for name, calls in self._operations.items()
+            }
+        operations_stats = {}
+        replicas_stats = {}
+        for (operation, directory), counters in counters_items:
+            operation_stats = operations_stats.setdefault(
+                operation,
+                {
+                    "n_calls": operations.get(operation, [0, 0.0])[0],
+                    "total_time": operations.get(operation, [0, 0.0])[1],
+                    "counters": {},
+                    "replicas": {},
+                },
+            )
+            operation_stats["replicas"][directory] = counters
+            self._add_counters(dst=operation_stats["counters"], src=counters)
+            self._add_counters(
+                dst=replicas_stats.setdefault(directory, {}), src=counters
+            )
+        for operation, (n_calls, total_time) in operations.items():
+            ## Case: operation without any I/O, such as a search
+            operations_stats.setdefault(
+                operation,
+                {
+                    "n_calls": n_calls,
+                    "total_time": total_time,
+                    "counters": {},
+                    "replicas": {},
+                },
+            )
+        return {"operations": operations_stats, "replicas": replicas_stats}
+
+    def report(self) -> str:
+        lines = []
+        stats = self.stats()
+        for operation, operation_stats in sorted(
+            stats["operations"].items(),
+            key=lambda x: x[1]["total_time"],
+            reverse=True,
+        ):
+            n_calls = operation_stats["n_calls"]
+            lines.append(
+                "{}: {} calls, {:.1f} ms".format(
+                    operation, n_calls, operation_stats["total_time"] * 1000
+                )
+            )
+            for name, value in sorted(operation_stats["counters"].items()):
+                per_call = (
+                    ""
+                    if n_calls == 0
+                    else " ({}/call)".format(
+                        self._format_value(name, value / n_calls)
+                    )
+                )
+                lines.append(
+                    f"    {name}: {self._format_value(name, value)}{per_call}"
+                )
+        for directory, counters in sorted(stats["replicas"].items()):
+            lines.append(f"Replica \"{directory}\":")
+            for name, value in sorted(counters.items()):
+                lines.append(f"    {name}: {self._format_value(name, value)}")
+        return "\n".join(lines)
+
+    @classmethod
+    def _add_counters(cls, dst: dict, src: dict):
+        for name, value in src.items():
+            dst[name] = dst.get(name, 0) + value
+
+    @classmethod
+    def _format_value(cls, name: str, value: int | float) -> str:
+        if name.endswith(cls.TIME_SUFFIX):
+            return f"{value * 1000:.3g} ms"
+        return f"{value:g}"
@@ -0,0 +1,136 @@
+from __future__ import annotations
+import dataclasses
+import threading
+import time
+from typing import Callable, Optional
+
+
+class OperationCancelledError(Exception):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class ProgressSnapshot:
+    stage: str
+    n_items_done: int
+    n_items_total: int
+    n_bytes_done: int
+    ## Seconds since the stage started
+    elapsed_time: float
+    counts: dict
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second in the current stage."""
+        if self.elapsed_time <= 0:
+            return 0.0
+        return self.n_bytes_done / self.elapsed_time
+
+    @property
+    def eta(self) -> float | None:
+        """
+        Seconds until the current stage is done, at the rate of the items
+        done so far. None before the first item is done.
+        """
+        if self.n_items_done == 0 or self.elapsed_time <= 0:
+            return None
+        n_items_left = max(0, self.n_items_total - self.n_items_done)
+        return n_items_left * self.elapsed_time / self.n_items_done
+
+    def describe(self) -> str:
+        text = f"{self.stage}: {self.n_items_done}/{self.n_items_total}"
+        if self.n_bytes_done > 0:
+            text += ", {:.1f} MiB at {:.1f} MiB/s".format(
+                self.n_bytes_done / 2**20, self.throughput / 2**20
+            )
+        eta = self.eta
+        if eta is not None and self.n_items_done < self.n_items_total:
+            text += f", ETA {eta:.0f} s"
+        if len(self.counts) > 0:
+            text += " ({})".format(
+                ", ".join(f"{name}: {n}" for name, n in self.counts.items())
+            )
+        return text
+
+
+class OperationProgress:
+    """
+    Shared by a long-running operation, which reports its progress and
+    checks for cancellation at safe points, and its caller, which may run
+    in another thread.
+
+    The operation runs through stages, such as opening the replicas, and
+    counts the items and bytes done in each stage. Named counts, such as
+    the number of files repaired, are kept across stages.
+
+    Every long-running operation of the handler stack and `PasswordVault`
+    accepts one as `progress`. A cancelled operation raises
+    `OperationCancelledError` at its next safe point, leaving the data as
+    it was before the operation, or in a state the next unlock recovers.
+    """
+
+    def __init__(self, callback: Optional[Callable] = None):
+        """
+        Parameters
+        ----
+        callback : Callable | None
+            Called with a `ProgressSnapshot` after every update, in the
+            thread of the operation.
+        """
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._is_cancelled = threading.Event()
+        self._stage = ""
+        self._stage_start_time = time.perf_counter()
+        self._n_items_done = 0
+        self._n_items_total = 0
+        self._n_bytes_done = 0
+        self._counts = {}
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._is_cancelled.is_set()
+
+    def cancel(self):
+        self._is_cancelled.set()
+
+    def check_cancelled(self):
+        if self._is_cancelled.is_set():
+            raise OperationCancelledError(
+                f"Operation is cancelled at stage \"{self._stage}\""
+            )
+
+    def start_stage(self, stage: str, n_items_total: int):
+        with self._lock:
+            self._stage = stage
+            self._stage_start_time = time.perf_counter()
+            self._n_items_done = 0
+            self._n_items_total = n_items_total
+            self._n_bytes_done = 0
+        self._notify()
+
+    def advance(self, n_items: int = 1, n_bytes: int = 0):
+        with self._lock:
+            self._n_items_done += n_items
+            self._n_bytes_done += n_bytes
+        self._notify()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+        self._notify()
+
+    def snapshot(self) -> ProgressSnapshot:
+        with self._lock:
+            return ProgressSnapshot(
+                stage=self._stage,
+                n_items_done=self._n_items_done,
+                n_items_total=self._n_items_total,
+                n_bytes_done=self._n_bytes_done,
+                elapsed_time=time.perf_counter() - self._stage_start_time,
+                counts=dict(self._counts),
+            )
+
+    def _notify(self):
+        if self._callback is not None:
+            self._callback(self.snapshot())
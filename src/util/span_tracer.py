@@ -0,0 +1,139 @@
+from __future__ import annotations
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Callable
+
+
+## Tracer of the process, or None if tracing is disabled
+_active_tracer = None
+
+
+class SpanTracer:
+    """
+    Record nested spans of time, and export them in the trace event format
+    of Chrome, which Perfetto (ui.perfetto.dev) and chrome://tracing show
+    as a timeline per thread.
+
+    Spans are nested by time within a thread, so a span recorded inside
+    another is shown under it. File names are never recorded as is, but as
+    a hash salted per tracer, so that a trace can be shared without
+    revealing the account names.
+    """
+
+    FILE_NAME_HASH_NUM_CHARS = 12
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._file_name_salt = secrets.token_bytes(16)
+        self._events = []
+        self._thread_ids = set()
+
+    def start(self):
+        """Record the spans of all `traced` functions, until `stop`."""
+        global _active_tracer
+        _active_tracer = self
+
+    def stop(self):
+        global _active_tracer
+        if _active_tracer is self:
+            _active_tracer = None
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        """
+        Record the block as a span.
+
+        Parameters
+        ----
+        name : str
+        **args
+            Shown with the span. A "file_name" is replaced by its hash.
+        """
+        if "file_name" in args:
+            args["file_name"] = self.hash_file_name(
+                file_name=args["file_name"]
+            )
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_span(
+                name=name,
+                start_time=start_time,
+                end_time=time.perf_counter(),
+                args=args,
+            )
+
+    def hash_file_name(self, file_name: str) -> str:
+        return hashlib.sha256(
+            self._file_name_salt + file_name.encode("utf-8")
+        ).hexdigest()[: self.FILE_NAME_HASH_NUM_CHARS]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            events = list(self._events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, file_path: str):
+        with open(file_path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    def _add_span(
+        self, name: str, start_time: float, end_time: float, args: dict
+    ):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start_time - self._start_time) * 1e6,
+            "dur": (end_time - start_time) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            if thread.ident not in self._thread_ids:
+                self._thread_ids.add(thread.ident)
+                self._events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self._events.append(event)
+
+
+def traced(function: Callable) -> Callable:
+    """
+    Record every call of a method as a span while a `SpanTracer` is started,
+    tagged with the directory of the handler and the hashed file name, if
+    any. When tracing is disabled, the only cost is a check of a global.
+    """
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        tracer = _active_tracer
+        if tracer is None:
+            return function(*args, **kwargs)
+        span_args = {}
+        directory = getattr(args[0], "_directory", None)
+        if isinstance(directory, str):
+            span_args["directory"] = directory
+        file_name = kwargs.get("file_name", None)
+        if isinstance(file_name, str):
+            span_args["file_name"] = file_name
+        with tracer.span(name, **span_args):
+            return function(*args, **kwargs)
+
+    return wrapper
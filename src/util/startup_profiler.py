@@ -0,0 +1,149 @@
+from __future__ import annotations
+import datetime
+import importlib.abc
+import json
+import sys
+import time
+
+
+class _TimedLoader:
+    """Delegate to a loader, timing the execution of the module."""
+
+    def __init__(self, loader, profiler: StartupProfiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._on_import_started()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._on_import_finished(module_name=module.__name__)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler: StartupProfiler):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(
+                    loader=spec.loader, profiler=self._profiler
+                )
+            return spec
+        return None
+
+
+class StartupProfiler:
+    """
+    Report where the startup time goes, like `python -X importtime`, but
+    also usable in the packaged app.
+
+    Every module imported after `install` is timed. Named events, such as
+    the first window being shown, are recorded by `mark`.
+    """
+
+    N_TOP_IMPORTS = 20
+
+    def __init__(self, start_time: float | None = None):
+        """
+        Parameters
+        ----
+        start_time : float | None
+            `time.perf_counter()` at process start. Defaults to now.
+        """
+        self._start_time = (
+            time.perf_counter() if start_time is None else start_time
+        )
+        self._finder = _TimingFinder(profiler=self)
+        ## Each frame is [start time, time spent in nested imports]
+        self._import_stack = []
+        ## Module name -> (self time, cumulative time), in seconds
+        self._imports = {}
+        self._events = {}
+
+    def install(self):
+        if self._finder not in sys.meta_path:
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def mark(self, event: str):
+        self._events.setdefault(event, time.perf_counter() - self._start_time)
+
+    def report(self, n_top_imports: int = N_TOP_IMPORTS) -> str:
+        lines = [
+            f"{event}: {elapsed_time * 1000:.1f} ms"
+            for event, elapsed_time in self._events.items()
+        ]
+        lines.append(
+            f"Imports: {len(self._imports)} modules, "
+            f"{self._get_total_import_time() * 1000:.1f} ms"
+        )
+        lines.append(f"{'self [ms]':>10} | {'cumulative [ms]':>15} | module")
+        for name, (self_time, cumulative_time) in self._get_top_imports(
+            n=n_top_imports
+        ):
+            lines.append(
+                f"{self_time * 1000:>10.1f} | {cumulative_time * 1000:>15.1f}"
+                f" | {name}"
+            )
+        return "\n".join(lines)
+
+    def save(self, file_path: str, n_top_imports: int = N_TOP_IMPORTS):
+        """Append the profile as one JSON line, to track it over time."""
+        record = {
+            "time": datetime.datetime.now(
+                tz=datetime.timezone.utc
+            ).isoformat(),
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "events_ms": {
+                event: round(elapsed_time * 1000, 3)
+                for event, elapsed_time in self._events.items()
+            },
+            "n_imports": len(self._imports),
+            "total_import_ms": round(self._get_total_import_time() * 1000, 3),
+            "top_imports_self_ms": {
+                name: round(self_time * 1000, 3)
+                for name, (self_time, _) in self._get_top_imports(
+                    n=n_top_imports
+                )
+            },
+        }
+        with open(file_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _get_total_import_time(self) -> float:
+        return sum(self_time for self_time, _ in self._imports.values())
+
+    def _get_top_imports(self, n: int) -> list:
+        return sorted(
+            self._imports.items(), key=lambda x: x[1][0], reverse=True
+        )[:n]
+
+    def _on_import_started(self):
+        self._import_stack.append([time.perf_counter(), 0.0])
+
+    def _on_import_finished(self, module_name: str):
+        start_time, nested_time = self._import_stack.pop()
+        cumulative_time = time.perf_counter() - start_time
+        self._imports[module_name] = (
+            cumulative_time - nested_time,
+            cumulative_time,
+        )
+        if len(self._import_stack) > 0:
+            self._import_stack[-1][1] += cumulative_time